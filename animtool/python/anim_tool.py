@@ -1,16 +1,28 @@
 import os
 import sys
+import shutil
 import threading
 import time
 import json
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 
 from common_arg import CommonArgTool, CommonArg
-from get_alpha_frame import GetAlphaFrame
+import frame_worker
+from build_manifest import BuildManifest
+from frame_dedup import FrameDedup
 from utils.log import TLog
+from utils.build_stats import BuildStats
+from utils.executor_util import ExecutorUtil
+from utils.ffprobe_util import FfprobeUtil
+from utils.mem_util import MemUtil
 from utils.process_util import ProcessUtil
+from utils.process_runner import EncodeProgress, ProcessRunner, TeePipe
 from utils.md5_util import Md5Util
 from mp4_box_tool import Mp4BoxTool
+from segment_plan import SegmentPlan
+from variant_matrix import VariantMatrix
 
 from PIL import Image
 
@@ -28,29 +40,122 @@ class AnimTool:
 
     def __init__(self):
         self.total_p = 0
+        self.encoded_p = 0
+        self.progress_total = 0
+        self.progress_stages = 1  # 2 when an encode follows the compositing
         self.start_time = 0
-        self.get_alpha_frame = GetAlphaFrame()
         self.tool_listener = None
         self.lock = threading.Lock()
+        self.executor = None
+        self.executor_workers = 0
+        self.encoder_limiter = None
+        self.md5 = None
+        self.stats = None  # BuildStats of the current create()
+        self.cancelled = False
+        self.processes = set()  # running process futures / pipes, stopped by cancel()
+        self.variant_encoded = {}  # variant build: output path -> frames encoded
+        self.variant_results = []  # variant build: one dict per variant, see VariantMatrix.save_report
 
     def set_tool_listener(self, listener):
         self.tool_listener = listener
 
+    def set_executor(self, executor, workers):
+        """
+        Use a shared frame executor (owned by the caller) instead of creating one per build.
+        """
+        self.executor = executor
+        self.executor_workers = workers
+
+    def set_encoder_limiter(self, limiter):
+        """
+        Semaphore shared between tools to cap the number of concurrent ffmpeg encodes.
+        """
+        self.encoder_limiter = limiter
+
+    @contextmanager
+    def encoder_slot(self):
+        if self.encoder_limiter is None:
+            yield
+            return
+        with self.encoder_limiter:
+            yield
+
+    def acquire_encoder_slots(self, count):
+        """
+        Wait for one encoder slot, then take up to count - 1 more if they are free right now.
+        Returns the number taken; give them back with release_encoder_slots.
+        """
+        if self.encoder_limiter is None:
+            return count
+        self.encoder_limiter.acquire()
+        slots = 1
+        while slots < count and self.encoder_limiter.acquire(blocking=False):
+            slots += 1
+        return slots
+
+    def release_encoder_slots(self, slots):
+        if self.encoder_limiter is None:
+            return
+        for _ in range(slots):
+            self.encoder_limiter.release()
+
+    def cancel(self):
+        """
+        Stop a running create() from another thread: no new frames are submitted and the
+        running ffmpeg/mp4edit is stopped, so create() fails soon after.
+        """
+        self.cancelled = True
+        with self.lock:
+            processes = list(self.processes)
+        for process in processes:
+            process.cancel()
+
+    def track_process(self, process, running):
+        with self.lock:
+            if running:
+                self.processes.add(process)
+            else:
+                self.processes.discard(process)
+        if running and self.cancelled:
+            process.cancel()
+
+    def run_process(self, common_arg, cmd, on_progress=None):
+        """
+        ProcessUtil.run that cancel() can stop, with the build's process timeout.
+        """
+        future = ProcessRunner.get_default().submit(cmd, on_progress, common_arg.process_timeout or None)
+        self.track_process(future, True)
+        try:
+            result = ProcessRunner.wait(future)
+        finally:
+            self.track_process(future, False)
+        return ProcessUtil.get_return_code(cmd, result)
+
     def create(self, common_arg, need_video):
+        self.stats = BuildStats()
+        success = False
+        try:
+            success = self.build(common_arg, need_video)
+        finally:
+            self.finish_stats(common_arg, success)
+        return success
+
+    def build(self, common_arg, need_video):
         TLog.i(self.TAG, "start create")
 
         # inputPath is already checked/formatted in CommonArgTool
         input_file = common_arg.input_path
+        self.progress_stages = 2 if need_video else 1
 
-        # TODO: Handle .webm logic if needed (ProcessUtil.run logic for webm parsing)
-        # Java: if (inputFile.getName().endsWith(".webm")) ...
-        # Assuming folder input for now based on typical usage.
-
-        if os.path.isfile(input_file):
+        if CommonArgTool.is_webm_stream(common_arg):
+            # frames are decoded while compositing, see iter_frames
+            pass
+        elif os.path.isfile(input_file):
             # check if it is webm
             if input_file.strip().endswith(".webm"):
                 # Handle WebM
-                success = self.split_video(common_arg)
+                with self.stage("split"):
+                    success = self.split_video(common_arg)
                 if success:
                     common_arg.input_path = os.path.join(
                         common_arg.output_path, self.FRAME_ORIGINAL_DIR
@@ -60,6 +165,20 @@ class AnimTool:
             else:
                 raise FileNotFoundError(f"not found frames dir: {input_file}")
 
+        if need_video and VariantMatrix.is_enabled(common_arg):
+            return self.create_variants(common_arg)
+
+        if need_video and common_arg.segments != 1 and common_arg.stream_frames:
+            TLog.w(self.TAG, "segments: --stream writes no frames/*.png to encode segments from, encoding as one")
+
+        # segments: all frames first, then the segment encoders run side by side on frames/*.png
+        if (common_arg.stream_frames or common_arg.pipeline) and need_video and not SegmentPlan.is_enabled(common_arg):
+            # ffmpeg encodes from stdin while the workers keep compositing ahead
+            success = self.create_all_frame_stream(common_arg)
+            if success and self.final_check(common_arg):
+                return self.finish_video(common_arg)
+            return False
+
         success = self.create_all_frame_image(common_arg)
         if success:
             if self.final_check(common_arg) and need_video:
@@ -68,17 +187,40 @@ class AnimTool:
         return False
 
     def check_common_arg(self, common_arg):
-        return CommonArgTool.auto_fill_and_check(common_arg, self.tool_listener)
+        with self.stage("check"):
+            ok = CommonArgTool.auto_fill_and_check(common_arg, self.tool_listener)
+        if ok and self.stats and common_arg.layout_plan:
+            self.stats.layout = common_arg.layout_plan.to_dict()
+        return ok
+
+    def stage(self, name):
+        # no stats when a step is called on its own, outside create()
+        return self.stats.stage(name) if self.stats else nullcontext()
+
+    def add_stage_bytes(self, name, read=0, written=0):
+        if self.stats:
+            self.stats.add_bytes(name, read, written)
+
+    def finish_stats(self, common_arg, success):
+        stats = self.stats.to_dict(bool(success))
+        TLog.i(self.TAG, f"stats: {BuildStats.get_summary(stats)}")
+        if common_arg.output_path and os.path.isdir(common_arg.output_path):
+            try:
+                BuildStats.save(common_arg.output_path, stats)
+            except Exception as e:
+                TLog.e(self.TAG, f"save build stats fail: {e}")
+        if self.tool_listener:
+            self.tool_listener.on_stats(stats)
 
     def final_check(self, common_arg):
-        # if common_arg.is_vapx:
-        #     if not common_arg.src_set.srcs:
-        #         TLog.i(self.TAG, "vapx error: src is empty")
-        #         return False
-        #     for src in common_arg.src_set.srcs:
-        #         if src.w <= 0 or src.h <= 0:
-        #             TLog.i(self.TAG, f"vapx error: src.id={src.src_id}, src.w={src.w}, src.h={src.h}")
-        #             return False
+        if common_arg.is_vapx:
+            if not common_arg.src_set.srcs:
+                TLog.i(self.TAG, "vapx error: src is empty")
+                return False
+            for src in common_arg.src_set.srcs:
+                if src.w <= 0 or src.h <= 0:
+                    TLog.i(self.TAG, f"vapx error: src.id={src.src_id}, src.w={src.w}, src.h={src.h}")
+                    return False
         return True
 
     def create_all_frame_image(self, common_arg):
@@ -92,154 +234,560 @@ class AnimTool:
 
         self.check_dir(common_arg.output_path)
         self.check_dir(common_arg.frame_output_path)
+        self.prepare_frame_cache(common_arg)
 
         self.total_p = 0
+        self.encoded_p = 0
+        self.progress_total = common_arg.total_frame
+        self.update_progress()
 
-        # Threading logic
-        # Java used manual thread creating.
-        # Python GIL limits CPU bound tasks, but let's use ThreadPoolExecutor for I/O + Pillow (which releases GIL often)
+        error_occurred = False
+        frame_hashes = {}
 
-        max_workers = 16
-        total_frame = common_arg.total_frame
+        for result in self.iter_frames(common_arg, True, False):
+            if not result.ok:
+                error_occurred = True
+                continue
+            frame_hashes[result.frame_index] = result.input_hash
+            self.update_progress(composited=self.total_p + 1)
+
+        if error_occurred:
+            if self.tool_listener:
+                self.tool_listener.on_error()
+            return False
+
+        self.save_frame_cache(common_arg, frame_hashes)
+
+        cost = (time.time() - self.start_time) * 1000
+        TLog.i(self.TAG, f"Finish cost={cost} ms, {MemUtil.peak_rss_msg()}")
 
         if self.tool_listener:
-            self.tool_listener.on_progress(0.0)
+            self.tool_listener.on_complete()
 
-        error_occurred = False
+        return True
+
+    def create_all_frame_stream(self, common_arg):
+        if not self.check_common_arg(common_arg):
+            if self.tool_listener:
+                self.tool_listener.on_error()
+            return False
 
-        def task(frame_index):
+        TLog.i(self.TAG, "createAllFrameStream")
+        self.start_time = time.time()
+
+        self.check_dir(common_arg.output_path)
+        # pipelined builds still produce frames/*.png, incremental builds use them as their cache
+        save_frames = not common_arg.stream_frames or common_arg.keep_frames or common_arg.incremental
+        if save_frames:
+            self.check_dir(common_arg.frame_output_path)
+        self.prepare_frame_cache(common_arg, save_frames)
+
+        output_file = self.get_video_output_file(common_arg)
+
+        self.total_p = 0
+        self.encoded_p = 0
+        self.progress_total = common_arg.total_frame
+        self.update_progress()
+
+        with self.encoder_slot(), self.stage("encode"):
+            TLog.i(self.TAG, "run createMp4 (stream)")
+            cmd = self.get_ffmpeg_stream_cmd(common_arg, output_file)
+            pipe = ProcessUtil.open_pipe(cmd, self.on_encode_progress, common_arg.process_timeout or None)
+            if not pipe:
+                if self.tool_listener:
+                    self.tool_listener.on_error()
+                return False
+
+            error_occurred = True
+            frame_hashes = {}
+            self.track_process(pipe, True)
             try:
-                self.create_frame(common_arg, frame_index)
-                with self.lock:
-                    self.total_p += 1
-                    progress = self.total_p / total_frame
-                    if self.tool_listener:
-                        self.tool_listener.on_progress(progress)
-                    else:
-                        # TLog.i(self.TAG, f"progress {progress}") # Reduce noise
-                        pass
-            except Exception as e:
-                TLog.e(self.TAG, f"createFrame error: {e}")
-                # In python, we can't easily break all threads, but we can set a flag
-                nonlocal error_occurred
-                error_occurred = True
+                error_occurred, frame_hashes = self.write_frames_to_pipe(common_arg, pipe, save_frames)
+            finally:
+                if error_occurred:
+                    pipe.abort()
+                else:
+                    pipe.close()
+                self.track_process(pipe, False)
+            # logs the tail of ffmpeg's stderr if it failed
+            result = ProcessUtil.get_return_code(cmd, pipe.result)
+            TLog.i(self.TAG, f"createMp4 result={'success' if result == 0 else 'fail'}")
+        if result == 0:
+            self.add_stage_bytes("encode", read=pipe.bytes_written, written=os.path.getsize(output_file))
+
+        if error_occurred or result != 0:
+            self.delete_file(common_arg)
+            if self.tool_listener:
+                self.tool_listener.on_error()
+            return False
+
+        if save_frames:
+            self.save_frame_cache(common_arg, frame_hashes)
+        self.update_progress(encoded=common_arg.total_frame)
+
+        cost = (time.time() - self.start_time) * 1000
+        TLog.i(self.TAG, f"Finish cost={cost} ms, {MemUtil.peak_rss_msg()}")
+
+        if self.tool_listener:
+            self.tool_listener.on_complete()
+
+        return True
+
+    def create_variants(self, common_arg):
+        """
+        Variant matrix build (see VariantMatrix): frames are composited once, every variant
+        gets video.mp4 (with its vapc box) and md5.txt in output_path/variants/<name>/.
+        As many variants as there are free encoder slots are encoded while compositing, all
+        fed from one TeePipe; the others are encoded from frames/*.png afterwards.
+        """
+        variants = VariantMatrix.create(common_arg)
+        if not variants or not self.check_common_arg(common_arg):
+            if self.tool_listener:
+                self.tool_listener.on_error()
+            return False
 
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all
-            futures = [executor.submit(task, i) for i in range(total_frame)]
+        TLog.i(self.TAG, f"createVariants: {', '.join(variant.name for variant in variants)}")
+        self.start_time = time.time()
+        if self.encoder_limiter is None:
+            # single build: its own limit, batch builds share the batch's
+            self.encoder_limiter = threading.BoundedSemaphore(common_arg.max_encoders or len(variants))
 
-            # Wait for all (context manager does this)
+        variant_args = [variant.create_common_arg(common_arg) for variant in variants]
+        self.check_dir(common_arg.output_path)
+        for variant_arg in variant_args:
+            self.check_dir(variant_arg.output_path)
+
+        self.total_p = 0
+        self.encoded_p = 0
+        self.variant_encoded = {}
+        self.progress_total = common_arg.total_frame
+        self.progress_stages = 1 + len(variants)
+        self.update_progress()
+
+        pipelined = (common_arg.pipeline or common_arg.stream_frames) and not SegmentPlan.is_enabled(common_arg)
+        slots = self.acquire_encoder_slots(len(variants)) if pipelined else 0
+        teed, rest = variant_args[:slots], variant_args[slots:]
+        # variants that are not teed are encoded from the frames
+        save_frames = not common_arg.stream_frames or common_arg.keep_frames or common_arg.incremental or bool(rest)
+        if save_frames:
+            self.check_dir(common_arg.frame_output_path)
+        self.prepare_frame_cache(common_arg, save_frames)
+
+        try:
+            with self.stage("encode"):
+                error_occurred, results = self.encode_teed(common_arg, teed, save_frames)
+        finally:
+            self.release_encoder_slots(slots)
 
         if error_occurred:
+            for variant_arg in variant_args:
+                self.delete_file(variant_arg)
             if self.tool_listener:
                 self.tool_listener.on_error()
             return False
 
+        if rest:
+            with ThreadPoolExecutor(max_workers=len(rest)) as encode_executor:
+                encoded = encode_executor.map(
+                    lambda variant_arg: self.create_mp4(
+                        variant_arg,
+                        self.get_video_output_file(variant_arg),
+                        common_arg.frame_output_path,
+                        self.get_variant_progress(variant_arg),
+                    ),
+                    rest,
+                )
+                results.extend(encoded)
+
+        self.variant_results = []
+        for variant, variant_arg, encoded in zip(variants, variant_args, results):
+            success = encoded and self.final_check(variant_arg) and self.finish_video(variant_arg)
+            if encoded:
+                self.set_variant_encoded(variant_arg, common_arg.total_frame)
+            else:
+                self.delete_file(variant_arg)
+            self.variant_results.append(VariantMatrix.get_result(variant, variant_arg, success, self.md5))
+
+        VariantMatrix.save_report(common_arg.output_path, self.variant_results)
+        failed = [result["name"] for result in self.variant_results if result["status"] != VariantMatrix.STATUS_OK]
         cost = (time.time() - self.start_time) * 1000
-        TLog.i(self.TAG, f"Finish cost={cost} ms")
+        TLog.i(self.TAG, f"variants: {len(variants) - len(failed)}/{len(variants)} ok, cost={cost} ms")
+        if failed:
+            TLog.e(self.TAG, f"failed variants: {', '.join(failed)}")
+            self.md5 = None
+            if self.tool_listener:
+                self.tool_listener.on_error()
+            return False
 
         if self.tool_listener:
             self.tool_listener.on_complete()
-
         return True
 
-    def create_frame(self, common_arg, frame_index):
-        input_file_path = os.path.join(common_arg.input_path, f"{frame_index:03d}.png")
-        input_file = None
-        if os.path.exists(input_file_path):
-            # We pass path as pathlib.Path or just use it?
-            # GetAlphaFrame expects string or Path object?
-            # My python port expects Path mostly or string.
-            # but Java pass File.
-            # I should pass Path object to be consistent if I used pathlib, but I used os.path.
-            # Let's pass Path object for better API.
-            from pathlib import Path
-
-            input_file = Path(input_file_path)
-
-        video_frame = self.get_alpha_frame.create_frame(common_arg, input_file)
-
-        # if common_arg.is_vapx:
-        #      # getFrameObj takes PIL image as output_argb arg?
-        #      # My previous decision was interface.
-        #      # get_mask_frame.get_frame_obj_pil(index, arg, image)
-        #      frame_obj = self.get_mask_frame.get_frame_obj_pil(frame_index, common_arg, video_frame.image)
-        #      if frame_obj:
-        #          # Need thread safety for list append?
-        #          # frame_set.frameObjs is a list.
-        #          # Python lists are thread-safe for append (atomic), but logic might get interleaved?
-        #          # Handled by lock or just use list.
-        #          with self.lock:
-        #              common_arg.frame_set.frame_objs.append(frame_obj)
-
-        if not video_frame:
-            TLog.i(self.TAG, f"frameIndex={frame_index} is empty")
+    def encode_teed(self, common_arg, variant_args, save_frames):
+        """
+        Composite all frames once and pipe them into one encoder per variant_arg.
+        Returns (error_occurred, [encoded ok per variant_arg]); error_occurred means the frames failed
+        (or every encoder died), a single failed encoder only fails its own variant.
+        """
+        pipes = []
+        for variant_arg in variant_args:
+            cmd = self.get_ffmpeg_stream_cmd(variant_arg, self.get_video_output_file(variant_arg))
+            pipe = ProcessUtil.open_pipe(cmd, self.get_variant_progress(variant_arg), common_arg.process_timeout or None)
+            if pipe:
+                self.track_process(pipe, True)
+            pipes.append((cmd, pipe))
+
+        alive = [pipe for _, pipe in pipes if pipe]
+        if variant_args and not alive:
+            return True, []
+
+        error_occurred = True
+        frame_hashes = {}
+        try:
+            error_occurred, frame_hashes = self.write_frames_to_pipe(
+                common_arg, TeePipe(alive) if alive else None, save_frames
+            )
+        finally:
+            for pipe in alive:
+                if error_occurred:
+                    pipe.abort()
+                else:
+                    pipe.close()
+                self.track_process(pipe, False)
+
+        results = []
+        for (cmd, pipe), variant_arg in zip(pipes, variant_args):
+            success = pipe is not None and ProcessUtil.get_return_code(cmd, pipe.result) == 0
+            if success:
+                output_file = self.get_video_output_file(variant_arg)
+                self.add_stage_bytes("encode", read=pipe.bytes_written, written=os.path.getsize(output_file))
+            results.append(success)
+
+        if not error_occurred and save_frames:
+            self.save_frame_cache(common_arg, frame_hashes)
+        return error_occurred, results
+
+    def write_frames_to_pipe(self, common_arg, pipe, save_frames):
+        """
+        Feed every frame, in order, into the encoder pipe. Returns (error_occurred, frame_hashes).
+        """
+        error_occurred = False
+        frame_hashes = {}
+        # no pipe: only composite (and save) the frames
+        frames = self.iter_frames(common_arg, save_frames, pipe is not None)
+        try:
+            for result in frames:
+                if not result.ok:
+                    TLog.e(self.TAG, f"frameIndex={result.frame_index} is empty")
+                    error_occurred = True
+                elif pipe is not None and not pipe.write(result.data):
+                    error_occurred = True
+
+                if error_occurred:
+                    break
+
+                frame_hashes[result.frame_index] = result.input_hash
+                self.update_progress(composited=self.total_p + 1)
+        finally:
+            # stops submitting and cancels what is still queued
+            frames.close()
+
+        return error_occurred, frame_hashes
+
+    def on_encode_progress(self, progress):
+        # runs on the ProcessRunner loop thread
+        self.update_progress(encoded=progress.frame)
+        if self.tool_listener:
+            self.tool_listener.on_encode_progress(progress)
+
+    def get_variant_progress(self, variant_arg):
+        # variant build: encoded is the sum over all variants, progress_stages counts them
+        def on_progress(progress):
+            self.set_variant_encoded(variant_arg, progress.frame)
+        return on_progress
+
+    def set_variant_encoded(self, variant_arg, frame_count):
+        with self.lock:
+            self.variant_encoded[variant_arg.output_path] = frame_count
+            self.encoded_p = sum(min(n, self.total_p) for n in self.variant_encoded.values())
+        self.update_progress()
+
+    def update_progress(self, composited=None, encoded=None):
+        """
+        Progress covers compositing and, when a video is built, encoding:
+        (composited + encoded) / (2 * total frames).
+        Called from the frame loop and from the encoder's progress callback.
+        """
+        with self.lock:
+            if composited is not None:
+                self.total_p = composited
+            if encoded is not None:
+                # the encoder can not be ahead of what it was fed
+                self.encoded_p = max(self.encoded_p, min(encoded, self.total_p))
+            if self.tool_listener and self.progress_total:
+                self.tool_listener.on_progress(
+                    (self.total_p + self.encoded_p) / (self.progress_stages * self.progress_total)
+                )
+
+    def prepare_frame_cache(self, common_arg, save_frames=True):
+        common_arg.frame_cache = {}
+        if common_arg.incremental:
+            common_arg.frame_cache = BuildManifest.load(common_arg)
+        if not save_frames:
+            return
+        # frames/*.png is about to change, incremental or not; save_frame_cache writes it again
+        BuildManifest.invalidate(common_arg)
+        if common_arg.incremental:
+            BuildManifest.remove_stale_frames(common_arg)
+            TLog.i(self.TAG, f"incremental: {len(common_arg.frame_cache)} frames in cache")
+
+    def save_frame_cache(self, common_arg, frame_hashes):
+        if not common_arg.incremental:
             return
+        skipped = sum(1 for i, h in frame_hashes.items() if common_arg.frame_cache.get(i) == h)
+        TLog.i(self.TAG, f"incremental: {skipped}/{common_arg.total_frame} frames unchanged")
+        BuildManifest.save(common_arg, frame_hashes)
+
+    def iter_frames(self, common_arg, save_frames, return_data):
+        """
+        Composite all frames on the configured executor and yield a FrameResult per frame, in frame order.
+
+        Frames are sent to workers in contiguous chunks so per-task overhead (pickling, IPC)
+        is paid per chunk, not per frame. The deque of in-flight chunks is the reorder buffer:
+        it holds at most stream_buffer frames (chunks shrink to fit), so workers can run ahead
+        of the consumer without holding the whole animation in memory.
+        """
+        total_frame = common_arg.total_frame
+        workers = self.executor_workers or ExecutorUtil.resolve_workers(common_arg.workers)
+        stream_buffer = max(1, common_arg.stream_buffer)
+        chunk_size = ExecutorUtil.chunk_size(total_frame, workers, common_arg.chunk_size)
+        # a small buffer gets smaller chunks, so every worker still has one
+        chunk_size = max(1, min(chunk_size, stream_buffer // workers))
+        max_chunks = max(1, stream_buffer // chunk_size)
+
+        # webm_stream: one ffmpeg decodes in frame order, the frames travel with their chunk
+        decoder = None
+        frame_size = common_arg.rgb_point.w * common_arg.rgb_point.h * 4
+        if CommonArgTool.is_webm_stream(common_arg):
+            decoder = ProcessUtil.open_reader(self.get_ffmpeg_decode_cmd(common_arg))
+            if decoder is None:
+                yield from (frame_worker.FrameResult(frame_index, False) for frame_index in range(total_frame))
+                return
+
+        # dedup: repeated frames are composited once, see FrameDedup
+        dedup = None
+        if common_arg.dedup:
+            dedup = FrameDedup(common_arg, return_data)
+            if not decoder:
+                with self.stage("dedup_scan"):
+                    dedup.scan_files()
+
+        job_id = f"{os.getpid()}-{id(common_arg)}-{time.time()}"
+        if self.executor:
+            # shared pool (batch builds): its workers were not initialized for this job,
+            # so the CommonArg travels with each chunk and is cached per worker; a process
+            # pool gets it without the per frame fields, each chunk brings its own
+            executor = self.executor
+            task_arg = common_arg
+            if ExecutorUtil.is_process(executor):
+                task_arg = frame_worker.get_task_arg(common_arg)
+        else:
+            # CommonArg goes to each worker once, tasks only carry frame indices
+            executor = ExecutorUtil.create(
+                common_arg.executor, workers, frame_worker.init_worker, (job_id, common_arg)
+            )
+            task_arg = None
 
-        # Save image
-        output_file_path = os.path.join(
-            common_arg.frame_output_path, f"{frame_index:03d}.png"
-        )
-        video_frame.image.save(output_file_path, "PNG")
+        # the consumer runs between yields, so in pipelined builds this includes feeding ffmpeg
+        with self.stage("frames"):
+            pending = deque()
+            next_index = 0
+            try:
+                while next_index < total_frame or pending:
+                    if self.cancelled:
+                        TLog.e(self.TAG, "cancelled")
+                        yield frame_worker.FrameResult(next_index, False)
+                        return
+                    while next_index < total_frame and len(pending) < max_chunks:
+                        frame_indices = range(next_index, min(next_index + chunk_size, total_frame))
+                        frames = self.read_frames(decoder, frame_size, len(frame_indices)) if decoder else None
+                        todo = frame_indices
+                        if dedup:
+                            todo, frames = dedup.add_chunk(frame_indices, frames)
+                        future = None
+                        if todo:
+                            inputs = None
+                            if task_arg is not None and task_arg is not common_arg:
+                                inputs = frame_worker.get_task_inputs(common_arg, todo)
+                            future = executor.submit(
+                                frame_worker.run_frame_batch, job_id, todo, save_frames, return_data, task_arg, frames,
+                                inputs
+                            )
+                        pending.append((frame_indices, todo, future))
+                        next_index = frame_indices.stop
+
+                    frame_indices, todo, future = pending.popleft()
+                    try:
+                        results = future.result() if future else []
+                    except Exception as e:
+                        # e.g. a worker process died
+                        TLog.e(self.TAG, f"createFrame error: {e}")
+                        results = [frame_worker.FrameResult(frame_index, False) for frame_index in todo]
+                    if dedup:
+                        results = dedup.merge(frame_indices, results, save_frames)
+
+                    for result in results:
+                        if result.stats and self.stats:
+                            self.stats.add_frame(result.stats)
+                        if result.frame_obj:
+                            # in frame order, so the json and src w/h do not depend on the worker timing
+                            common_arg.frame_set.frame_objs.append(result.frame_obj)
+                            common_arg.src_set.update_size(result.frame_obj)
+                        yield result
+            finally:
+                for _, _, future in pending:
+                    if future:
+                        future.cancel()
+                if executor is not self.executor:
+                    executor.shutdown(wait=True)
+                frame_worker.release_job(job_id)
+                if decoder:
+                    self.close_decoder(decoder, next_index < total_frame)
+                if dedup:
+                    self.report_dedup(dedup)
+
+    def report_dedup(self, dedup):
+        dedup_stats = dedup.to_dict()
+        TLog.i(self.TAG, f"dedup: {dedup_stats['frames']} frames reused "
+                         f"({dedup_stats['file_hash']} by file hash, {dedup_stats['pixel_hash']} by pixel hash), "
+                         f"saved ~{dedup_stats['saved_ms']:.0f} ms")
+        if self.stats:
+            self.stats.dedup = dedup_stats
+
+    def read_frames(self, decoder, frame_size, count):
+        """
+        The next count RGBA frames from the webm decoder, None for frames it did not deliver.
+        """
+        ended = decoder.ended
+        with self.stage("decode"):
+            frames = [decoder.read(frame_size) for _ in range(count)]
+        self.add_stage_bytes("decode", read=sum(len(frame) for frame in frames if frame is not None))
+        if decoder.ended and not ended:
+            TLog.e(self.TAG, "webm decoder ended before the probed frame count")
+        return frames
+
+    def close_decoder(self, decoder, stopped_early):
+        # stopped early: the rest of the decode is not needed
+        result = decoder.abort() if stopped_early else decoder.close()
+        if not stopped_early and result != 0:
+            TLog.e(self.TAG, f"webm decoder exited with {result}")
 
     def check_dir(self, path):
         if not os.path.exists(path):
             os.makedirs(path)
 
+    def get_video_output_file(self, common_arg):
+        if common_arg.mp4edit_cmd or common_arg.native_vapc:
+            return os.path.join(common_arg.output_path, self.TEMP_VIDEO_FILE)
+        return os.path.join(common_arg.output_path, self.VIDEO_FILE)
+
     def create_video(self, common_arg):
         try:
-            if common_arg.mp4edit_cmd:
-                output_file = os.path.join(common_arg.output_path, self.TEMP_VIDEO_FILE)
-            else:
-                output_file = os.path.join(common_arg.output_path, self.VIDEO_FILE)
+            output_file = self.get_video_output_file(common_arg)
+            self.encoded_p = 0
             result = self.create_mp4(
                 common_arg, output_file, common_arg.frame_output_path
             )
-            if not result:
+            if result:
+                self.update_progress(encoded=common_arg.total_frame)
+            else:
                 TLog.i(self.TAG, "createMp4 fail")
                 self.delete_file(common_arg)
                 return False
+        except Exception as e:
+            TLog.e(self.TAG, f"createVideo error: {e}")
+            return False
 
+        return self.finish_video(common_arg)
+
+    def finish_video(self, common_arg):
+        """audio merge, vapc box and md5 for an already encoded video"""
+        try:
+            algorithms = ("md5", "sha256") if common_arg.sha256 else ("md5",)
+            digests = None
             temp_video_name = self.TEMP_VIDEO_FILE
             if common_arg.need_audio:
-                result = self.merge_audio_2_mp4(common_arg, temp_video_name)
+                with self.stage("audio"):
+                    result = self.merge_audio_2_mp4(common_arg, temp_video_name)
                 if not result:
                     TLog.i(self.TAG, "mergeAudio2Mp4 fail")
                     self.delete_file(common_arg)
                     return False
                 temp_video_name = self.TEMP_VIDEO_AUDIO_FILE
 
-            if common_arg.mp4edit_cmd:
-                self.create_vapc_json(common_arg)
-                # Json to Bin
-                input_json = os.path.join(common_arg.output_path, self.VAPC_JSON_FILE)
-                mp4_box_tool = Mp4BoxTool()
-                vapc_bin_path = mp4_box_tool.create(input_json, common_arg.output_path)
-                # Merge Bin
-                result = self.merge_bin_2_mp4(
-                    common_arg,
-                    self.VAPC_BIN_FILE,
-                    temp_video_name,
-                    common_arg.output_path,
-                )
+            if common_arg.native_vapc or common_arg.mp4edit_cmd:
+                with self.stage("vapc"):
+                    result, digests = self.write_vapc(common_arg, temp_video_name, algorithms)
                 if not result:
-                    TLog.i(self.TAG, "mergeBin2Mp4 fail")
                     self.delete_file(common_arg)
                     return False
 
             self.delete_file(common_arg)
 
-            # MD5
+            # MD5 (+ sha256)
             final_video = os.path.join(common_arg.output_path, self.VIDEO_FILE)
-            md5_util = Md5Util()
-            md5 = md5_util.get_file_md5(final_video, common_arg.output_path)
+            with self.stage("md5"):
+                if digests is None:
+                    digests = Md5Util.get_file_hashes(final_video, algorithms) or {}
+                    if digests:
+                        self.add_stage_bytes("md5", read=os.path.getsize(final_video))
+                for algorithm, digest in digests.items():
+                    Md5Util.write_hash_file(common_arg.output_path, algorithm, digest)
+            md5 = digests.get("md5")
             TLog.i(self.TAG, f"md5={md5}")
+            if common_arg.sha256:
+                TLog.i(self.TAG, f"sha256={digests.get('sha256')}")
+            self.md5 = md5
 
             return True
         except Exception as e:
             TLog.e(self.TAG, f"createVideo error: {e}")
             return False
 
+    def write_vapc(self, common_arg, temp_video_name, algorithms):
+        """
+        Put the vapc box into the video and move it to video.mp4. Returns (success, digests),
+        digests is None when the video still has to be hashed.
+        """
+        if common_arg.native_vapc:
+            vapc_json = self.create_vapc_json(common_arg)
+            temp_video = os.path.join(common_arg.output_path, temp_video_name)
+            mp4_box_tool = Mp4BoxTool()
+            # hashed while the box goes in, no second read of the video for md5.txt
+            result = mp4_box_tool.insert_vapc(temp_video, vapc_json.encode("utf-8"), algorithms=algorithms)
+            if not result:
+                TLog.i(self.TAG, "insertVapc fail")
+                return False, None
+            os.replace(temp_video, os.path.join(common_arg.output_path, self.VIDEO_FILE))
+            return True, mp4_box_tool.digests
+
+        self.create_vapc_json(common_arg)
+        # Json to Bin
+        input_json = os.path.join(common_arg.output_path, self.VAPC_JSON_FILE)
+        mp4_box_tool = Mp4BoxTool()
+        vapc_bin_path = mp4_box_tool.create(input_json, common_arg.output_path)
+        # Merge Bin
+        result = self.merge_bin_2_mp4(
+            common_arg,
+            self.VAPC_BIN_FILE,
+            temp_video_name,
+            common_arg.output_path,
+        )
+        if not result:
+            TLog.i(self.TAG, "mergeBin2Mp4 fail")
+            return False, None
+        return True, None
+
     def delete_file(self, common_arg):
         for f in [self.TEMP_VIDEO_FILE, self.TEMP_VIDEO_AUDIO_FILE, self.VAPC_BIN_FILE]:
             p = os.path.join(common_arg.output_path, f)
@@ -270,47 +818,22 @@ class AnimTool:
             "isVapx": 1 if common_arg.is_vapx else 0,
             "orien": 0,
         }
-
-        # We need to construct the JSON carefully to match existing format if needed,
-        # but standardized JSON is better.
-        # The Java code manually string-builds partial JSONs then combines them.
-
-        # However, we converted FrameSet and SrcSet to have __str__ methods that return partial JSON strings.
-        # Actually, let's just build the dict and dump it if we can trust the structure.
-        # Java: { "info": { ... }, "src": [...], "frame": [...] }
-        # Note: Java's SrcSet.toString() returns '"src":[...]' (key included).
-
-        # Proper Pythonic way:
-        final_dict = {"info": info}
-        if common_arg.is_vapx:
-            pass
-            # SrcSet.to_dict() returns {"src": [...]}
-            # final_dict.update(common_arg.src_set.to_dict())
-            # FrameSet.to_dict() ? I didn't implement to_dict for FrameSet fully, only __str__.
-            # I should probably use the __str__ method or implement to_dict.
-            # Let's rely on JSON dump of a constructed dict.
-            # Since I didn't implement to_dict for FrameSet, I'll rely on string manipulation
-            # OR strictly implement to_dict in FrameSet now?
-            # I can't modify FrameSet file easily right now without another call.
-            # I'll construct the string manually to ensure compatibility with my previous steps.
-            # pass
-
-        info_json = json.dumps(info, separators=(",", ":"))
-        # remove curlies to embed? No, info is a key.
-        # Wrapper: { "info": ... , ... }
-
-        # Java: "info":{...}
-        # Then sb.append("{"); sb.append(json); ...
-
-        # If I want to use the __str__ from SrcSet/FrameSet which outputs '"src":[...]'
-
-        parts = []
-        parts.append(f'"info":{info_json}')
-
+        if common_arg.trim_rect:
+            # where the trimmed rgb area sits in the original canvas, for positioning the animation
+            info["trimFrame"] = [
+                common_arg.trim_rect.x,
+                common_arg.trim_rect.y,
+                common_arg.trim_rect.w,
+                common_arg.trim_rect.h,
+            ]
+            info["canvasW"] = common_arg.canvas_w
+            info["canvasH"] = common_arg.canvas_h
+
+        # same string as the Java tool: "src"/"frame" come with their key from SrcSet/FrameSet.__str__
+        parts = [f'"info":{json.dumps(info, separators=(",", ":"))}']
         if common_arg.is_vapx:
-            pass
-            # parts.append(str(common_arg.src_set))
-            # parts.append(str(common_arg.frame_set))
+            parts.append(str(common_arg.src_set))
+            parts.append(str(common_arg.frame_set))
 
         final_json_str = "{" + ",".join(parts) + "}"
 
@@ -319,10 +842,12 @@ class AnimTool:
         with open(os.path.join(common_arg.output_path, self.VAPC_JSON_FILE), "w") as f:
             f.write(final_json_str)
 
+        return final_json_str
+
     def split_video(self, common_arg):
         TLog.i(self.TAG, "run splitVideo")
         cmd = self.get_ffmpeg_split_cmd(common_arg)
-        result = ProcessUtil.run(cmd)
+        result = self.run_process(common_arg, cmd)
         TLog.i(self.TAG, f"splitVideo result={'success' if result == 0 else 'fail'}")
         return result == 0
 
@@ -345,22 +870,169 @@ class AnimTool:
         ]
         return cmd
 
-    def create_mp4(self, common_arg, output_file, frame_image_path):
+    def get_ffmpeg_decode_cmd(self, common_arg):
+        # rgba frames to stdout; libvpx decoders keep the alpha plane of the webm
+        decoder = FfprobeUtil.ALPHA_DECODERS.get(common_arg.webm_codec)
+        cmd = [common_arg.ffmpeg_cmd, "-nostdin", "-v", "error"]
+        if decoder:
+            cmd += ["-c:v", decoder]
+        cmd += ["-i", common_arg.input_path]
+        trim_rect = common_arg.trim_rect
+        if trim_rect:
+            # trim: ffmpeg crops, the frames arrive with the trimmed size
+            cmd += ["-vf", f"crop={trim_rect.w}:{trim_rect.h}:{trim_rect.x}:{trim_rect.y}"]
+        cmd += [
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgba",
+            "-",
+        ]
+        return cmd
+
+    def create_mp4(self, common_arg, output_file, frame_image_path, on_progress=None):
+        segments = SegmentPlan.create(common_arg) if SegmentPlan.is_enabled(common_arg) else None
+        if segments:
+            return self.create_mp4_segments(common_arg, output_file, frame_image_path, segments, on_progress)
+
         TLog.i(self.TAG, "run createMp4")
         cmd = self.get_ffmpeg_cmd(common_arg, output_file, frame_image_path)
-        result = ProcessUtil.run(cmd)
+        with self.encoder_slot(), self.stage("encode"):
+            result = self.run_process(common_arg, cmd, on_progress or self.on_encode_progress)
         TLog.i(self.TAG, f"createMp4 result={'success' if result == 0 else 'fail'}")
+        if result == 0:
+            self.add_stage_bytes("encode", written=os.path.getsize(output_file))
         return result == 0
 
-    def get_ffmpeg_cmd(self, common_arg, output_file, frame_image_path):
+    def create_mp4_segments(self, common_arg, output_file, frame_image_path, segments, on_progress=None):
+        """
+        One ffmpeg per segment, all started at once on the ProcessRunner loop, then joined with the
+        concat demuxer (stream copy). Each segment starts with a key frame and is encoded with the
+        same settings and size, so the joined stream has one set of parameter sets and decodes
+        like a single encode.
+        """
+        on_progress = on_progress or self.on_encode_progress
+        TLog.i(self.TAG, f"run createMp4 ({len(segments)} segments: "
+                         f"{', '.join(f'{segment.start}-{segment.end - 1}' for segment in segments)})")
+        segment_dir = os.path.join(common_arg.output_path, SegmentPlan.SEGMENTS_DIR)
+        self.check_dir(segment_dir)
+
+        encoded = {}
+
+        def get_progress(segment):
+            # all segments report on the loop thread, encoded needs no lock
+            def on_segment_progress(progress):
+                encoded[segment.index] = progress.frame
+                on_progress(EncodeProgress(frame=sum(encoded.values())))
+            return on_segment_progress
+
+        try:
+            runner = ProcessRunner.get_default()
+            with self.encoder_slot(), self.stage("encode"):
+                futures = []
+                for segment in segments:
+                    segment.output_file = os.path.join(segment_dir, f"{segment.index:03d}.mp4")
+                    cmd = self.get_ffmpeg_cmd(common_arg, segment.output_file, frame_image_path, segment)
+                    future = runner.submit(cmd, get_progress(segment), common_arg.process_timeout or None)
+                    self.track_process(future, True)
+                    futures.append((cmd, future))
+
+                failed = False
+                for cmd, future in futures:
+                    try:
+                        result = ProcessRunner.wait(future)
+                    finally:
+                        self.track_process(future, False)
+                    if failed:
+                        # stopped, or failed like the first one, which is logged
+                        continue
+                    if ProcessUtil.get_return_code(cmd, result) != 0:
+                        failed = True
+                        # the video fails anyway, stop the other segments
+                        for _, other in futures:
+                            other.cancel()
+            if failed:
+                TLog.i(self.TAG, "createMp4 result=fail")
+                return False
+
+            with self.stage("concat"):
+                success = self.concat_segments(common_arg, segments, segment_dir, output_file)
+            TLog.i(self.TAG, f"createMp4 result={'success' if success else 'fail'}")
+            if success:
+                self.add_stage_bytes("encode", written=os.path.getsize(output_file))
+            return success
+        finally:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+
+    def concat_segments(self, common_arg, segments, segment_dir, output_file):
+        concat_file = os.path.join(segment_dir, SegmentPlan.CONCAT_FILE)
+        with open(concat_file, "w") as f:
+            for segment in segments:
+                path = os.path.abspath(segment.output_file).replace("'", "'\\''")
+                f.write(f"file '{path}'\n")
+
+        cmd = [common_arg.ffmpeg_cmd, "-f", "concat", "-safe", "0", "-i", concat_file, "-c", "copy"]
+        if common_arg.enable_h265:
+            cmd.extend(["-tag:v", "hvc1"])
+        cmd.extend(["-y", output_file])
+        if self.run_process(common_arg, cmd) != 0:
+            return False
+
+        # a lost segment would still give a playable, shorter video
+        video_info = FfprobeUtil.probe_video(FfprobeUtil.get_ffprobe_cmd(common_arg), output_file)
+        if video_info is None:
+            TLog.w(self.TAG, "segments: can not probe the joined video, frame count not checked")
+        elif video_info.frames != segments[-1].end:
+            TLog.e(self.TAG, f"segments: joined video has {video_info.frames} frames, expected {segments[-1].end}")
+            return False
+        return True
+
+    def get_ffmpeg_cmd(self, common_arg, output_file, frame_image_path, segment=None):
         input_pattern = os.path.join(frame_image_path, "%03d.png")
 
         cmd = [
             common_arg.ffmpeg_cmd,
+            # frame/fps/speed on stdout, for progress
+            "-nostats",
+            "-progress",
+            "pipe:1",
+            "-framerate",
+            str(common_arg.fps),
+        ]
+        if segment:
+            cmd.extend(["-start_number", str(segment.start)])
+        cmd.extend(["-i", input_pattern])
+        if segment:
+            cmd.extend(["-frames:v", str(segment.frames)])
+            cmd.extend(self.get_ffmpeg_encode_args(common_arg, output_file, segment.force_key_frames))
+        else:
+            cmd.extend(self.get_ffmpeg_encode_args(common_arg, output_file))
+        return cmd
+
+    def get_ffmpeg_stream_cmd(self, common_arg, output_file):
+        # raw frames (RGBA, or I420 in yuv mode) in output order on stdin, same encoder settings as get_ffmpeg_cmd
+        cmd = [
+            common_arg.ffmpeg_cmd,
+            # encoded frame count on stdout, for progress
+            "-nostats",
+            "-progress",
+            "pipe:1",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "yuv420p" if common_arg.yuv_output else "rgba",
+            "-s",
+            f"{common_arg.output_w}x{common_arg.output_h}",
             "-framerate",
             str(common_arg.fps),
             "-i",
-            input_pattern,
+            "-",
+        ]
+        cmd.extend(self.get_ffmpeg_encode_args(common_arg, output_file))
+        return cmd
+
+    def get_ffmpeg_encode_args(self, common_arg, output_file, force_key_frames=None):
+        cmd = [
             "-pix_fmt",
             "yuv420p",
         ]
@@ -377,7 +1049,7 @@ class AnimTool:
         else:
             cmd.extend(["-b:v", f"{common_arg.bitrate}k"])
 
-        cmd.extend(["-force_key_frames", common_arg.force_key_frames])
+        cmd.extend(["-force_key_frames", force_key_frames or common_arg.force_key_frames])
         cmd.extend(["-profile:v", "main"])
         cmd.extend(["-level", "4.0"])
         cmd.extend(["-bufsize", "2000k"])
@@ -405,7 +1077,7 @@ class AnimTool:
         ]
 
         TLog.i(self.TAG, "run mergeAudio2Mp4")
-        result = ProcessUtil.run(cmd)
+        result = self.run_process(common_arg, cmd)
         TLog.i(
             self.TAG, f"mergeAudio2Mp4 result={'success' if result == 0 else 'fail'}"
         )
@@ -460,7 +1132,7 @@ class AnimTool:
         ]
 
         TLog.i(self.TAG, "run mergeBin2Mp4")
-        result = ProcessUtil.run(cmd)
+        result = self.run_process(common_arg, cmd)
         TLog.i(self.TAG, f"mergeBin2Mp4 result={'success' if result == 0 else 'fail'}")
         return result == 0
 
@@ -477,3 +1149,11 @@ class IToolListener:
 
     def on_complete(self):
         pass
+
+    def on_stats(self, stats):
+        # build_stats.json content, called once at the end of create() (also when it failed)
+        pass
+
+    def on_encode_progress(self, progress):
+        # EncodeProgress (frame, fps, speed ...) parsed from ffmpeg, called from the ProcessRunner thread
+        pass
@@ -0,0 +1,290 @@
+import os
+import csv
+import copy
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import frame_worker
+from anim_tool import AnimTool, IToolListener
+from utils.log import TLog
+from utils.executor_util import ExecutorUtil
+
+
+class BatchItem:
+    def __init__(self, name, input_path, output_path="", overrides=None):
+        self.name = name
+        self.input_path = input_path
+        self.output_path = output_path
+        self.overrides = overrides or {}
+
+
+class BatchToolListener(IToolListener):
+    """
+    Collects what happens to one item, never exits the process.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.warnings = []
+        self.error = False
+        self.stats = None
+
+    def on_progress(self, progress):
+        pass
+
+    def on_warning(self, msg):
+        self.warnings.append(msg)
+        TLog.w(BatchTool.TAG, f"[{self.name}] {msg}")
+
+    def on_error(self):
+        self.error = True
+
+    def on_complete(self):
+        pass
+
+    def on_stats(self, stats):
+        self.stats = stats
+
+
+class BatchTool:
+    """
+    Builds many animations in one process. All items share one frame executor, so the
+    compositing concurrency is the worker count no matter how many items run at once,
+    and a semaphore caps the ffmpeg encodes running at the same time. The encodes
+    themselves all run on the one ProcessRunner event loop.
+
+    Manifest, JSON:
+        [{"input": "a/", "output": "out/a", "fps": 30}, ...]
+        or {"defaults": {"enable_h265": false}, "items": [...]}
+    or CSV with a header row: input,output,name and any override column.
+    Overrides are CommonArg field names, e.g. fps, bitrate, enable_crf, crf, scale.
+    """
+    TAG = "BatchTool"
+    REPORT_FILE = "batch_report.json"
+
+    # CommonArg fields an item may set, anything derived by CommonArgTool is left out
+    OVERRIDE_FIELDS = (
+        "ffmpeg_cmd", "ffprobe_cmd", "mp4edit_cmd", "native_vapc", "enable_h265", "fps", "force_key_frames", "scale",
+        "enable_crf", "bitrate", "crf", "pipeline", "stream_frames", "keep_frames", "stream_buffer",
+        "compositor", "yuv_output", "chunk_size", "incremental", "dedup", "trim", "opaque",
+        "optimize_layout", "max_size", "segments", "need_audio", "audio_path", "sha256", "webm_stream", "process_timeout",
+        "variant_codecs", "variant_rates", "variant_fps",
+    )
+
+    STATUS_OK = "ok"
+    STATUS_FAILED = "failed"
+
+    def __init__(self, defaults, jobs=2, encoders=0):
+        """
+        defaults: CommonArg every item starts from; its executor/workers size the shared pool.
+        """
+        self.defaults = defaults
+        self.jobs = max(1, jobs)
+        self.encoders = encoders if encoders and encoders > 0 else self.jobs
+        self.lock = threading.Lock()
+        self.tools = set()  # AnimTools of the running items
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Stop the batch: running items are cancelled (their ffmpeg stopped), queued items fail right away.
+        """
+        self.cancelled = True
+        with self.lock:
+            tools = list(self.tools)
+        for tool in tools:
+            tool.cancel()
+
+    def load_manifest(self, manifest_file):
+        """
+        Returns a list of BatchItem, None if the manifest can not be used.
+        """
+        try:
+            if manifest_file.lower().endswith(".csv"):
+                defaults, rows = {}, self.read_csv(manifest_file)
+            else:
+                with open(manifest_file, "r") as f:
+                    manifest = json.load(f)
+                if isinstance(manifest, dict):
+                    defaults, rows = manifest.get("defaults", {}), manifest.get("items", [])
+                else:
+                    defaults, rows = {}, manifest
+        except Exception as e:
+            TLog.e(self.TAG, f"read manifest {manifest_file} fail: {e}")
+            return None
+
+        base_dir = os.path.dirname(os.path.abspath(manifest_file))
+        items = []
+        names = set()
+        for i, row in enumerate(rows):
+            row = {**defaults, **row}
+            input_path = row.pop("input", "")
+            if not input_path:
+                TLog.e(self.TAG, f"manifest item {i}: no input")
+                return None
+            output_path = row.pop("output", "")
+            name = row.pop("name", "") or os.path.basename(os.path.normpath(input_path))
+            if name in names:
+                name = f"{name}#{i}"
+            names.add(name)
+
+            overrides = {}
+            for key, value in row.items():
+                if key not in self.OVERRIDE_FIELDS:
+                    TLog.e(self.TAG, f"manifest item {name}: unknown field '{key}'")
+                    return None
+                try:
+                    overrides[key] = self.coerce(value, getattr(self.defaults, key))
+                except ValueError as e:
+                    TLog.e(self.TAG, f"manifest item {name}: {key}={value!r}, {e}")
+                    return None
+
+            # relative paths are relative to the manifest, not to the working directory
+            input_path = os.path.join(base_dir, input_path)
+            if output_path:
+                output_path = os.path.join(base_dir, output_path)
+            items.append(BatchItem(name, input_path, output_path, overrides))
+
+        TLog.i(self.TAG, f"manifest {manifest_file}: {len(items)} items")
+        return items
+
+    @staticmethod
+    def read_csv(manifest_file):
+        with open(manifest_file, "r", newline="") as f:
+            # empty cells mean "use the default"
+            return [{k.strip(): v.strip() for k, v in row.items() if k and v and v.strip()}
+                    for row in csv.DictReader(f)]
+
+    @staticmethod
+    def coerce(value, default):
+        # CSV cells are strings, JSON may be loose as well, follow the type of the default
+        if isinstance(default, bool):
+            if isinstance(value, str):
+                if value.lower() in ("1", "true", "yes"):
+                    return True
+                if value.lower() in ("0", "false", "no"):
+                    return False
+                raise ValueError("expected a boolean")
+            return bool(value)
+        if isinstance(default, int):
+            return int(value)
+        if isinstance(default, float):
+            return float(value)
+        if default is None or isinstance(default, str):
+            return str(value)
+        return value
+
+    def create_common_arg(self, item):
+        common_arg = copy.deepcopy(self.defaults)
+        common_arg.input_path = item.input_path
+        common_arg.output_path = item.output_path
+        for key, value in item.overrides.items():
+            setattr(common_arg, key, value)
+        if common_arg.yuv_output:
+            common_arg.stream_frames = True
+        return common_arg
+
+    def run(self, items, report_file=None):
+        """
+        Build all items, then write the summary report. Returns the report dict.
+        """
+        start_time = time.time()
+        workers = ExecutorUtil.resolve_workers(self.defaults.workers)
+        encoder_limiter = threading.BoundedSemaphore(self.encoders)
+        TLog.i(self.TAG, f"batch: items={len(items)}, jobs={self.jobs}, encoders={self.encoders}")
+
+        # its workers cache the FrameWorkers of as many jobs as run at once
+        executor = ExecutorUtil.create(self.defaults.executor, workers, frame_worker.init_shared_pool, (self.jobs,))
+        # a forking pool starts all its processes on the first task; do that now, before the
+        # item threads exist, a fork while another thread holds a lock can deadlock the child
+        executor.submit(int).result()
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as item_executor:
+                futures = [
+                    item_executor.submit(self.run_item, item, executor, workers, encoder_limiter) for item in items
+                ]
+                try:
+                    results = [future.result() for future in futures]
+                except KeyboardInterrupt:
+                    TLog.e(self.TAG, "interrupted, cancelling")
+                    self.cancel()
+                    raise
+        finally:
+            executor.shutdown(wait=True)
+
+        failed = sum(1 for r in results if r["status"] != self.STATUS_OK)
+        report = {
+            "total": len(results),
+            "succeeded": len(results) - failed,
+            "failed": failed,
+            "total_ms": int((time.time() - start_time) * 1000),
+            "items": results,
+        }
+
+        if report_file:
+            tmp_file = report_file + ".tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(report, f, indent=2)
+            os.replace(tmp_file, report_file)
+            TLog.i(self.TAG, f"report: {report_file}")
+
+        TLog.i(self.TAG, f"batch finished: {report['succeeded']}/{report['total']} ok, cost={report['total_ms']} ms")
+        return report
+
+    def run_item(self, item, executor, workers, encoder_limiter):
+        TLog.i(self.TAG, f"[{item.name}] start")
+        start_time = time.time()
+        listener = BatchToolListener(item.name)
+        common_arg = self.create_common_arg(item)
+
+        tool = AnimTool()
+        tool.set_tool_listener(listener)
+        tool.set_executor(executor, workers)
+        tool.set_encoder_limiter(encoder_limiter)
+
+        error = None
+        with self.lock:
+            self.tools.add(tool)
+        if self.cancelled:
+            tool.cancel()
+        try:
+            success = tool.create(common_arg, True)
+        except Exception as e:
+            # one broken item must not take the rest of the batch down
+            success = False
+            error = str(e)
+        finally:
+            with self.lock:
+                self.tools.discard(tool)
+        if not success and tool.cancelled:
+            error = "cancelled"
+
+        if success and (listener.error or not tool.md5):
+            success = False
+        if not success and not error:
+            error = "build failed, see log"
+
+        total_ms = int((time.time() - start_time) * 1000)
+        status = self.STATUS_OK if success else self.STATUS_FAILED
+        if success:
+            TLog.i(self.TAG, f"[{item.name}] {status}, cost={total_ms} ms")
+        else:
+            TLog.e(self.TAG, f"[{item.name}] {status}: {error}")
+
+        return {
+            "name": item.name,
+            "input": item.input_path,
+            "output": common_arg.output_path,
+            "status": status,
+            "error": error,
+            "total_ms": total_ms,
+            "frames": common_arg.total_frame,
+            "md5": tool.md5,
+            "warnings": listener.warnings,
+            "variants": tool.variant_results,
+            # wall time per build stage, the whole breakdown is in the item's build_stats.json
+            "stages": {name: stage["wall_ms"] for name, stage in listener.stats["stages"].items()}
+            if listener.stats else {},
+        }
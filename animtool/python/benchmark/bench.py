@@ -0,0 +1,334 @@
+"""
+Benchmark suite for the animtool pipeline.
+
+    cd animtool/python
+    python -m benchmark.bench --save-baseline benchmark/baseline.json
+    python -m benchmark.bench --baseline benchmark/baseline.json
+
+Frame sequences are synthesized once into --work-dir and reused by later runs.
+Timings are wall clock; each benchmark keeps the median of --repeat runs, and a benchmark
+is a regression when its median is more than --tolerance slower than in the baseline.
+Stages that need ffmpeg are skipped (and reported as skipped) when it is not installed.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from anim_tool import AnimTool
+from common_arg import CommonArg, CommonArgTool
+from get_alpha_frame import GetAlphaFrame
+from mp4_box_tool import Mp4BoxTool
+from utils.executor_util import ExecutorUtil
+from utils.log import TLog, ITLog
+
+
+class Benchmark:
+    TAG = "Benchmark"
+    VERSION = 1
+
+    # name -> (width, height) of the input frames
+    CASES = {
+        "portrait": (750, 1334),
+        "square": (1500, 1500),
+    }
+    SCALES = (1.0, 0.5)
+    # frames timed one by one in the create_frame benchmark
+    SAMPLE_FRAMES = 20
+    # mdat size of the synthesized mp4 for the box benchmarks
+    MP4_MDAT_MB = 64
+
+    def __init__(self, args):
+        self.args = args
+        self.results = {}
+        self.ffmpeg = shutil.which(args.ffmpeg)
+
+    def run(self):
+        for case in self.args.cases:
+            input_path = self.synthesize(case, self.args.frames)
+            for scale in self.SCALES:
+                self.bench_create_frame(case, input_path, scale)
+            self.bench_discovery(case, input_path)
+            for scale in self.SCALES:
+                for executor in self.args.executors:
+                    for workers in self.args.workers:
+                        self.bench_all_frame_image(case, input_path, scale, executor, workers)
+            self.bench_video(case, input_path)
+        self.bench_mp4_box()
+        return self.results
+
+    # --- inputs
+
+    def synthesize(self, case, frames):
+        """
+        Deterministic RGBA sequence: a soft-edged disc moving over a transparent
+        gradient, so both the color and the alpha region change every frame.
+        """
+        w, h = self.CASES[case]
+        path = os.path.join(self.args.work_dir, f"{case}_{w}x{h}_{frames}")
+        done_file = os.path.join(path, ".done")
+        if os.path.exists(done_file):
+            return path
+
+        TLog.i(self.TAG, f"synthesize {frames} frames of {w}x{h} into {path}")
+        os.makedirs(path, exist_ok=True)
+        yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+        base = np.empty((h, w, 4), dtype=np.uint8)
+        base[..., 0] = (xx * 255 / w).astype(np.uint8)
+        base[..., 1] = (yy * 255 / h).astype(np.uint8)
+        base[..., 2] = 128
+        radius = min(w, h) / 4
+        for i in range(frames):
+            t = i / max(1, frames - 1)
+            cx = w * (0.25 + 0.5 * t)
+            cy = h * (0.5 + 0.25 * np.sin(t * 2 * np.pi))
+            dist = np.sqrt((xx - cx) ** 2 + (yy - cy) ** 2)
+            # opaque disc with a 32 px soft edge, faint gradient around it
+            alpha = np.clip((radius - dist) / 32 + 0.5, 0, 1) * 224 + 16
+            frame = base.copy()
+            frame[..., 3] = alpha.astype(np.uint8)
+            Image.fromarray(frame, "RGBA").save(os.path.join(path, f"{i:03d}.png"), compress_level=1)
+        open(done_file, "w").close()
+        return path
+
+    def create_common_arg(self, input_path, scale=1.0, **overrides):
+        common_arg = CommonArg()
+        common_arg.input_path = input_path
+        common_arg.output_path = os.path.join(self.args.work_dir, "out")
+        common_arg.ffmpeg_cmd = self.args.ffmpeg
+        common_arg.mp4edit_cmd = None
+        common_arg.scale = scale
+        for key, value in overrides.items():
+            setattr(common_arg, key, value)
+        return common_arg
+
+    # --- timing
+
+    def measure(self, name, fn, frames=None, repeat=None, setup=None):
+        runs = []
+        for _ in range(repeat or self.args.repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            fn()
+            runs.append((time.perf_counter() - start) * 1000)
+
+        result = {
+            "median_ms": round(statistics.median(runs), 3),
+            "min_ms": round(min(runs), 3),
+            "runs_ms": [round(r, 3) for r in runs],
+        }
+        if frames:
+            result["per_frame_ms"] = round(result["median_ms"] / frames, 3)
+        self.results[name] = result
+        print(f"{name:<60} {result['median_ms']:>10.1f} ms" + (f"  ({result['per_frame_ms']:.2f} ms/frame)" if frames else ""))
+        return result
+
+    def skip(self, name, reason):
+        self.results[name] = {"skipped": reason}
+        print(f"{name:<60} {'skipped':>10}  ({reason})")
+
+    # --- benchmarks
+
+    def bench_create_frame(self, case, input_path, scale):
+        common_arg = self.create_common_arg(input_path, scale)
+        CommonArgTool.auto_fill_and_check(common_arg)
+        files = common_arg.frame_paths[:self.SAMPLE_FRAMES]
+        for compositor in (GetAlphaFrame.COMPOSITOR_PIL, GetAlphaFrame.COMPOSITOR_NUMPY):
+            common_arg.compositor = compositor
+            get_alpha_frame = GetAlphaFrame()
+
+            def run():
+                for file in files:
+                    get_alpha_frame.create_frame(common_arg, file)
+
+            self.measure(f"create_frame/{case}/scale={scale}/{compositor}", run, len(files))
+
+    def bench_discovery(self, case, input_path):
+        # directory scan + header validation of every frame
+        def run():
+            CommonArgTool.auto_fill_and_check(self.create_common_arg(input_path))
+
+        self.measure(f"discovery/{case}", run)
+
+    def bench_all_frame_image(self, case, input_path, scale, executor, workers):
+        common_arg = self.create_common_arg(input_path, scale, executor=executor, workers=workers)
+        frame_output_path = os.path.join(common_arg.output_path, AnimTool.FRAME_IMAGE_DIR)
+
+        def setup():
+            shutil.rmtree(frame_output_path, ignore_errors=True)
+
+        def run():
+            if not AnimTool().create_all_frame_image(common_arg):
+                raise RuntimeError("create_all_frame_image failed")
+
+        self.measure(
+            f"create_all_frame_image/{case}/scale={scale}/{executor}/workers={workers}",
+            run, self.args.frames, setup=setup,
+        )
+
+    def bench_video(self, case, input_path):
+        for name, overrides in (
+            ("pipeline", {}),
+            ("no_pipeline", {"pipeline": False}),
+            ("stream_yuv", {"stream_frames": True, "yuv_output": True, "compositor": "numpy"}),
+        ):
+            full_name = f"create/{case}/{name}"
+            if not self.ffmpeg:
+                self.skip(full_name, f"{self.args.ffmpeg} not found")
+                continue
+
+            common_arg = self.create_common_arg(input_path, native_vapc=True, **overrides)
+
+            def run():
+                if not AnimTool().create(common_arg, True):
+                    raise RuntimeError("create failed")
+
+            self.measure(full_name, run, self.args.frames)
+
+    def bench_mp4_box(self):
+        path = os.path.join(self.args.work_dir, "mp4box")
+        os.makedirs(path, exist_ok=True)
+        video_file = os.path.join(path, "src.mp4")
+        if not os.path.exists(video_file):
+            mdat_len = self.MP4_MDAT_MB << 20
+            with open(video_file, "wb") as f:
+                f.write(b"\0\0\0\x10ftypisom\0\0\0\0")
+                f.write((mdat_len + 8).to_bytes(4, "big") + b"mdat")
+                chunk = os.urandom(1 << 20)
+                for _ in range(self.MP4_MDAT_MB):
+                    f.write(chunk)
+                f.write(b"\0\0\0\x10moov\0\0\0\x08mvhd")
+
+        vapc_json = os.path.join(path, AnimTool.VAPC_JSON_FILE)
+        with open(vapc_json, "w") as f:
+            json.dump({"info": {"v": 2, "f": 300, "w": 750, "h": 1334, "fps": 25}}, f)
+        mp4_box_tool = Mp4BoxTool()
+        work_file = os.path.join(path, "video.mp4")
+
+        self.measure("mp4box/create", lambda: mp4_box_tool.create(vapc_json, path))
+
+        with open(vapc_json, "rb") as f:
+            vapc_data = f.read()
+
+        def copy():
+            shutil.copyfile(video_file, work_file)
+
+        self.measure("mp4box/insert_vapc", lambda: mp4_box_tool.insert_vapc(work_file, vapc_data), setup=copy)
+        self.measure(
+            "mp4box/insert_vapc+md5",
+            lambda: mp4_box_tool.insert_vapc(work_file, vapc_data, algorithms=("md5",)), setup=copy,
+        )
+        self.measure("mp4box/parse", lambda: mp4_box_tool.parse(work_file, os.path.join(path, "parsed")))
+
+
+def get_meta(args):
+    import PIL
+    return {
+        "v": Benchmark.VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": ExecutorUtil.cpu_count(),
+        "pillow": PIL.__version__,
+        "numpy": np.__version__,
+        "frames": args.frames,
+        "repeat": args.repeat,
+    }
+
+
+def compare(results, baseline, tolerance, min_ms):
+    """
+    Print the change against the baseline. Returns the names of the regressed benchmarks.
+    Benchmarks faster than min_ms in the baseline are shown but never flagged, they are mostly noise.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<60} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or "median_ms" not in base or "median_ms" not in result:
+            continue
+        change = result["median_ms"] / base["median_ms"] - 1 if base["median_ms"] else 0.0
+        flag = ""
+        if change > tolerance and base["median_ms"] >= min_ms:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<60} {base['median_ms']:>10.1f} {result['median_ms']:>10.1f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def parse_list(value, cast=str):
+    return [cast(v) for v in value.split(",") if v]
+
+
+def run(args_list=None):
+    parser = argparse.ArgumentParser(description="animtool benchmark suite")
+    parser.add_argument(
+        "--cases", type=parse_list, default=list(Benchmark.CASES),
+        help=f"Frame sizes to run, comma separated (default: {','.join(Benchmark.CASES)})",
+    )
+    parser.add_argument("--frames", type=int, default=300, help="Frames per sequence (default: 300)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark, the median counts (default: 3)")
+    parser.add_argument(
+        "--executors", type=parse_list, default=[ExecutorUtil.BACKEND_THREAD, ExecutorUtil.BACKEND_PROCESS],
+        help="Frame executor backends (default: thread,process)",
+    )
+    parser.add_argument(
+        "--workers", type=lambda v: parse_list(v, int), default=sorted({1, ExecutorUtil.cpu_count()}),
+        help="Worker counts, comma separated (default: 1 and the cpu count)",
+    )
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="FFmpeg executable for the video stages")
+    parser.add_argument(
+        "--work-dir", default=os.path.join(tempfile.gettempdir(), "animtool_bench"),
+        help="Where synthesized frames are cached and builds are written",
+    )
+    parser.add_argument("-o", "--output", help="Write the results json here")
+    parser.add_argument("--save-baseline", help="Write the results as the new baseline json")
+    parser.add_argument("--baseline", help="Compare against this baseline json, exit 1 on regressions")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.15, help="Allowed slowdown against the baseline (default: 0.15)"
+    )
+    parser.add_argument(
+        "--min-ms", type=float, default=5.0, help="Ignore regressions of benchmarks faster than this (default: 5)"
+    )
+    args = parser.parse_args(args_list)
+
+    unknown = [case for case in args.cases if case not in Benchmark.CASES]
+    if unknown:
+        parser.error(f"unknown case(s): {','.join(unknown)}")
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    # the tools log every step, keep the benchmark output readable
+    TLog.logger = ITLog()
+    try:
+        results = Benchmark(args).run()
+    finally:
+        TLog.logger = None
+
+    report = {"meta": get_meta(args), "results": results}
+    for output in (args.output, args.save_baseline):
+        if output:
+            with open(output, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"results: {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("cpu_count") != report["meta"]["cpu_count"]:
+            print("warning: baseline was recorded on a machine with a different cpu count", file=sys.stderr)
+        regressions = compare(results, baseline.get("results", {}), args.tolerance, args.min_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.tolerance:.0%}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,99 @@
+import os
+import json
+import hashlib
+
+from utils.log import TLog
+
+
+class BuildManifest:
+    """
+    build_manifest.json in the output directory: the layout a build used plus the content
+    hash of every input frame. Frames whose hash is unchanged (and whose output frame is
+    still on disk) are not composited again on the next incremental build.
+    Any change to a layout-affecting field throws the whole cache away.
+    """
+    TAG = "BuildManifest"
+    MANIFEST_FILE = "build_manifest.json"
+    VERSION = 1
+
+    @staticmethod
+    def hash_bytes(data) -> str:
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    @staticmethod
+    def get_layout(common_arg) -> dict:
+        # everything that changes the pixels of an output frame for the same input frame
+        layout = {
+            "v": BuildManifest.VERSION,
+            "rgbPoint": str(common_arg.rgb_point),
+            "alphaPoint": str(common_arg.alpha_point),
+            "scale": common_arg.scale,
+            "outputW": common_arg.output_w,
+            "outputH": common_arg.output_h,
+            "isVapx": common_arg.is_vapx,
+        }
+        if common_arg.trim_rect:
+            # same size, other offset is still another frame
+            layout["trimFrame"] = str(common_arg.trim_rect)
+        if common_arg.is_opaque:
+            layout["opaque"] = True
+        return layout
+
+    @staticmethod
+    def load(common_arg) -> dict:
+        """
+        Returns {frame_index: hash} from the previous build, or {} if there is nothing reusable.
+        """
+        manifest_file = os.path.join(common_arg.output_path, BuildManifest.MANIFEST_FILE)
+        if not os.path.exists(manifest_file):
+            return {}
+
+        try:
+            with open(manifest_file, "r") as f:
+                manifest = json.load(f)
+        except Exception as e:
+            TLog.w(BuildManifest.TAG, f"ignore broken manifest: {e}")
+            return {}
+
+        if manifest.get("layout") != BuildManifest.get_layout(common_arg):
+            TLog.i(BuildManifest.TAG, "layout changed, rebuild all frames")
+            return {}
+
+        return {int(k): v for k, v in manifest.get("frames", {}).items()}
+
+    @staticmethod
+    def invalidate(common_arg):
+        """
+        Remove the manifest before a build writes frames, it only comes back when that build
+        succeeds. Otherwise frames of a failed or non-incremental build (maybe with another
+        layout) would be taken for the frames the manifest describes.
+        """
+        manifest_file = os.path.join(common_arg.output_path, BuildManifest.MANIFEST_FILE)
+        if os.path.exists(manifest_file):
+            os.remove(manifest_file)
+
+    @staticmethod
+    def save(common_arg, frame_hashes: dict):
+        manifest = {
+            "layout": BuildManifest.get_layout(common_arg),
+            "frames": {str(k): frame_hashes[k] for k in sorted(frame_hashes)},
+        }
+        manifest_file = os.path.join(common_arg.output_path, BuildManifest.MANIFEST_FILE)
+        tmp_file = manifest_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(manifest, f, separators=(",", ":"))
+        os.replace(tmp_file, manifest_file)
+
+    @staticmethod
+    def remove_stale_frames(common_arg):
+        """
+        Drop output frames past the end of the current sequence, otherwise ffmpeg's
+        %03d.png input would pick them up after a frame count change.
+        """
+        if not os.path.isdir(common_arg.frame_output_path):
+            return
+
+        for entry in os.scandir(common_arg.frame_output_path):
+            name, ext = os.path.splitext(entry.name)
+            if ext == ".png" and name.isdigit() and int(name) >= common_arg.total_frame:
+                os.remove(entry.path)
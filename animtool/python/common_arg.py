@@ -1,17 +1,26 @@
-# from vapx.src_set import SrcSet # Removed
-# from vapx.frame_set import FrameSet # Removed
+from vapx.src_set import SrcSet
+from vapx.frame_set import FrameSet
 from data.point_rect import PointRect
+from data.frame_index import FrameIndex
+from layout_planner import LayoutPlanner
+from utils.executor_util import ExecutorUtil
+from utils.ffprobe_util import FfprobeUtil
+from utils.png_util import PngUtil
+from utils.process_util import ProcessUtil
+from utils.trim_util import TrimUtil
 from utils.log import TLog
 # from anim_tool import AnimTool  # Removed to avoid circular import
 import os
 import math
-from PIL import Image
 import anim_tool
 
 class CommonArg:
     def __init__(self):
         self.ffmpeg_cmd = "ffmpeg"
+        self.ffprobe_cmd = ""  # default: ffprobe next to ffmpeg_cmd
         self.mp4edit_cmd = "mp4edit"
+        self.native_vapc = False  # write the vapc box in process, mp4edit is not needed
+        self.sha256 = False  # also write sha256.txt next to md5.txt
         self.enable_h265 = True
         self.fps = 25
         self.force_key_frames = "0.000"
@@ -20,7 +29,32 @@ class CommonArg:
         self.enable_crf = False
         self.bitrate = 15000
         self.crf = 29
-        self.is_vapx = False
+        self.is_vapx = False  # fusion animation: masks of src_set go into the free space of the video
+        self.src_set = SrcSet()
+        self.frame_set = FrameSet()  # vapx: filled in frame order while compositing
+        self.pipeline = True  # encode while compositing: ffmpeg reads frames from stdin, frames/*.png are still written
+        self.stream_frames = False  # pipe composited frames into ffmpeg instead of writing frames/*.png
+        self.keep_frames = False  # stream mode: still write frames/*.png for debugging
+        self.stream_buffer = 32  # stream mode: max frames composited ahead of the encoder
+        self.compositor = "pil"  # frame compositing engine: pil | numpy
+        self.yuv_output = False  # stream mode: composite straight to I420, no RGBA frames / ffmpeg color conversion
+        self.executor = "auto"  # frame worker backend: auto | thread | process
+        self.workers = 0  # frame workers, 0 = one per available core
+        self.chunk_size = 0  # frames per worker task, 0 = auto
+        self.incremental = False  # only recomposite frames whose input or layout changed
+        self.dedup = False  # composite repeated (hold) frames once and reuse the output
+        self.trim = False  # crop all frames to the union bounding box of their visible (alpha > 0) pixels
+        self.optimize_layout = False  # search orientation, alpha scale (0.5 - scale) and gap for the fewest macroblocks
+        self.max_size = 1504  # max video width/height, larger shows a green screen on some devices
+        self.opaque = False  # if every frame is fully opaque, encode the rgb area only (plus a tiny white aFrame)
+        self.process_timeout = 0  # seconds one ffmpeg/mp4edit run may take, 0 = no limit
+        # variant matrix, comma separated: codecs (h264,h265) x rates (15000,crf28) x fps (25,30)
+        self.variant_codecs = ""
+        self.variant_rates = ""
+        self.variant_fps = ""
+        self.max_encoders = 0  # variant builds: concurrent encoders, 0 = one per variant
+        self.segments = 1  # encode frames/*.png as this many key frame aligned segments in parallel, 0 = by cores
+        self.webm_stream = False  # .webm input: decode straight into the compositor, no frames_original/*.png
         
         self.output_path = ""
         self.frame_output_path = ""
@@ -34,6 +68,15 @@ class CommonArg:
         self.output_h = 0
         self.need_audio = False
         self.audio_path = ""
+        self.frame_paths = []  # input frame paths by frame index, filled by CommonArgTool
+        self.webm_codec = ""  # webm_stream: codec of the input, picks the decoder
+        self.frame_cache = {}  # incremental: frame index -> input hash of the previous build
+        self.trim_rect = None  # trim: the part of the input canvas that is encoded, rgb_point has its size
+        self.canvas_w = 0  # trim: size of the input frames
+        self.canvas_h = 0
+        self.is_opaque = False  # opaque: every frame is fully opaque, the video has no alpha area
+        self.opaque_block = None  # opaque: the white block that aFrame points into
+        self.layout_plan = None  # LayoutPlan of the rgb + alpha layout, with its decode load
 
 
     def __str__(self):
@@ -46,6 +89,8 @@ class CommonArg:
 class CommonArgTool:
     TAG = "CommonArgTool"
     MIN_GAP = 0
+    OPAQUE_BLOCK = 8  # opaque: white block in the padding
+    OPAQUE_ALPHA = 4  # opaque: aFrame, in the middle of the block
 
     @staticmethod
     def auto_fill_and_check(common_arg, tool_listener=None):
@@ -70,7 +115,8 @@ class CommonArgTool:
             TLog.e(CommonArgTool.TAG, f"input path invalid {common_arg.input_path}")
             return False
 
-        if not common_arg.input_path.endswith(os.sep):
+        webm_stream = CommonArgTool.is_webm_stream(common_arg)
+        if not webm_stream and not common_arg.input_path.endswith(os.sep):
             common_arg.input_path += os.sep
 
         if common_arg.need_audio:
@@ -83,74 +129,80 @@ class CommonArgTool:
                 return False
 
         if not common_arg.output_path:
-            common_arg.output_path = os.path.join(common_arg.input_path, anim_tool.AnimTool.OUTPUT_DIR)
+            input_dir = os.path.dirname(common_arg.input_path) if webm_stream else common_arg.input_path
+            common_arg.output_path = os.path.join(input_dir, anim_tool.AnimTool.OUTPUT_DIR)
 
         common_arg.frame_output_path = os.path.join(common_arg.output_path, anim_tool.AnimTool.FRAME_IMAGE_DIR)
 
+        # srcId auto generation & vapx path check & z order
+        if common_arg.is_vapx:
+            # vapx is always scaled down, the masks go into the space that frees
+            common_arg.scale = 0.5
+            for i, src in enumerate(common_arg.src_set.srcs):
+                src.src_id = str(i)
+                src.z = i
+                if not os.path.exists(src.src_path):
+                    TLog.e(CommonArgTool.TAG, f"src={src.src_id},path invalid {src.src_path}")
+                    continue
+                if not src.src_path.endswith(os.sep):
+                    src.src_path += os.sep
+            common_arg.frame_set = FrameSet()
+
         common_arg.scale = max(0.5, min(1.0, common_arg.scale))
 
-        first_frame_path = os.path.join(common_arg.input_path, "000.png")
-        if not os.path.exists(first_frame_path):
-            TLog.e(CommonArgTool.TAG, "first frame 000.png does not exist")
-            return False
-            
-        try:
-            with Image.open(first_frame_path) as img:
-                common_arg.rgb_point.w, common_arg.rgb_point.h = img.size
-        except Exception as e:
-            TLog.e(CommonArgTool.TAG, f"read image error: {e}")
-            return False
+        if webm_stream:
+            # size and frame count come from the container, there is no 000.png to look at
+            video_info = FfprobeUtil.probe_video(FfprobeUtil.get_ffprobe_cmd(common_arg), common_arg.input_path)
+            if video_info is None:
+                TLog.e(CommonArgTool.TAG, f"can not probe {common_arg.input_path}")
+                return False
+            common_arg.rgb_point.w, common_arg.rgb_point.h = video_info.width, video_info.height
+            common_arg.webm_codec = video_info.codec
+            frame_index = None
+        else:
+            frame_index = CommonArgTool.scan_frames(common_arg, tool_listener)
+            if frame_index is None:
+                return False
 
         if common_arg.rgb_point.w <= 0 or common_arg.rgb_point.h <= 0:
             TLog.e(CommonArgTool.TAG, f"video size {common_arg.rgb_point.w}x{common_arg.rgb_point.h}")
             return False
 
-        common_arg.gap = CommonArgTool.MIN_GAP
-
-        common_arg.alpha_point.w = int(common_arg.rgb_point.w * common_arg.scale)
-        common_arg.alpha_point.h = int(common_arg.rgb_point.h * common_arg.scale)
-
-        h_w = common_arg.rgb_point.w + common_arg.gap + common_arg.alpha_point.w
-        h_h = common_arg.rgb_point.h
-        h_max = max(h_w, h_h)
-
-        v_w = common_arg.rgb_point.w
-        v_h = common_arg.rgb_point.h + common_arg.gap + common_arg.alpha_point.h
-        v_max = max(v_w, v_h)
-
-        if h_max > v_max: # Vertical layout
-            common_arg.is_v_layout = True
-            common_arg.alpha_point.x = 0
-            common_arg.alpha_point.y = common_arg.rgb_point.h + common_arg.gap
-            common_arg.output_w = common_arg.rgb_point.w
-            common_arg.output_h = common_arg.rgb_point.h + common_arg.gap + common_arg.alpha_point.h
-        else: # Horizontal layout
-            common_arg.is_v_layout = False
-            common_arg.alpha_point.x = common_arg.rgb_point.w + common_arg.gap
-            common_arg.alpha_point.y = 0
-            common_arg.output_w = common_arg.rgb_point.w + common_arg.gap + common_arg.alpha_point.w
-            common_arg.output_h = common_arg.rgb_point.h
+        common_arg.trim_rect = None
+        common_arg.is_opaque = False
+        common_arg.opaque_block = None
+        common_arg.layout_plan = None
+        if common_arg.trim or common_arg.opaque:
+            total_frame = video_info.frames if webm_stream else frame_index.total_frame
+            if not CommonArgTool.check_alpha(common_arg, frame_index, total_frame, tool_listener):
+                return False
 
-        w_fill, h_fill = CommonArgTool.cal_size_fill(common_arg.output_w, common_arg.output_h)
-        common_arg.output_w += w_fill
-        common_arg.output_h += h_fill
+        if common_arg.is_opaque:
+            CommonArgTool.set_opaque_layout(common_arg)
+        else:
+            CommonArgTool.set_layout(common_arg)
 
-        if common_arg.output_w > 1504 or common_arg.output_h > 1504:
+        msg = None
+        plan = common_arg.layout_plan
+        if common_arg.optimize_layout and plan:
+            TLog.i(CommonArgTool.TAG, f"layout: {plan}")
+            if plan.violations:
+                msg = f"[Warning] no layout fits the limits: {', '.join(plan.violations)}"
+        if msg is None and (common_arg.output_w > common_arg.max_size or common_arg.output_h > common_arg.max_size):
             msg = (f"[Warning] Output video width:{common_arg.output_w} or "
-                   f"height:{common_arg.output_h} is over 1504. Some devices will "
+                   f"height:{common_arg.output_h} is over {common_arg.max_size}. Some devices will "
                    "display exception. For example green screen!")
+        if msg:
             TLog.w(CommonArgTool.TAG, msg)
             if tool_listener:
                 tool_listener.on_warning(msg)
 
-        common_arg.total_frame = 0
-        i = 0
-        while i <= 10000:
-            frame_file = os.path.join(common_arg.input_path, f"{i:03d}.png")
-            if not os.path.exists(frame_file):
-                break
-            common_arg.total_frame += 1
-            i += 1
+        if webm_stream:
+            common_arg.total_frame = video_info.frames
+            common_arg.frame_paths = []
+        else:
+            common_arg.total_frame = frame_index.total_frame
+            common_arg.frame_paths = frame_index.paths
 
         if common_arg.total_frame <= 0:
             TLog.e(CommonArgTool.TAG, f"totalFrame={common_arg.total_frame}")
@@ -164,8 +216,199 @@ class CommonArgTool:
             TLog.e(CommonArgTool.TAG, f"crf={common_arg.crf}, no in [0, 51]")
             return False
 
+        if common_arg.segments < 0:
+            TLog.e(CommonArgTool.TAG, f"segments={common_arg.segments}")
+            return False
+
         return True
 
+    @staticmethod
+    def is_webm_stream(common_arg):
+        return (common_arg.webm_stream and common_arg.input_path.lower().endswith(".webm")
+                and os.path.isfile(common_arg.input_path))
+
+    @staticmethod
+    def scan_frames(common_arg, tool_listener):
+        """
+        FrameIndex of the input dir with rgb_point.w/h set from the first frame, None if the frames are unusable.
+        """
+        # one directory listing gives the count, the paths and the gaps
+        frame_index = FrameIndex.scan(common_arg.input_path)
+        if frame_index.total_frame <= 0:
+            TLog.e(CommonArgTool.TAG, "first frame 000.png does not exist")
+            return None
+
+        # header-only check of every frame, fails before minutes of compositing/encoding
+        errors, warnings = frame_index.validate()
+        for msg in warnings:
+            TLog.w(CommonArgTool.TAG, msg)
+            if tool_listener:
+                tool_listener.on_warning(msg)
+        if errors:
+            TLog.e(CommonArgTool.TAG, f"invalid frames in {common_arg.input_path}:\n" + "\n".join(errors))
+            return None
+
+        try:
+            common_arg.rgb_point.w, common_arg.rgb_point.h = frame_index.get_first_size()
+        except Exception as e:
+            TLog.e(CommonArgTool.TAG, f"read image error: {e}")
+            return None
+
+        if frame_index.gaps:
+            msg = f"[Warning] {frame_index.get_gap_msg()}"
+            TLog.w(CommonArgTool.TAG, msg)
+            if tool_listener:
+                tool_listener.on_warning(msg)
+
+        if frame_index.duplicates:
+            TLog.w(CommonArgTool.TAG, f"duplicate frame files for index: {sorted(set(frame_index.duplicates))}")
+
+        return frame_index
+
+    @staticmethod
+    def check_alpha(common_arg, frame_index, total_frame, tool_listener):
+        """
+        trim / opaque: one look at the alpha of every frame serves both.
+        """
+        opaque = common_arg.opaque
+        if opaque and common_arg.is_vapx:
+            # the masks go into the alpha area
+            TLog.w(CommonArgTool.TAG, "opaque: not supported for vapx, ignored")
+            opaque = False
+
+        if frame_index is not None and frame_index.headers and \
+                not any(PngUtil.has_alpha_channel(header) for header in frame_index.headers):
+            # no frame has an alpha channel: nothing to trim and nothing to decode
+            TLog.i(CommonArgTool.TAG, "no frame has an alpha channel")
+            common_arg.is_opaque = opaque
+            if opaque:
+                TLog.i(CommonArgTool.TAG, "opaque: rgb-only layout")
+            return True
+
+        bounds = CommonArgTool.scan_alpha(common_arg, frame_index, total_frame)
+        if bounds is None:
+            return False
+
+        if opaque:
+            if bounds.opaque:
+                common_arg.is_opaque = True
+                TLog.i(CommonArgTool.TAG, "opaque: every frame is fully opaque, rgb-only layout")
+            else:
+                msg = "[Warning] opaque: not every frame is fully opaque, the alpha area is kept"
+                TLog.w(CommonArgTool.TAG, msg)
+                if tool_listener:
+                    tool_listener.on_warning(msg)
+
+        if common_arg.trim:
+            CommonArgTool.trim_frames(common_arg, bounds)
+        return True
+
+    @staticmethod
+    def scan_alpha(common_arg, frame_index, total_frame):
+        """
+        AlphaBounds of all frames (vapx: and all masks), None if they can not be decoded.
+        Every frame is decoded once for this.
+        """
+        w, h = common_arg.rgb_point.w, common_arg.rgb_point.h
+        workers = ExecutorUtil.resolve_workers(common_arg.workers)
+        bounds = None
+        paths = []
+        if frame_index is None:
+            # webm_stream: one extra decode of the whole video
+            cmd = anim_tool.AnimTool().get_ffmpeg_decode_cmd(common_arg)
+            reader = ProcessUtil.open_reader(cmd)
+            if reader is None:
+                return None
+            bounds, _ = TrimUtil.scan_stream(reader, w, h)
+            if reader.close() != 0:
+                TLog.e(CommonArgTool.TAG, f"can not decode {common_arg.input_path}")
+                return None
+        else:
+            paths = list(frame_index.paths)
+        if common_arg.is_vapx:
+            # a src may be drawn where the animation itself is transparent
+            paths += [src.src_path + f"{i:03d}.png" for src in common_arg.src_set.srcs for i in range(total_frame)]
+        if paths:
+            file_bounds = TrimUtil.scan_files(paths, w, h, workers)
+            if bounds is None:
+                bounds = file_bounds
+            else:
+                bounds.merge(file_bounds)
+        return bounds
+
+    @staticmethod
+    def trim_frames(common_arg, bounds):
+        """
+        Shrink rgb_point to the union bounding box of alpha > 0 of bounds,
+        trim_rect is where that box is in the input canvas.
+        """
+        w, h = common_arg.rgb_point.w, common_arg.rgb_point.h
+        trim_rect = bounds.get_rect()
+        if trim_rect is None:
+            TLog.w(CommonArgTool.TAG, "trim: all frames are transparent, nothing to trim")
+            return
+        if (trim_rect.w, trim_rect.h) == (w, h):
+            TLog.i(CommonArgTool.TAG, "trim: no transparent margin")
+            return
+
+        common_arg.trim_rect = trim_rect
+        common_arg.canvas_w, common_arg.canvas_h = w, h
+        common_arg.rgb_point.w, common_arg.rgb_point.h = trim_rect.w, trim_rect.h
+        TLog.i(CommonArgTool.TAG, f"trim: {w}x{h} -> {trim_rect.w}x{trim_rect.h} at ({trim_rect.x},{trim_rect.y})")
+
+    @staticmethod
+    def set_layout(common_arg):
+        """
+        rgb area plus the alpha area scaled by common_arg.scale, side by side or stacked, 16 aligned.
+        optimize_layout: orientation, scale and gap are searched by the LayoutPlanner instead.
+        """
+        common_arg.gap = CommonArgTool.MIN_GAP
+        if common_arg.optimize_layout and common_arg.is_vapx:
+            TLog.w(CommonArgTool.TAG, "optimize layout: not for vapx, the masks need the free space of the default layout")
+        if common_arg.optimize_layout and not common_arg.is_vapx:
+            plan = LayoutPlanner.search(common_arg)
+        else:
+            plan = LayoutPlanner.get_default(common_arg)
+            fps, level = LayoutPlanner.get_limits(common_arg)
+            plan.check(fps, level, common_arg.max_size)
+        plan.apply(common_arg)
+        common_arg.layout_plan = plan
+
+    @staticmethod
+    def set_opaque_layout(common_arg):
+        """
+        opaque: the rgb area alone, 16 aligned. The player still needs an aFrame, it points into
+        a small white block in the alignment padding (a 16 px strip is added if the padding is too thin).
+        The block is larger than aFrame so scaling and chroma subsampling never blend in other pixels.
+        """
+        block = CommonArgTool.OPAQUE_BLOCK
+        rgb_w, rgb_h = common_arg.rgb_point.w, common_arg.rgb_point.h
+        w_fill, h_fill = CommonArgTool.cal_size_fill(rgb_w, rgb_h)
+        common_arg.output_w = rgb_w + w_fill
+        common_arg.output_h = rgb_h + h_fill
+        # even position: a 2x2 chroma block must not be shared with rgb pixels
+        x = rgb_w + rgb_w % 2
+        y = rgb_h + rgb_h % 2
+        if x + block <= common_arg.output_w and block <= common_arg.output_h:
+            common_arg.is_v_layout = False
+            y = 0
+        elif y + block <= common_arg.output_h and block <= common_arg.output_w:
+            common_arg.is_v_layout = True
+            x = 0
+        elif common_arg.output_h <= common_arg.output_w:
+            # a strip on the shorter side adds the fewest macroblocks
+            common_arg.is_v_layout = False
+            x, y = common_arg.output_w, 0
+            common_arg.output_w += 16
+        else:
+            common_arg.is_v_layout = True
+            x, y = 0, common_arg.output_h
+            common_arg.output_h += 16
+        common_arg.gap = 0
+        common_arg.opaque_block = PointRect(x, y, block, block)
+        margin = (block - CommonArgTool.OPAQUE_ALPHA) // 2
+        common_arg.alpha_point = PointRect(x + margin, y + margin, CommonArgTool.OPAQUE_ALPHA, CommonArgTool.OPAQUE_ALPHA)
+
     @staticmethod
     def cal_size_fill(out_w, out_h):
         w_fill = 0
@@ -0,0 +1,121 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.png_util import PngUtil
+
+
+class FrameIndex:
+    """
+    Input frames of a directory, found with a single os.scandir instead of one
+    os.path.exists per frame (each of which is a round trip on a network share).
+
+    Frames are named by their index: 000.png, 001.png ... 999.png, 1000.png,
+    any zero padding is accepted (0000.png). The sequence is the contiguous run starting at 0.
+    """
+
+    MAX_REPORTED_GAPS = 10
+    MAX_REPORTED_ERRORS = 20
+    # header reads are tiny and latency bound (NFS), so use plenty of threads
+    PROBE_THREADS = 32
+
+    def __init__(self):
+        self.paths = []  # frame index -> path, contiguous from 0
+        self.gaps = []  # missing indices between 0 and the highest index found
+        self.duplicates = []  # indices with more than one file (e.g. 1.png and 001.png)
+        self.first_size = None
+        self.headers = []  # PngHeader per frame, filled by validate()
+
+    @property
+    def total_frame(self):
+        return len(self.paths)
+
+    @staticmethod
+    def scan(input_path):
+        frame_index = FrameIndex()
+        found = {}
+
+        with os.scandir(input_path) as it:
+            for entry in it:
+                name, ext = os.path.splitext(entry.name)
+                if ext.lower() != ".png" or not (name.isascii() and name.isdigit()):
+                    continue
+                index = int(name)
+                if index in found:
+                    frame_index.duplicates.append(index)
+                    # prefer the canonical %03d name
+                    if entry.name != f"{index:03d}.png":
+                        continue
+                found[index] = entry.path
+
+        if not found:
+            return frame_index
+
+        for index in range(max(found) + 1):
+            path = found.get(index)
+            if path is None:
+                frame_index.gaps.append(index)
+            elif not frame_index.gaps:
+                frame_index.paths.append(path)
+
+        return frame_index
+
+    def get_first_size(self):
+        if self.first_size is None and self.paths:
+            header = PngUtil.read_header(self.paths[0])
+            self.first_size = (header.width, header.height)
+        return self.first_size
+
+    def validate(self):
+        """
+        Read the IHDR of every frame in parallel (no pixel decoding) and check they all
+        have the first frame's size. Returns (errors, warnings), one line per bad frame.
+        """
+        errors = []
+        warnings = []
+        if not self.paths:
+            return errors, warnings
+
+        def read(path):
+            try:
+                return PngUtil.read_header(path)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=min(self.PROBE_THREADS, len(self.paths))) as executor:
+            headers = list(executor.map(read, self.paths))
+
+        first = headers[0]
+        if isinstance(first, Exception):
+            errors.append(f"frame {0:03d}: {first}")
+            return errors, warnings
+
+        self.first_size = (first.width, first.height)
+        self.headers = headers
+        no_alpha = []
+
+        for index, header in enumerate(headers):
+            if isinstance(header, Exception):
+                errors.append(f"frame {index:03d}: {header} ({self.paths[index]})")
+            elif (header.width, header.height) != self.first_size:
+                errors.append(
+                    f"frame {index:03d}: size {header.width}x{header.height}, "
+                    f"expected {first.width}x{first.height}"
+                )
+            elif not PngUtil.has_alpha_channel(header):
+                no_alpha.append(index)
+
+        if no_alpha and len(no_alpha) < len(headers):
+            # a whole opaque sequence is fine, a few opaque frames in a transparent one usually is not
+            frames = ",".join(f"{i:03d}" for i in no_alpha[:self.MAX_REPORTED_GAPS])
+            warnings.append(f"{len(no_alpha)} frames have no alpha channel ({PngUtil.color_name(headers[no_alpha[0]])}): {frames}")
+
+        if len(errors) > self.MAX_REPORTED_ERRORS:
+            errors = errors[:self.MAX_REPORTED_ERRORS] + [f"... {len(errors) - self.MAX_REPORTED_ERRORS} more"]
+
+        return errors, warnings
+
+    def get_gap_msg(self):
+        gaps = ",".join(str(i) for i in self.gaps[:self.MAX_REPORTED_GAPS])
+        if len(self.gaps) > self.MAX_REPORTED_GAPS:
+            gaps += f",... ({len(self.gaps)} missing)"
+        return f"frame sequence stops at {self.total_frame}, missing frames: {gaps}"
@@ -0,0 +1,188 @@
+import os
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from build_manifest import BuildManifest
+from frame_worker import FrameResult
+from vapx.frame_set import FrameObj
+from utils.log import TLog
+
+
+class FrameDedup:
+    """
+    Gift animations often hold a pose for dozens of frames. Each distinct frame is composited
+    once and its output is reused for every frame that repeats it:
+
+    - file hash, in the build before frames go to the workers: byte-identical input pngs
+      (webm_stream: identical decoded frames) are not sent to a worker at all, their FrameResult
+      (and frames/*.png) is copied from the frame they repeat.
+    - pixel hash, in the worker (FrameWorker): a png whose bytes differ (re-exported, other
+      metadata) but whose pixels are those of the frame before it in the same chunk reuses that
+      composite and png.
+
+    A repeated frame is only held while duplicates of it are still in flight. With frame data
+    (pipelined/stream builds) at most MAX_HELD frames are held, a repeat beyond that is composited.
+    Runs on the thread that iterates the frames, not thread safe.
+    """
+    TAG = "FrameDedup"
+    HASH_THREADS = 32
+    MAX_HELD = 8
+
+    KIND_FILE = "file_hash"
+    KIND_PIXEL = "pixel_hash"
+
+    def __init__(self, common_arg, keep_data):
+        self.common_arg = common_arg
+        self.keep_data = keep_data
+        self.file_hashes = None  # frame index -> hash of its input files
+        self.reps = {}  # hash -> latest frame index with it
+        self.rep_of = {}  # duplicate frame index -> frame index it repeats
+        self.pending = {}  # frame index -> duplicates of it not yielded yet
+        self.held = {}  # frame index -> its FrameResult, kept for the pending duplicates
+        self.latency_ms = {}  # frame index -> worker time of a held frame
+        self.yielded = 0  # frames yielded so far
+        self.last_latency_ms = 0.0  # worker time of the last composited frame
+        self.counts = {self.KIND_FILE: 0, self.KIND_PIXEL: 0}
+        self.scan_ms = 0.0
+        self.copy_ms = 0.0
+        self.saved_ms = 0.0
+
+    def scan_files(self):
+        """
+        Hash every input png (vapx: together with its mask pngs) on a thread pool, reads are I/O bound.
+        """
+        start_time = time.perf_counter()
+        common_arg = self.common_arg
+        with ThreadPoolExecutor(max_workers=min(self.HASH_THREADS, common_arg.total_frame)) as executor:
+            self.file_hashes = list(executor.map(self.get_file_hash, range(common_arg.total_frame)))
+        self.scan_ms = (time.perf_counter() - start_time) * 1000
+
+    def get_file_hash(self, frame_index):
+        common_arg = self.common_arg
+        paths = [common_arg.frame_paths[frame_index]]
+        if common_arg.is_vapx:
+            # the masks are part of the frame: same input with other masks is another frame
+            paths += [src.src_path + f"{frame_index:03d}.png" for src in common_arg.src_set.srcs]
+        hashes = []
+        for path in paths:
+            try:
+                with open(path, "rb") as f:
+                    hashes.append(BuildManifest.hash_bytes(f.read()))
+            except FileNotFoundError:
+                hashes.append("")
+            except OSError as e:
+                # the worker reports it when it reads the frame
+                TLog.w(self.TAG, f"hash {path}: {e}")
+                return None
+        return ",".join(hashes)
+
+    def add_chunk(self, frame_indices, frames):
+        """
+        Drop the duplicates of a chunk before it goes to a worker.
+        frames: decoded input per frame (webm_stream) or None. Returns (frame indices, frames) left to composite.
+        """
+        todo = []
+        todo_frames = [] if frames is not None else None
+        for i, frame_index in enumerate(frame_indices):
+            if frames is not None:
+                key = BuildManifest.hash_bytes(frames[i]) if frames[i] is not None else None
+            else:
+                key = self.file_hashes[frame_index]
+            if self.add(frame_index, key) is not None:
+                continue
+            todo.append(frame_index)
+            if frames is not None:
+                todo_frames.append(frames[i])
+        return todo, todo_frames
+
+    def add(self, frame_index, key):
+        """
+        The frame index that frame_index repeats, None if it has to be composited.
+        """
+        if key is None:
+            return None
+        rep = self.reps.get(key)
+        # the earlier frame must still be around: not yielded yet or held for its duplicates
+        available = rep is not None and (rep >= self.yielded or rep in self.held)
+        if available and rep not in self.pending and self.keep_data and len(self.pending) >= self.MAX_HELD:
+            available = False
+        if not available:
+            self.reps[key] = frame_index
+            return None
+        self.rep_of[frame_index] = rep
+        self.pending[rep] = self.pending.get(rep, 0) + 1
+        return rep
+
+    def merge(self, frame_indices, results, save_frames):
+        """
+        Yield a FrameResult for every frame of a chunk, in order: the worker's results for the
+        frames it composited, copies for the duplicates dropped by add_chunk.
+        """
+        results = iter(results)
+        for frame_index in frame_indices:
+            if frame_index in self.rep_of:
+                result = self.get_duplicate(frame_index, save_frames)
+            else:
+                result = next(results, None) or FrameResult(frame_index, False)
+                self.on_result(result)
+            self.yielded = frame_index + 1
+            yield result
+
+    def on_result(self, result):
+        latency_ms = result.stats.latency_ms if result.stats else 0.0
+        if result.duplicate_of is not None:
+            # the worker reused the frame before it, what the frame cost is what it did not save
+            self.counts[self.KIND_PIXEL] += 1
+            self.saved_ms += max(0.0, self.last_latency_ms - latency_ms)
+        else:
+            self.last_latency_ms = latency_ms
+        if self.pending.get(result.frame_index):
+            self.held[result.frame_index] = result
+            self.latency_ms[result.frame_index] = self.last_latency_ms
+
+    def get_duplicate(self, frame_index, save_frames):
+        rep = self.rep_of.pop(frame_index)
+        rep_result = self.held[rep]
+        self.pending[rep] -= 1
+        if not self.pending[rep]:
+            del self.pending[rep]
+            del self.held[rep]
+            latency_ms = self.latency_ms.pop(rep)
+        else:
+            latency_ms = self.latency_ms[rep]
+
+        if not rep_result.ok:
+            return FrameResult(frame_index, False)
+
+        start_time = time.perf_counter()
+        if save_frames:
+            frame_dir = self.common_arg.frame_output_path
+            try:
+                shutil.copyfile(os.path.join(frame_dir, f"{rep:03d}.png"), os.path.join(frame_dir, f"{frame_index:03d}.png"))
+            except OSError as e:
+                TLog.e(self.TAG, f"frameIndex={frame_index} copy from {rep}: {e}")
+                return FrameResult(frame_index, False)
+        copy_ms = (time.perf_counter() - start_time) * 1000
+
+        self.counts[self.KIND_PIXEL if self.file_hashes is None else self.KIND_FILE] += 1
+        self.copy_ms += copy_ms
+        self.saved_ms += max(0.0, latency_ms - copy_ms)
+
+        # same input, so the same input hash for the incremental cache
+        result = FrameResult(frame_index, True, rep_result.data, rep_result.input_hash)
+        result.duplicate_of = rep
+        if rep_result.frame_obj:
+            result.frame_obj = FrameObj(frame_index)
+            result.frame_obj.frames = rep_result.frame_obj.frames
+        return result
+
+    def to_dict(self):
+        return {
+            "frames": sum(self.counts.values()),
+            self.KIND_FILE: self.counts[self.KIND_FILE],
+            self.KIND_PIXEL: self.counts[self.KIND_PIXEL],
+            "scan_ms": round(self.scan_ms, 3),
+            "copy_ms": round(self.copy_ms, 3),
+            "saved_ms": round(self.saved_ms, 3),
+        }
@@ -0,0 +1,282 @@
+import io
+import os
+import copy
+import time
+import threading
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from get_alpha_frame import GetAlphaFrame
+from vapx.get_mask_frame import GetMaskFrame
+from vapx.frame_set import FrameSet
+from build_manifest import BuildManifest
+from utils.build_stats import FrameStats
+from utils.log import TLog
+
+
+class FrameResult:
+    """
+    Outcome of one frame, sent back from the worker, so it has to stay small and picklable.
+    """
+    __slots__ = ("frame_index", "ok", "data", "input_hash", "skipped", "stats", "frame_obj", "duplicate_of")
+
+    def __init__(self, frame_index, ok, data=None, input_hash=None, skipped=False):
+        self.frame_index = frame_index
+        self.ok = ok
+        self.data = data  # raw frame bytes when the caller asked for them
+        self.input_hash = input_hash  # incremental mode: hash of the input png (raw frame for webm_stream)
+        self.skipped = skipped  # incremental mode: unchanged, previous output reused
+        self.stats = None  # FrameStats, timings measured in the worker
+        self.frame_obj = None  # vapx: FrameObj of the masks in this frame, None if it has none
+        self.duplicate_of = None  # dedup: frame index whose output was reused for this frame
+
+
+class FrameWorker:
+    """
+    Composites frames for one CommonArg. Runs inside executor workers, so everything
+    here must work the same in a worker thread and in a worker process.
+    """
+    TAG = "FrameWorker"
+
+    def __init__(self, common_arg):
+        self.common_arg = common_arg
+        self.get_alpha_frame = GetAlphaFrame()
+        self.get_mask_frame = GetMaskFrame()
+        # dedup: (frame_index, pixel_hash, composited frame index, png buffer, data) of the last frame
+        self.last_frame = None
+
+    def run_batch(self, frame_indices, save_frames, return_data, frames=None):
+        """
+        Composite a contiguous batch of frames.
+        frames: decoded RGBA input per frame (webm_stream), None to read the input pngs.
+        Returns a FrameResult per frame, data is the raw frame when return_data else None.
+        """
+        results = []
+        for i, frame_index in enumerate(frame_indices):
+            try:
+                if frames is not None and frames[i] is None:
+                    TLog.e(self.TAG, f"frameIndex={frame_index} was not decoded")
+                    results.append(FrameResult(frame_index, False))
+                    continue
+                raw_frame = frames[i] if frames is not None else None
+                results.append(self.run_frame(frame_index, save_frames, return_data, raw_frame))
+            except Exception as e:
+                TLog.e(self.TAG, f"createFrame error: {e}")
+                results.append(FrameResult(frame_index, False))
+        return results
+
+    def run_frame(self, frame_index, save_frames, return_data, raw_frame=None):
+        stats = FrameStats()
+        start_time = time.perf_counter()
+        self.get_alpha_frame.frame_stats = stats
+        self.get_mask_frame.frame_stats = stats
+        try:
+            result = self.build_frame(frame_index, save_frames, return_data, stats, raw_frame)
+        finally:
+            self.get_alpha_frame.frame_stats = None
+            self.get_mask_frame.frame_stats = None
+        stats.latency_ms = (time.perf_counter() - start_time) * 1000
+        result.stats = stats
+        return result
+
+    def build_frame(self, frame_index, save_frames, return_data, stats, raw_frame=None):
+        common_arg = self.common_arg
+        input_hash = None
+
+        if raw_frame is None:
+            # read once: the same bytes are hashed (incremental) and decoded
+            with stats.stage("frame.read"):
+                raw = self.get_input_file(frame_index).read_bytes()
+            stats.bytes_read = len(raw)
+        else:
+            raw = raw_frame
+
+        if common_arg.incremental:
+            input_hash = BuildManifest.hash_bytes(raw)
+            output_file = self.get_output_file(frame_index)
+            # vapx: the masks are not in the hash and every frame has to report its FrameObj
+            if (not common_arg.is_vapx and common_arg.frame_cache.get(frame_index) == input_hash
+                    and os.path.exists(output_file)):
+                data = None
+                if return_data:
+                    image = self.get_alpha_frame.load_image(output_file)
+                    with stats.stage("frame.to_bytes"):
+                        data = self.get_frame_data(GetAlphaFrame.AlphaFrameOut(image))
+                return FrameResult(frame_index, True, data, input_hash, True)
+
+        # straight to I420 unless an RGBA frame is needed for the png as well
+        yuv = common_arg.yuv_output and return_data and not save_frames
+        if raw_frame is None:
+            source = io.BytesIO(raw)
+        else:
+            # no copy, the image reads the decoder's buffer
+            source = Image.frombuffer(
+                "RGBA", (common_arg.rgb_point.w, common_arg.rgb_point.h), raw_frame, "raw", "RGBA", 0, 1
+            )
+
+        # dedup of files that differ but decode to the same pixels as the frame before
+        # (byte-identical files and webm frames are already dropped by FrameDedup in the build)
+        pixel_hash = None
+        if common_arg.dedup and raw_frame is None and not common_arg.is_vapx:
+            source = self.get_alpha_frame.load_image(source)
+            if source is not None:
+                with stats.stage("frame.pixel_hash"):
+                    pixel_hash = BuildManifest.hash_bytes(source.tobytes())
+                last = self.last_frame
+                if last is not None and last[0] == frame_index - 1 and last[1] == pixel_hash:
+                    return self.reuse_last_frame(frame_index, save_frames, input_hash, stats)
+
+        # the decode inside composite_frame counts as frame.decode, not frame.composite
+        with stats.stage("frame.composite"):
+            video_frame = self.composite_frame(frame_index, source, yuv)
+
+        frame_obj = None
+        if video_frame and common_arg.is_vapx:
+            # same for the mask pngs (frame.mask_decode)
+            with stats.stage("frame.mask"):
+                frame_obj = self.get_mask_frame.get_frame_obj(frame_index, common_arg, video_frame)
+
+        if not video_frame:
+            TLog.i(self.TAG, f"frameIndex={frame_index} is empty")
+            return FrameResult(frame_index, False)
+
+        png = None
+        if save_frames:
+            png = self.save_frame(frame_index, video_frame, stats)
+
+        data = None
+        if return_data:
+            with stats.stage("frame.to_bytes"):
+                data = self.get_frame_data(video_frame)
+        if pixel_hash is not None:
+            self.last_frame = (frame_index, pixel_hash, frame_index, png, data)
+        result = FrameResult(frame_index, True, data, input_hash)
+        result.frame_obj = frame_obj
+        return result
+
+    def reuse_last_frame(self, frame_index, save_frames, input_hash, stats):
+        last_index, pixel_hash, composited_index, png, data = self.last_frame
+        if save_frames:
+            with stats.stage("frame.write"):
+                with open(self.get_output_file(frame_index), "wb") as f:
+                    f.write(png.getbuffer())
+            stats.bytes_written += png.tell()
+        self.last_frame = (frame_index, pixel_hash, composited_index, png, data)
+        result = FrameResult(frame_index, True, data, input_hash)
+        result.duplicate_of = composited_index
+        return result
+
+    def get_frame_data(self, video_frame):
+        # raw bytes in the pixel format the encoder pipe expects
+        if self.common_arg.yuv_output and video_frame.yuv is None:
+            array = video_frame.array if video_frame.array is not None else np.asarray(video_frame.get_image())
+            return self.get_alpha_frame.rgba_to_i420(array).tobytes()
+        return video_frame.tobytes()
+
+    def get_input_file(self, frame_index):
+        # paths come from the FrameIndex scan, no per-frame stat
+        return Path(self.common_arg.frame_paths[frame_index])
+
+    def get_output_file(self, frame_index):
+        return os.path.join(self.common_arg.frame_output_path, f"{frame_index:03d}.png")
+
+    def composite_frame(self, frame_index, input_file, yuv=False):
+        common_arg = self.common_arg
+        if yuv:
+            video_frame = self.get_alpha_frame.create_frame_yuv(common_arg, input_file)
+        else:
+            video_frame = self.get_alpha_frame.create_frame(common_arg, input_file)
+        return video_frame
+
+    def save_frame(self, frame_index, video_frame, stats=None):
+        stats = stats or FrameStats()
+        with stats.stage("frame.png_encode"):
+            buf = io.BytesIO()
+            video_frame.get_image().save(buf, "PNG")
+        with stats.stage("frame.write"):
+            with open(self.get_output_file(frame_index), "wb") as f:
+                f.write(buf.getbuffer())
+        stats.bytes_written += buf.tell()
+        return buf
+
+
+# Per worker state. A process worker gets the CommonArg once through init_worker
+# instead of having it pickled with every task. Thread workers share these dicts,
+# each thread keeps its own FrameWorker: _workers[job_id][thread id].
+_jobs = {}
+_workers = {}
+_lock = threading.Lock()
+
+# A shared pool (batch builds) is never told that a job ended, its workers keep the
+# FrameWorkers of the latest few jobs only; init_shared_pool sets it to the batch's job count
+_max_shared_jobs = 2
+
+
+def init_worker(job_id, common_arg):
+    _jobs[job_id] = common_arg
+
+
+def init_shared_pool(jobs):
+    global _max_shared_jobs
+    _max_shared_jobs = max(1, jobs)
+
+
+def release_job(job_id):
+    """
+    Drop the state of a finished job. Called by the builder, so it frees what thread
+    workers hold; process workers exit with their pool or are bounded by _max_shared_jobs.
+    """
+    with _lock:
+        _jobs.pop(job_id, None)
+        _workers.pop(job_id, None)
+
+
+def get_task_arg(common_arg):
+    """
+    Copy of common_arg to pickle with every chunk of a shared process pool, without the
+    fields that grow with the frame count; each chunk carries its own, see get_task_inputs.
+    """
+    task_arg = copy.copy(common_arg)
+    task_arg.frame_paths = {}
+    task_arg.frame_cache = {}
+    task_arg.frame_set = FrameSet()
+    return task_arg
+
+
+def get_task_inputs(common_arg, frame_indices):
+    # (frame_paths, frame_cache) of the chunk's frames
+    frame_paths = {}
+    if common_arg.frame_paths:
+        frame_paths = {i: common_arg.frame_paths[i] for i in frame_indices}
+    frame_cache = {i: common_arg.frame_cache[i] for i in frame_indices if i in common_arg.frame_cache}
+    return frame_paths, frame_cache
+
+
+def run_frame_batch(job_id, frame_indices, save_frames, return_data, common_arg=None, frames=None, inputs=None):
+    """
+    Executor entry point (module level so it can be pickled).
+    common_arg is only passed when the pool was not created with init_worker for this job,
+    frames only when the input is decoded by the caller (webm_stream), inputs only with a
+    common_arg from get_task_arg.
+    """
+    with _lock:
+        workers = _workers.pop(job_id, None)
+        if workers is None:
+            workers = {}
+            if common_arg is not None:
+                # shared pool job: evict the least recently used ones of those
+                shared = [key for key in _workers if key not in _jobs]
+                for key in shared[:max(0, len(shared) - _max_shared_jobs + 1)]:
+                    del _workers[key]
+        # (re)inserted last, _workers runs from least to most recently used
+        _workers[job_id] = workers
+
+        worker = workers.get(threading.get_ident())
+        if worker is None:
+            worker = workers[threading.get_ident()] = FrameWorker(common_arg or _jobs[job_id])
+
+    if inputs is not None:
+        worker.common_arg.frame_paths, worker.common_arg.frame_cache = inputs
+    return worker.run_batch(frame_indices, save_frames, return_data, frames)
@@ -1,17 +1,131 @@
 from data.point_rect import PointRect
+from utils.trim_util import TrimUtil
 from PIL import Image
 import numpy as np
 
+
+class FrameBuffers:
+    """
+    Canvas and scratch buffers owned by one worker and reused for every frame it composites,
+    instead of allocating (and throwing away) several full-size images per frame.
+    Buffers are keyed by size, so they are allocated once per CommonArg layout.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+
+    def get_image(self, mode, size, color):
+        # PIL images filled with a constant color; callers must not write into them
+        key = ("image", mode, size, color)
+        img = self.buffers.get(key)
+        if img is None:
+            img = self.buffers[key] = Image.new(mode, size, color)
+        return img
+
+    def get_canvas_image(self, size):
+        # PIL output canvas, starts opaque black and is written in place
+        key = ("canvas_image", size)
+        img = self.buffers.get(key)
+        if img is None:
+            img = self.buffers[key] = Image.new("RGBA", size, (0, 0, 0, 255))
+        return img
+
+    def get_canvas(self, w, h):
+        # numpy output canvas, starts opaque black and is written in place
+        key = ("canvas", w, h)
+        arr = self.buffers.get(key)
+        if arr is None:
+            arr = self.buffers[key] = np.zeros((h, w, 4), dtype=np.uint8)
+            arr[..., 3] = 255
+        return arr
+
+    def get_i420(self, w, h):
+        """
+        One contiguous planar I420 frame (Y, then U, then V) plus plane views into it.
+        Starts as black: Y=16, U=V=128.
+        """
+        key = ("i420", w, h)
+        planes = self.buffers.get(key)
+        if planes is None:
+            yuv = np.empty(w * h * 3 // 2, dtype=np.uint8)
+            y = yuv[:w * h].reshape(h, w)
+            u = yuv[w * h:w * h * 5 // 4].reshape(h // 2, w // 2)
+            v = yuv[w * h * 5 // 4:].reshape(h // 2, w // 2)
+            y[...] = 16
+            u[...] = 128
+            v[...] = 128
+            planes = self.buffers[key] = (yuv, y, u, v)
+        return planes
+
+    def get_scratch(self, name, h, w, c, dtype):
+        key = ("scratch", name, h, w, c, np.dtype(dtype).str)
+        arr = self.buffers.get(key)
+        if arr is None:
+            arr = self.buffers[key] = np.empty((h, w, c), dtype=dtype)
+        return arr
+
+    def nbytes(self):
+        total = 0
+        for buf in self.buffers.values():
+            if isinstance(buf, np.ndarray):
+                total += buf.nbytes
+            elif isinstance(buf, tuple):
+                total += buf[0].nbytes
+            else:
+                total += buf.width * buf.height * len(buf.getbands())
+        return total
+
+
 class GetAlphaFrame:
+    """
+    Not thread safe: each worker owns its own GetAlphaFrame and the buffers in it.
+    The returned frame lives in those buffers and is only valid until the next create_frame call.
+    """
+
+    COMPOSITOR_PIL = "pil"
+    COMPOSITOR_NUMPY = "numpy"
+
+    OPAQUE_BLACK = 0xFF000000  # RGBA (0, 0, 0, 255) as a little endian uint32 pixel
+    # numpy compositor: pixels per block of array ops, its scratch (4 x 256 KB) stays in the L2 cache
+    BLOCK_PIXELS = 1 << 16
+
+    # BT.601 limited range, the same matrix ffmpeg uses for rgb -> yuv420p by default.
+    # Gray (r=g=b) has no chroma, so the alpha half only needs Y, through this table.
+    GRAY_TO_Y = ((np.arange(256, dtype=np.uint16) * (66 + 129 + 25) + 128 >> 8) + 16).astype(np.uint8)
     
     class AlphaFrameOut:
-        def __init__(self, argb=None):
+        def __init__(self, argb=None, array=None, yuv=None):
             # We assume argb in Python will be a PILLOW IMAGE object for efficiency
             # instead of a massive int array.
             self.image = argb # PIL Image
+            # numpy compositor: (output_h, output_w, 4) uint8 RGBA, same pixels as image
+            self.array = array
+            # yuv mode: planar I420 (output_w x output_h), ready for -f rawvideo -pix_fmt yuv420p
+            self.yuv = yuv
+
+        def get_image(self):
+            if self.image is None:
+                self.image = Image.fromarray(self.array, "RGBA")
+            return self.image
+
+        def tobytes(self):
+            if self.yuv is not None:
+                return self.yuv.tobytes()
+            if self.array is not None:
+                return self.array.tobytes()
+            return self.image.tobytes()
+
+    def __init__(self):
+        self.buffers = FrameBuffers()
+        self.frame_stats = None  # FrameStats of the frame being built, decode time goes there
 
     def create_frame(self, common_arg, input_file):
-        if not input_file or not input_file.exists():
+        if common_arg.compositor == self.COMPOSITOR_NUMPY:
+            return self.create_frame_numpy(common_arg, input_file)
+
+        # a Path, an already read file object (BytesIO) or a decoded Image (webm_stream);
+        # a missing file fails in load_image
+        if not input_file:
             return None
             
         w = common_arg.rgb_point.w
@@ -19,32 +133,57 @@ class GetAlphaFrame:
         out_w = common_arg.output_w
         out_h = common_arg.output_h
         
-        try:
-            input_buf = Image.open(input_file).convert("RGBA")
-        except Exception:
+        input_buf = self.load_image(input_file)
+        if input_buf is None:
             return None
+        input_buf = TrimUtil.crop(input_buf, common_arg.trim_rect)
             
         # Create output image (canvas)
         # Background strictly 0x00000000 ? Java fills with 0xff000000 (Opaque Black)
         # "Arrays.fill(outputArgb, 0xff000000);"
         # So background is Opaque Black.
-        output_img = Image.new("RGBA", (out_w, out_h), (0, 0, 0, 255))
+        # The canvas is reused across frames, only the rgb/alpha regions are ever written.
+        output_img = self.buffers.get_canvas_image((out_w, out_h))
         
+        # Fill RGB area
+        self.fill_color(output_img, common_arg.rgb_point, False, input_buf)
+
+        if common_arg.is_opaque:
+            # no alpha area, aFrame points into a white block
+            block = common_arg.opaque_block
+            output_img.paste((255, 255, 255, 255), (block.x, block.y, block.x + block.w, block.y + block.h))
+            return self.AlphaFrameOut(output_img)
+
         alpha_buf = input_buf
         
         if common_arg.scale < 1.0:
             new_w = int(w * common_arg.scale)
             new_h = int(h * common_arg.scale)
             alpha_buf = input_buf.resize((new_w, new_h), Image.BILINEAR)
-            
-        # Fill RGB area
-        self.fill_color(output_img, common_arg.rgb_point, False, input_buf)
         
         # Fill Alpha area
         self.fill_color(output_img, common_arg.alpha_point, True, alpha_buf)
         
         return self.AlphaFrameOut(output_img)
 
+    def load_image(self, input_file):
+        if self.frame_stats is None:
+            return self.decode_image(input_file)
+        with self.frame_stats.stage("frame.decode"):
+            return self.decode_image(input_file)
+
+    def decode_image(self, input_file):
+        if isinstance(input_file, Image.Image):
+            # already decoded (webm_stream)
+            return input_file
+        try:
+            with Image.open(input_file) as img:
+                img.load()
+                # convert() always copies, skip it for the common RGBA case
+                return img if img.mode == "RGBA" else img.convert("RGBA")
+        except Exception:
+            return None
+
     def fill_color(self, output_img, point, is_alpha, input_img):
         # Determine source matching region?
         # Java logic: iterates x,y from 0 to point.w/h.
@@ -63,7 +202,14 @@ class GetAlphaFrame:
         if copy_w <= 0 or copy_h <= 0:
             return
 
-        source_region = input_img.crop((0, 0, copy_w, copy_h))
+        if copy_w < point.w or copy_h < point.h:
+            # reused canvas: clear what a smaller frame would not overwrite
+            output_img.paste((0, 0, 0, 255), (point.x, point.y, point.x + point.w, point.y + point.h))
+
+        if (copy_w, copy_h) == input_img.size:
+            source_region = input_img
+        else:
+            source_region = input_img.crop((0, 0, copy_w, copy_h))
         
         if is_alpha:
             processed = self.process_alpha_region(source_region)
@@ -79,8 +225,8 @@ class GetAlphaFrame:
         # Basically premultiplied alpha on black?
         # But maintains Alpha=255 (Opaque) result.
         
-        # Create a black background image
-        bg = Image.new("RGBA", img.size, (0, 0, 0, 255))
+        # Black background image (shared, alpha_composite does not modify it)
+        bg = self.buffers.get_image("RGBA", img.size, (0, 0, 0, 255))
         
         # Composite img over bg
         # Image.alpha_composite requires both RGBA
@@ -99,11 +245,256 @@ class GetAlphaFrame:
         # Returns grayscale opaque pixel based on Alpha channel.
         
         # Extract alpha
-        r, g, b, a = img.split()
+        a = img.getchannel("A")
         
         # Create new image where R=G=B=A_channel, A=255
-        opaque = Image.new("L", img.size, 255)
+        opaque = self.buffers.get_image("L", img.size, 255)
         
         # Use 'a' as the grayscale value
         res = Image.merge("RGBA", (a, a, a, opaque))
         return res
+
+    def create_frame_numpy(self, common_arg, input_file):
+        """
+        Same output as the PIL path (bit-exact), but the black background blend,
+        alpha-to-gray and placement are done as array ops on one output buffer.
+        """
+        # a Path or an already read file object (BytesIO); a missing file fails in load_image
+        if not input_file:
+            return None
+
+        input_buf = self.load_image(input_file)
+        if input_buf is None:
+            return None
+        input_buf = TrimUtil.crop(input_buf, common_arg.trim_rect)
+
+        # Opaque black canvas, reused across frames
+        output = self.buffers.get_canvas(common_arg.output_w, common_arg.output_h)
+
+        input_arr = np.asarray(input_buf)
+        self.fill_color_array(output, common_arg.rgb_point, False, input_arr)
+
+        if common_arg.is_opaque:
+            block = common_arg.opaque_block
+            output[block.y:block.y + block.h, block.x:block.x + block.w, :3] = 255
+            return self.AlphaFrameOut(array=output)
+
+        alpha_arr = input_arr
+        if common_arg.scale < 1.0:
+            alpha_arr = self.scale_alpha(common_arg, input_buf)
+        self.fill_color_array(output, common_arg.alpha_point, True, alpha_arr)
+
+        return self.AlphaFrameOut(array=output)
+
+    def scale_alpha(self, common_arg, input_buf):
+        """
+        The alpha channel scaled for the alpha area, as an (h, w) uint8 array. PIL's bilinear RGBA
+        resize (the PIL path) gives the same alpha, premultiplying only changes the color,
+        so the channel is resized on its own at a third of the cost.
+        """
+        size = (int(common_arg.rgb_point.w * common_arg.scale), int(common_arg.rgb_point.h * common_arg.scale))
+        return np.asarray(input_buf.getchannel("A").resize(size, Image.BILINEAR))
+
+    def fill_color_array(self, output, point, is_alpha, input_arr):
+        """
+        input_arr: (h, w, 4) uint8 RGBA, or for the alpha area also an (h, w) uint8 alpha plane.
+        """
+        # Same top-left crop as fill_color, clipped to the canvas like Image.paste
+        out_h, out_w = output.shape[:2]
+        copy_w = min(point.w, input_arr.shape[1], out_w - point.x)
+        copy_h = min(point.h, input_arr.shape[0], out_h - point.y)
+
+        if copy_w <= 0 or copy_h <= 0:
+            return
+
+        # one uint32 per RGBA pixel, the math runs on whole pixels instead of strided channels
+        pixels = output.view("<u4")[..., 0]
+        if copy_w < point.w or copy_h < point.h:
+            # reused canvas: clear what a smaller frame would not overwrite
+            pixels[point.y:point.y + point.h, point.x:point.x + point.w] = self.OPAQUE_BLACK
+
+        src = (self.get_pixels(input_arr) if input_arr.ndim == 3 else input_arr)[:copy_h, :copy_w]
+        dst = pixels[point.y:point.y + copy_h, point.x:point.x + copy_w]
+
+        if is_alpha:
+            self.alpha_to_gray(src, dst)
+        else:
+            self.premultiply(src, dst)
+
+    @staticmethod
+    def get_pixels(input_arr):
+        # (h, w, 4) uint8 RGBA -> (h, w) uint32 view, one element per pixel
+        return input_arr.view("<u4")[..., 0]
+
+    def iter_blocks(self, src, dst, names):
+        """
+        Yield (src, dst, scratch...) per block of BLOCK_PIXELS, so one block's scratch
+        stays in the cpu cache between the ops on it.
+        """
+        h, w = src.shape
+        rows = max(1, min(h, self.BLOCK_PIXELS // w))
+        scratch = [self.buffers.get_scratch(name, rows, w, 1, np.uint32)[..., 0] for name in names]
+        for y in range(0, h, rows):
+            n = min(rows, h - y)
+            yield (src[y:y + n], dst[y:y + n]) + tuple(buf[:n] for buf in scratch)
+
+    def alpha_to_gray(self, src, dst):
+        # gray = alpha, opaque; src: uint32 RGBA pixels or a uint8 alpha plane
+        for src_block, dst_block, alpha in self.iter_blocks(src, dst, ("alpha",)):
+            if src_block.dtype == np.uint8:
+                np.multiply(src_block, 0x010101, out=alpha, dtype=np.uint32)
+            else:
+                np.right_shift(src_block, 24, out=alpha)
+                np.multiply(alpha, 0x010101, out=alpha)
+            np.bitwise_or(alpha, self.OPAQUE_BLACK, out=dst_block)
+
+    def premultiply(self, src, dst=None):
+        """
+        Color over opaque black, round(c * a / 255) as Image.alpha_composite rounds it.
+        src: (h, w) uint32 RGBA pixels (get_pixels), the result goes as opaque pixels into
+        dst (same shape, default a scratch buffer). Returns dst.
+
+        r and b are multiplied side by side in the 16 bit lanes of one uint32 (255 * 255 + 255
+        still fits a lane), g on its own; all ops run in place on contiguous uint32 scratch.
+        """
+        h, w = src.shape
+        if dst is None:
+            dst = self.buffers.get_scratch("premultiplied", h, w, 1, np.uint32)[..., 0]
+        blocks = self.iter_blocks(src, dst, ("alpha", "blend_rb", "blend_g", "blend_tmp"))
+        for src_block, dst_block, alpha, rb, g, tmp in blocks:
+            np.right_shift(src_block, 24, out=alpha)
+
+            # x = c * a + 128, c' = (x + (x >> 8)) >> 8 per lane
+            np.bitwise_and(src_block, 0x00FF00FF, out=rb)
+            np.multiply(rb, alpha, out=rb)
+            np.add(rb, 0x00800080, out=rb)
+            np.right_shift(rb, 8, out=tmp)
+            np.bitwise_and(tmp, 0x00FF00FF, out=tmp)
+            np.add(rb, tmp, out=rb)
+            np.right_shift(rb, 8, out=rb)
+            np.bitwise_and(rb, 0x00FF00FF, out=rb)
+
+            # g: the same, left in its byte of the pixel (bits 8-15)
+            np.right_shift(src_block, 8, out=g)
+            np.bitwise_and(g, 0xFF, out=g)
+            np.multiply(g, alpha, out=g)
+            np.add(g, 128, out=g)
+            np.right_shift(g, 8, out=tmp)
+            np.add(g, tmp, out=g)
+            np.bitwise_and(g, 0xFF00, out=g)
+
+            np.bitwise_or(rb, g, out=rb)
+            np.bitwise_or(rb, self.OPAQUE_BLACK, out=dst_block)
+        return dst
+
+    def create_frame_yuv(self, common_arg, input_file):
+        """
+        Composite straight into a planar I420 frame, skipping the RGBA canvas and ffmpeg's
+        rgba -> yuv420p conversion. Frame size is output_w x output_h (16-aligned, so even).
+        Gives the same I420 as rgba_to_i420() on the create_frame_numpy output.
+        """
+        if not input_file:
+            return None
+
+        input_buf = self.load_image(input_file)
+        if input_buf is None:
+            return None
+        input_buf = TrimUtil.crop(input_buf, common_arg.trim_rect)
+
+        yuv, y, u, v = self.buffers.get_i420(common_arg.output_w, common_arg.output_h)
+
+        # rgb half: premultiplied color -> Y and U/V
+        point = common_arg.rgb_point
+        input_arr = np.asarray(input_buf)
+        src = self.clip_input(y, point, self.get_pixels(input_arr))
+        if src is not None:
+            if src.shape[0] < point.h or src.shape[1] < point.w:
+                # reused buffer: clear what a smaller frame would not overwrite
+                self.write_i420_rgb(y, u, v, np.zeros((point.h, point.w, 3), np.uint16), point.x, point.y)
+            rgba = self.premultiply(src).view(np.uint8).reshape(src.shape + (4,))
+            self.write_i420_rgb(y, u, v, rgba[..., :3], point.x, point.y)
+
+        if common_arg.is_opaque:
+            # white has no chroma and the block is even aligned: only Y changes
+            block = common_arg.opaque_block
+            y[block.y:block.y + block.h, block.x:block.x + block.w] = self.GRAY_TO_Y[255]
+            return self.AlphaFrameOut(yuv=yuv)
+
+        if common_arg.scale < 1.0:
+            alpha = self.scale_alpha(common_arg, input_buf)
+        else:
+            alpha = input_arr[..., 3]
+
+        # alpha half: gray = alpha, only Y changes (U/V stay 128)
+        point = common_arg.alpha_point
+        src = self.clip_input(y, point, alpha)
+        if src is not None:
+            if src.shape[0] < point.h or src.shape[1] < point.w:
+                y[point.y:point.y + point.h, point.x:point.x + point.w] = 16
+            y[point.y:point.y + src.shape[0], point.x:point.x + src.shape[1]] = self.GRAY_TO_Y[src]
+
+        return self.AlphaFrameOut(yuv=yuv)
+
+    def rgba_to_i420(self, array):
+        """
+        Convert an opaque RGBA canvas (e.g. a cached frame png) to the same I420 create_frame_yuv gives.
+        """
+        out_h, out_w = array.shape[:2]
+        yuv, y, u, v = self.buffers.get_i420(out_w, out_h)
+        self.write_i420_rgb(y, u, v, array[..., :3].astype(np.uint16), 0, 0)
+        return yuv
+
+    def clip_input(self, plane, point, input_arr):
+        # same top-left crop and canvas clipping as fill_color_array
+        out_h, out_w = plane.shape
+        copy_w = min(point.w, input_arr.shape[1], out_w - point.x)
+        copy_h = min(point.h, input_arr.shape[0], out_h - point.y)
+        if copy_w <= 0 or copy_h <= 0:
+            return None
+        return input_arr[:copy_h, :copy_w]
+
+    def write_i420_rgb(self, y, u, v, rgb, x0, y0):
+        """
+        Write an opaque rgb block (uint8 or uint16 values 0-255) at (x0, y0) into the I420 planes.
+
+        Chroma is the 2x2 block average. Gray and black pixels add nothing to the
+        U/V weighted sums, so blocks shared with the alpha half or the padding come out
+        right without looking at those pixels.
+        """
+        h, w = rgb.shape[:2]
+        r = rgb[..., 0]
+        g = rgb[..., 1]
+        b = rgb[..., 2]
+
+        # Y = ((66R + 129G + 25B + 128) >> 8) + 16, fits in uint16
+        luma = self.buffers.get_scratch("luma", h, w, 1, np.uint16)[..., 0]
+        tmp = self.buffers.get_scratch("luma_tmp", h, w, 1, np.uint16)[..., 0]
+        np.multiply(r, 66, out=luma, dtype=np.uint16)
+        np.multiply(g, 129, out=tmp, dtype=np.uint16)
+        luma += tmp
+        np.multiply(b, 25, out=tmp, dtype=np.uint16)
+        luma += tmp
+        luma += 128
+        luma >>= 8
+        luma += 16
+        np.copyto(y[y0:y0 + h, x0:x0 + w], luma, casting="unsafe")
+
+        # 2x2 sums over the even-aligned area around the block, outside pixels count as 0
+        px = x0 % 2
+        py = y0 % 2
+        eh = (h + py + 1) // 2 * 2
+        ew = (w + px + 1) // 2 * 2
+        padded = self.buffers.get_scratch("chroma", eh, ew, 3, np.int32)
+        if (eh, ew) != (h, w):
+            padded[...] = 0
+        padded[py:py + h, px:px + w] = rgb
+        sums = padded[0::2, 0::2] + padded[1::2, 0::2] + padded[0::2, 1::2] + padded[1::2, 1::2]
+        sr = sums[..., 0]
+        sg = sums[..., 1]
+        sb = sums[..., 2]
+
+        cy = y0 // 2
+        cx = x0 // 2
+        ch, cw = sr.shape
+        u[cy:cy + ch, cx:cx + cw] = ((-38 * sr - 74 * sg + 112 * sb + 512) >> 10) + 128
+        v[cy:cy + ch, cx:cx + cw] = ((112 * sr - 94 * sg - 18 * sb + 512) >> 10) + 128
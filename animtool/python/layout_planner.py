@@ -0,0 +1,176 @@
+from data.point_rect import PointRect
+from variant_matrix import VariantMatrix
+from utils.log import TLog
+
+
+class LayoutPlan:
+    """
+    One video layout: where the rgb and alpha areas go, the 16 aligned video size,
+    and what decoding it costs at fps.
+    """
+
+    def __init__(self, rgb_w, rgb_h, scale, gap, is_v_layout):
+        self.scale = scale
+        self.gap = gap
+        self.is_v_layout = is_v_layout
+        self.rgb_point = PointRect(0, 0, rgb_w, rgb_h)
+        alpha_w = int(rgb_w * scale)
+        alpha_h = int(rgb_h * scale)
+        if is_v_layout:
+            self.alpha_point = PointRect(0, rgb_h + gap, alpha_w, alpha_h)
+            self.output_w = rgb_w
+            self.output_h = rgb_h + gap + alpha_h
+        else:
+            self.alpha_point = PointRect(rgb_w + gap, 0, alpha_w, alpha_h)
+            self.output_w = rgb_w + gap + alpha_w
+            self.output_h = rgb_h
+        self.output_w = LayoutPlanner.align(self.output_w)
+        self.output_h = LayoutPlanner.align(self.output_h)
+        self.macroblocks = (self.output_w // 16) * (self.output_h // 16)
+        self.fps = 0
+        self.level = None
+        self.violations = []
+
+    def check(self, fps, level, max_size):
+        """
+        Limits this layout breaks at fps: max_size (px, either side) and the level's
+        frame size and macroblock rate.
+        """
+        name, max_frame_mbs, max_mb_rate = level
+        self.fps = fps
+        self.level = level
+        self.violations = []
+        if max(self.output_w, self.output_h) > max_size:
+            self.violations.append(f"size {self.output_w}x{self.output_h} > {max_size}")
+        if self.macroblocks > max_frame_mbs:
+            self.violations.append(f"{self.macroblocks} macroblocks/frame > {max_frame_mbs} ({name})")
+        if self.get_mb_rate() > max_mb_rate:
+            self.violations.append(f"{self.get_mb_rate()} macroblocks/s > {max_mb_rate} ({name})")
+        return not self.violations
+
+    def get_mb_rate(self):
+        return self.macroblocks * self.fps
+
+    def get_load(self):
+        # share of the level's macroblock rate, what a decoder built for exactly that level has to sustain
+        return self.get_mb_rate() / self.level[2]
+
+    def apply(self, common_arg):
+        common_arg.scale = self.scale
+        common_arg.gap = self.gap
+        common_arg.is_v_layout = self.is_v_layout
+        alpha_point = self.alpha_point
+        common_arg.alpha_point = PointRect(alpha_point.x, alpha_point.y, alpha_point.w, alpha_point.h)
+        common_arg.output_w = self.output_w
+        common_arg.output_h = self.output_h
+
+    def to_dict(self):
+        return {
+            "layout": "v" if self.is_v_layout else "h",
+            "scale": self.scale,
+            "gap": self.gap,
+            "outputW": self.output_w,
+            "outputH": self.output_h,
+            "aFrame": [self.alpha_point.x, self.alpha_point.y, self.alpha_point.w, self.alpha_point.h],
+            "macroblocks": self.macroblocks,
+            "fps": self.fps,
+            "mb_rate": self.get_mb_rate(),
+            "level": self.level[0],
+            "decode_load": round(self.get_load(), 4),
+            "violations": self.violations,
+        }
+
+    def __str__(self):
+        return (f"{'v' if self.is_v_layout else 'h'} layout, scale={self.scale}, gap={self.gap}, "
+                f"{self.output_w}x{self.output_h}, {self.macroblocks} macroblocks/frame, {self.get_mb_rate()} macroblocks/s "
+                f"at {self.fps} fps, decode load {self.get_load():.1%} of {self.level[0]}")
+
+
+class LayoutPlanner:
+    """
+    Picks the layout with the fewest macroblocks per frame (16x16, what the decoder works through)
+    over orientation, alpha scale (0.5 up to CommonArg.scale) and the gap before the alpha area:
+    none, or up to the next macroblock so rgb and alpha never share one.
+
+    A layout must stay within CommonArg.max_size and the level 4.0 limits of the codec at the
+    build's fps. Ties go to the larger alpha scale (padding that would be encoded anyway holds
+    more alpha detail), then to the macroblock aligned gap, then to the default orientation.
+    """
+    TAG = "LayoutPlanner"
+    MIN_SCALE = 0.5
+    SCALE_STEP = 0.01
+
+    # (name, max macroblocks per frame, max macroblocks per second)
+    # h264: MaxFS / MaxMBPS of level 4.0, h265: MaxLumaPs / MaxLumaSr of level 4 in 16x16 blocks
+    LEVEL_H264 = ("h264 level 4.0", 8192, 245760)
+    LEVEL_H265 = ("h265 level 4.0", 2228224 // 256, 66846720 // 256)
+
+    @staticmethod
+    def align(size):
+        return (size + 15) // 16 * 16
+
+    @staticmethod
+    def get_default(common_arg):
+        """
+        The layout of the Java tool: alpha at common_arg.scale, on the side that keeps the longer side shorter.
+        """
+        w, h = common_arg.rgb_point.w, common_arg.rgb_point.h
+        gap = common_arg.gap
+        h_max = max(w + gap + int(w * common_arg.scale), h)
+        v_max = max(w, h + gap + int(h * common_arg.scale))
+        return LayoutPlan(w, h, common_arg.scale, gap, h_max > v_max)
+
+    @staticmethod
+    def get_limits(common_arg):
+        """
+        (fps, level) to plan for: a layout is shared by every variant, so the highest fps and
+        the tighter codec of the variant matrix count.
+        """
+        fps_list = [common_arg.fps]
+        codecs = ["h265" if common_arg.enable_h265 else "h264"]
+        if VariantMatrix.is_enabled(common_arg):
+            try:
+                fps_list = [int(fps) for fps in VariantMatrix.split(common_arg.variant_fps)] or fps_list
+            except ValueError:
+                pass  # reported when the variant matrix is created
+            codecs = VariantMatrix.split(common_arg.variant_codecs) or codecs
+        level = LayoutPlanner.LEVEL_H264 if "h264" in codecs else LayoutPlanner.LEVEL_H265
+        return max(fps_list), level
+
+    @staticmethod
+    def get_scales(max_scale):
+        steps = int(round((max_scale - LayoutPlanner.MIN_SCALE) / LayoutPlanner.SCALE_STEP))
+        scales = [round(LayoutPlanner.MIN_SCALE + i * LayoutPlanner.SCALE_STEP, 2) for i in range(steps + 1)]
+        if max_scale not in scales:
+            scales.append(max_scale)
+        return scales
+
+    @staticmethod
+    def search(common_arg):
+        """
+        Best LayoutPlan for common_arg. If no layout fits the limits, the one with the
+        fewest macroblocks, with its violations set.
+        """
+        w, h = common_arg.rgb_point.w, common_arg.rgb_point.h
+        fps, level = LayoutPlanner.get_limits(common_arg)
+        default = LayoutPlanner.get_default(common_arg)
+
+        best = None
+        best_key = None
+        checked = 0
+        fitting = 0
+        for scale in LayoutPlanner.get_scales(common_arg.scale):
+            for is_v_layout in (False, True):
+                aligned_gap = LayoutPlanner.align(h if is_v_layout else w) - (h if is_v_layout else w)
+                for gap in sorted({common_arg.gap, max(common_arg.gap, aligned_gap)}):
+                    plan = LayoutPlan(w, h, scale, gap, is_v_layout)
+                    fits = plan.check(fps, level, common_arg.max_size)
+                    checked += 1
+                    fitting += fits
+                    key = (not fits, plan.macroblocks, -scale, gap != aligned_gap, is_v_layout != default.is_v_layout)
+                    if best_key is None or key < best_key:
+                        best, best_key = plan, key
+
+        default.check(fps, level, common_arg.max_size)
+        TLog.i(LayoutPlanner.TAG, f"{checked} layouts checked, {fitting} fit; default: {default}")
+        return best
@@ -2,6 +2,7 @@ import sys
 import os
 from anim_tool import AnimTool, IToolListener
 from common_arg import CommonArg
+from vapx.src_set import SrcSet
 
 
 class Main:  # Helper class not really used, script runs via run()
@@ -27,20 +28,38 @@ class ConsoleToolListener(IToolListener):
     def on_complete(self):
         print(f"onComplete: {self.common_arg.output_path}")
 
+    def on_encode_progress(self, progress):
+        speed = f"{progress.speed}x" if progress.speed is not None else "N/A"
+        print(f"onEncodeProgress: frame={progress.frame}/{self.common_arg.total_frame} "
+              f"fps={progress.fps:.1f} speed={speed}")
 
-def run(args_list=None):
-    import argparse
-
-    parser = argparse.ArgumentParser(description="AnimTool Python Port (Make4K)")
 
-    parser.add_argument("-i", "--input", required=True, help="Input directory path")
+def add_common_args(parser):
+    """
+    Build options shared by the single build and the batch mode.
+    """
     parser.add_argument(
         "-f", "--ffmpeg", default="ffmpeg", help="FFmpeg executable path"
     )
+    parser.add_argument(
+        "--ffprobe", default="", help="FFprobe executable path (default: next to ffmpeg)"
+    )
     parser.add_argument(
         "-m", "--mp4edit", default=None, help="Mp4edit executable path; mp4edit|None,default None, no vapc.json to write;"
     )
 
+    parser.add_argument(
+        "--native-vapc",
+        action="store_true",
+        help="Write the vapc box into the mp4 in process (no mp4edit needed)",
+    )
+
+    parser.add_argument(
+        "--sha256",
+        action="store_true",
+        help="Also write sha256.txt (computed in the same pass as md5)",
+    )
+
     # H265 handling: default True, support --no-h265
     parser.add_argument("--h265", dest="h265", action="store_true", help="Enable H265")
     parser.add_argument(
@@ -56,8 +75,171 @@ def run(args_list=None):
         "-fkps", "--force_key_frames", default="0.000", help="Force key frames"
     )
 
+    parser.add_argument(
+        "--no-pipeline",
+        dest="pipeline",
+        action="store_false",
+        help="Composite all frames first, then encode frames/*.png (no overlap)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Pipe composited frames straight into ffmpeg, no frames/*.png",
+    )
+    parser.add_argument(
+        "--keep-frames",
+        action="store_true",
+        help="With --stream, still write frames/*.png for debugging",
+    )
+
+    parser.add_argument(
+        "--compositor",
+        choices=["pil", "numpy"],
+        default="pil",
+        help="Frame compositing engine (numpy is faster, identical output)",
+    )
+
+    parser.add_argument(
+        "--yuv",
+        action="store_true",
+        help="Composite straight to yuv420p and pipe that to ffmpeg (implies --stream)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Frame compositing workers (default: one per available core)",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=["auto", "thread", "process"],
+        default="auto",
+        help="Frame worker backend (auto: processes on multi-core machines)",
+    )
+
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only recomposite frames that changed since the last build in the same output dir",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Composite repeated (hold) frames once and reuse the result for every repeat",
+    )
+    parser.add_argument(
+        "--trim",
+        action="store_true",
+        help="Crop all frames to the union bounding box of their visible pixels (offset goes into vapc info)",
+    )
+    parser.add_argument(
+        "--optimize-layout",
+        action="store_true",
+        help="Pick orientation, alpha scale and gap for the fewest macroblocks within --max-size and level 4.0",
+    )
+    parser.add_argument(
+        "--max-size",
+        type=int,
+        default=1504,
+        help="Max video width/height (default: 1504, larger shows a green screen on some devices)",
+    )
+    parser.add_argument(
+        "--opaque",
+        action="store_true",
+        help="If every frame is fully opaque, encode the rgb area only, without the alpha half",
+    )
+    parser.add_argument(
+        "--segments",
+        type=int,
+        default=1,
+        help="Encode in this many key frame aligned segments at once, joined losslessly (0: by available cores)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=0,
+        help="Stop any single ffmpeg/mp4edit run after this many seconds (default: no limit)",
+    )
+    parser.add_argument(
+        "--variant-codecs",
+        default="",
+        help="Variant matrix: codecs to encode, e.g. h264,h265",
+    )
+    parser.add_argument(
+        "--variant-rates",
+        default="",
+        help="Variant matrix: bitrates in kbps and/or crf values, e.g. 15000,8000,crf28",
+    )
+    parser.add_argument(
+        "--variant-fps",
+        default="",
+        help="Variant matrix: frame rates, e.g. 25,30",
+    )
+    parser.add_argument(
+        "--webm-stream",
+        action="store_true",
+        help="WebM input: decode frames straight into the compositor (no frames_original/*.png)",
+    )
+
+
+def apply_common_args(args, common_arg):
+    common_arg.ffmpeg_cmd = args.ffmpeg
+    common_arg.ffprobe_cmd = args.ffprobe
+    common_arg.mp4edit_cmd = args.mp4edit
+    common_arg.native_vapc = args.native_vapc
+    common_arg.sha256 = args.sha256
+    common_arg.enable_h265 = args.h265
+    common_arg.bitrate = args.bitrate
+    common_arg.fps = args.fps
+    common_arg.force_key_frames = args.force_key_frames
+    common_arg.pipeline = args.pipeline
+    common_arg.stream_frames = args.stream or args.yuv
+    common_arg.keep_frames = args.keep_frames
+    common_arg.compositor = args.compositor
+    common_arg.yuv_output = args.yuv
+    common_arg.workers = args.workers
+    common_arg.executor = args.executor
+    common_arg.incremental = args.incremental
+    common_arg.dedup = args.dedup
+    common_arg.trim = args.trim
+    common_arg.optimize_layout = args.optimize_layout
+    common_arg.max_size = args.max_size
+    common_arg.opaque = args.opaque
+    common_arg.segments = args.segments
+    common_arg.webm_stream = args.webm_stream
+    common_arg.process_timeout = args.timeout
+    common_arg.variant_codecs = args.variant_codecs
+    common_arg.variant_rates = args.variant_rates
+    common_arg.variant_fps = args.variant_fps
+
+
+def run(args_list=None):
+    import argparse
+
+    if args_list is None:
+        args_list = sys.argv[1:]
+    if args_list and args_list[0] == "batch":
+        return run_batch(args_list[1:])
+    if args_list and args_list[0] == "scan":
+        return run_scan(args_list[1:])
+
+    parser = argparse.ArgumentParser(description="AnimTool Python Port (Make4K)")
+
+    parser.add_argument("-i", "--input", required=True, help="Input directory path (or .webm file)")
     # Optional output path (not in Make4K params but useful)
     parser.add_argument("-o", "--output", help="Output directory")
+    parser.add_argument(
+        "--max-encoders",
+        type=int,
+        default=0,
+        help="Variant matrix: max concurrent ffmpeg encodes (default: one per variant)",
+    )
+    parser.add_argument(
+        "--vapx",
+        default=None,
+        help="Fusion animation: json file listing the mask srcs (srcPath, srcType, srcTag, fitType ...)",
+    )
+    add_common_args(parser)
 
     args = parser.parse_args(args_list)
 
@@ -74,12 +256,16 @@ def run(args_list=None):
 
     common_arg = CommonArg()
     common_arg.input_path = args.input
-    common_arg.ffmpeg_cmd = args.ffmpeg
-    common_arg.mp4edit_cmd = args.mp4edit
-    common_arg.enable_h265 = args.h265
-    common_arg.bitrate = args.bitrate
-    common_arg.fps = args.fps
-    common_arg.force_key_frames = args.force_key_frames
+    apply_common_args(args, common_arg)
+
+    common_arg.max_encoders = args.max_encoders
+
+    if args.vapx:
+        src_set = SrcSet.load(args.vapx)
+        if src_set is None:
+            sys.exit(1)
+        common_arg.is_vapx = True
+        common_arg.src_set = src_set
 
     if args.output:
         common_arg.output_path = args.output
@@ -89,5 +275,93 @@ def run(args_list=None):
     tool.create(common_arg, True)
 
 
+def run_batch(args_list):
+    import argparse
+    from batch_tool import BatchTool
+
+    parser = argparse.ArgumentParser(
+        prog="main.py batch", description="Build every animation listed in a manifest"
+    )
+    parser.add_argument("manifest", help="Manifest file (.json or .csv)")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=2,
+        help="Animations built at the same time (they share the frame workers)",
+    )
+    parser.add_argument(
+        "--encoders",
+        type=int,
+        default=0,
+        help="Max concurrent ffmpeg encodes (default: same as --jobs)",
+    )
+    parser.add_argument(
+        "--report",
+        default=None,
+        help="Summary report path (default: batch_report.json next to the manifest)",
+    )
+    add_common_args(parser)
+
+    args = parser.parse_args(args_list)
+
+    defaults = CommonArg()
+    apply_common_args(args, defaults)
+
+    batch_tool = BatchTool(defaults, args.jobs, args.encoders)
+    items = batch_tool.load_manifest(args.manifest)
+    if items is None:
+        sys.exit(1)
+
+    report_file = args.report or os.path.join(
+        os.path.dirname(os.path.abspath(args.manifest)), BatchTool.REPORT_FILE
+    )
+    report = batch_tool.run(items, report_file)
+    if report["failed"]:
+        sys.exit(1)
+
+
+def run_scan(args_list):
+    import argparse
+    import json
+    from collections import Counter
+    from vapc_scan import VapcScanner
+
+    parser = argparse.ArgumentParser(
+        prog="main.py scan", description="Check the vapc config of many mp4 files, JSON lines report"
+    )
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        help="Directories (searched for *.mp4), mp4 files, or lists of paths (.txt/.lst, '-' for stdin)",
+    )
+    parser.add_argument("-o", "--output", default=None, help="Report file (default: stdout)")
+    parser.add_argument(
+        "--threads", type=int, default=0, help=f"Files read at once (default: {VapcScanner.DEFAULT_THREADS})"
+    )
+    parser.add_argument("--include-json", action="store_true", help="Add the whole vapc json to each line")
+    parser.add_argument("--problems-only", action="store_true", help="Only report files that are not ok")
+
+    args = parser.parse_args(args_list)
+
+    scanner = VapcScanner(args.threads, args.include_json)
+    counts = Counter()
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for result in scanner.scan(args.paths):
+            counts[result["status"]] += 1
+            if args.problems_only and result["status"] == VapcScanner.STATUS_OK:
+                continue
+            out.write(json.dumps(result, separators=(",", ":")) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    # the report may be on stdout, keep the summary apart
+    summary = ", ".join(f"{status}={count}" for status, count in sorted(counts.items()))
+    print(f"scanned {sum(counts.values())} files: {summary}", file=sys.stderr)
+    if sum(counts.values()) != counts[VapcScanner.STATUS_OK]:
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     run()
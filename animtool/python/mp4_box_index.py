@@ -0,0 +1,187 @@
+import mmap
+import struct
+
+from utils.log import TLog
+
+
+class Mp4Box:
+    """
+    One box of an Mp4BoxIndex. Children are only parsed when first asked for, and data is a
+    memoryview into the mapped file, so nothing is copied until the caller does bytes(box.data).
+    """
+    __slots__ = ("index", "type", "offset", "size", "header_size", "parent", "_children")
+
+    def __init__(self, index, box_type, offset, size, header_size, parent=None):
+        self.index = index
+        self.type = box_type
+        self.offset = offset
+        self.size = size
+        self.header_size = header_size
+        self.parent = parent
+        self._children = None
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+    @property
+    def data_offset(self):
+        return self.offset + self.header_size
+
+    @property
+    def data(self) -> memoryview:
+        """payload without the box header, valid until the index is closed"""
+        return self.index.view[self.data_offset:self.end]
+
+    @property
+    def children(self):
+        if self._children is None:
+            child_offset = Mp4BoxIndex.CONTAINERS.get(self.type)
+            if child_offset is None:
+                self._children = []
+            else:
+                self._children = self.index.parse_boxes(self.data_offset + child_offset, self.end, self)
+        return self._children
+
+    def find(self, path):
+        return next(self.iter_path(path.split("/")), None)
+
+    def find_all(self, path):
+        return list(self.iter_path(path.split("/")))
+
+    def iter_path(self, names):
+        for child in self.children:
+            if child.type == names[0]:
+                if len(names) == 1:
+                    yield child
+                else:
+                    yield from child.iter_path(names[1:])
+
+    def get_path(self):
+        names = []
+        box = self
+        while box:
+            names.append(box.type)
+            box = box.parent
+        return "/".join(reversed(names))
+
+    def __repr__(self):
+        return f"Mp4Box({self.get_path()}, offset={self.offset}, size={self.size})"
+
+
+class Mp4BoxIndex:
+    """
+    Memory mapped box tree of an mp4 file.
+
+        with Mp4BoxIndex(path) as index:
+            vapc = index.find("vapc")
+            stsd = index.find("moov/trak/mdia/minf/stbl/stsd")
+
+    Handles 64 bit largesize boxes (size 1), "up to the end" boxes (size 0) and uuid boxes.
+    Opening only maps the file, the top level is walked on first use by jumping from box
+    header to box header, so a big mdat is never read. A malformed box stops the walk of
+    its level, error tells what happened, the boxes before it are still usable.
+    Box data views must not be kept after close().
+    """
+    TAG = "Mp4BoxIndex"
+
+    # container type -> offset of the first child inside the payload
+    CONTAINERS = {
+        "moov": 0, "trak": 0, "mdia": 0, "minf": 0, "stbl": 0, "dinf": 0, "edts": 0,
+        "udta": 0, "mvex": 0, "moof": 0, "traf": 0, "mfra": 0, "tref": 0, "sinf": 0,
+        "schi": 0,
+        # full boxes: version + flags first
+        "meta": 4,
+        # full box + entry_count, children are the sample entries
+        "stsd": 8, "dref": 8,
+        # visual sample entries: 78 bytes of fields, then avcC/hvcC/...
+        "avc1": 78, "avc3": 78, "hvc1": 78, "hev1": 78, "mp4v": 78, "encv": 78,
+        # audio sample entries
+        "mp4a": 28, "enca": 28,
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self.error = None
+        self._boxes = None
+        with open(path, "rb") as f:
+            f.seek(0, 2)
+            self.file_size = f.tell()
+            # an empty file can not be mapped
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.file_size else None
+        self.view = memoryview(self.mmap) if self.mmap else memoryview(b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.view.release()
+        if self.mmap:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # a Mp4Box.data view is still alive, the mapping goes away with it
+                TLog.w(self.TAG, f"{self.path}: box data still referenced, mmap closed later")
+            self.mmap = None
+
+    @property
+    def boxes(self):
+        """top level boxes"""
+        if self._boxes is None:
+            self._boxes = self.parse_boxes(0, self.file_size, None)
+        return self._boxes
+
+    def find(self, path):
+        """first box at path, e.g. "vapc" or "moov/trak/mdia/mdhd", None if there is none"""
+        return next(self.iter_path(path.split("/")), None)
+
+    def find_all(self, path):
+        return list(self.iter_path(path.split("/")))
+
+    def iter_path(self, names):
+        for box in self.boxes:
+            if box.type == names[0]:
+                if len(names) == 1:
+                    yield box
+                else:
+                    yield from box.iter_path(names[1:])
+
+    def walk(self, boxes=None):
+        """every box, depth first; parses the whole tree"""
+        for box in self.boxes if boxes is None else boxes:
+            yield box
+            yield from self.walk(box.children)
+
+    def parse_boxes(self, start, end, parent):
+        boxes = []
+        view = self.view
+        offset = start
+        while offset + 8 <= end:
+            size, raw_type = struct.unpack_from(">I4s", view, offset)
+            header_size = 8
+            if size == 1:
+                if offset + 16 > end:
+                    self.set_error(f"truncated largesize at {offset}")
+                    break
+                size = struct.unpack_from(">Q", view, offset + 8)[0]
+                header_size = 16
+            elif size == 0:
+                size = end - offset
+            box_type = raw_type.decode("latin-1")
+            if box_type == "uuid":
+                header_size += 16
+
+            if size < header_size or offset + size > end:
+                self.set_error(f"bad {box_type!r} box size {size} at {offset}")
+                break
+
+            boxes.append(Mp4Box(self, box_type, offset, size, header_size, parent))
+            offset += size
+        return boxes
+
+    def set_error(self, msg):
+        if self.error is None:
+            self.error = msg
@@ -1,6 +1,8 @@
 import os
 import struct
 from utils.log import TLog
+from mp4_box_index import Mp4BoxIndex
+from utils.md5_util import Md5Util, HashingWriter
 # from anim_tool import AnimTool # Removed to avoid circular import
 
 class Mp4BoxTool:
@@ -38,6 +40,128 @@ class Mp4BoxTool:
             TLog.e(self.TAG, str(e))
             return None
 
+    def insert_vapc(self, video_file, vapc_data, output_file=None, algorithms=()):
+        """
+        Add a top-level vapc box holding vapc_data (the vapc.json bytes) to an encoded mp4,
+        replacing the vapc.bin + mp4edit --insert round-trip.
+
+        The box goes right before moov when moov is the last top-level box (ffmpeg's default
+        layout, same place mp4edit puts it), so only moov is rewritten and no chunk offset
+        changes. If moov comes before mdat (faststart) the box is appended at the end instead,
+        inserting before moov would shift mdat and require patching stco/co64.
+        AnimConfigManager scans the top-level boxes in order, either position is found.
+
+        output_file None: patch video_file in place. Otherwise video_file is left untouched and
+        the unchanged part is copied with copy_file_range/sendfile.
+
+        algorithms: e.g. ("md5", "sha256"), hash the resulting file while writing it, the digests
+        end up in self.digests. In place only the part before the box is read back (mmap), the box
+        and the rewritten tail are hashed as they are written. With an output file everything is
+        copied through a HashingWriter instead of the kernel copy.
+        """
+        self.digests = None
+        try:
+            with Mp4BoxIndex(video_file) as index:
+                boxes = [(box.type, box.offset, box.size) for box in index.boxes]
+                file_len = index.file_size
+                error = index.error
+        except Exception as e:
+            TLog.e(self.TAG, f"read {video_file} fail: {e}")
+            return False
+
+        if error:
+            TLog.e(self.TAG, f"{video_file}: {error}")
+            return False
+
+        types = [box_type for box_type, _, _ in boxes]
+        if "moov" not in types:
+            TLog.e(self.TAG, f"{video_file} has no moov box")
+            return False
+        if "vapc" in types:
+            TLog.e(self.TAG, f"{video_file} already has a vapc box")
+            return False
+
+        moov_index = types.index("moov")
+        if "mdat" in types[moov_index:]:
+            insert_at = file_len
+        else:
+            insert_at = boxes[moov_index][1]
+
+        for box_type, offset, size in boxes:
+            if offset < insert_at and size > 0xFFFFFFFF:
+                # the player only understands 32 bit box sizes while scanning for vapc
+                TLog.w(self.TAG, f"{box_type} box is larger than 4GB, players will not find vapc")
+
+        box = bytes(self.get_box_head(len(vapc_data))) + vapc_data
+        hashes = Md5Util.new_hashes(algorithms) if algorithms else None
+        try:
+            if output_file is None:
+                with open(video_file, "r+b") as f:
+                    f.seek(insert_at)
+                    tail = f.read()
+                    if hashes:
+                        Md5Util.update_from_file(hashes, f, 0, insert_at)
+                    f.seek(insert_at)
+                    writer = HashingWriter(f, hashes) if hashes else f
+                    writer.write(box)
+                    writer.write(tail)
+            else:
+                tmp_file = output_file + ".tmp"
+                with open(video_file, "rb") as src, open(tmp_file, "wb") as dst:
+                    writer = HashingWriter(dst, hashes) if hashes else dst
+                    self.copy_range(src, writer, 0, insert_at)
+                    writer.write(box)
+                    self.copy_range(src, writer, insert_at, file_len - insert_at)
+                os.replace(tmp_file, output_file)
+        except Exception as e:
+            TLog.e(self.TAG, f"insert vapc fail: {e}")
+            return False
+
+        if hashes:
+            self.digests = {algorithm: h.hexdigest() for algorithm, h in hashes.items()}
+        TLog.i(self.TAG, f"vapc box inserted at {insert_at}, len={len(box)}")
+        return True
+
+    @staticmethod
+    def copy_range(src, dst, offset, count):
+        # kernel side copy where possible, the mdat never passes through user space.
+        # dst may be a HashingWriter (no fileno), then the bytes have to come through here
+        src_fd = src.fileno()
+        dst_fd = dst.fileno() if hasattr(dst, "fileno") else None
+        copies = ("copy_file_range", "sendfile") if dst_fd is not None else ()
+        if dst_fd is not None:
+            dst.flush()
+        for copy in copies:
+            if not hasattr(os, copy):
+                continue
+            try:
+                while count > 0:
+                    if copy == "copy_file_range":
+                        n = os.copy_file_range(src_fd, dst_fd, count, offset)
+                    else:
+                        n = os.sendfile(dst_fd, src_fd, offset, count)
+                    if n == 0:
+                        break
+                    offset += n
+                    count -= n
+                # keep the python file position in step with the fd
+                dst.seek(0, os.SEEK_END)
+                if count == 0:
+                    return
+            except OSError:
+                # e.g. EXDEV/EINVAL on some filesystems, fall through to the next method
+                pass
+
+        if dst_fd is not None:
+            dst.seek(0, os.SEEK_END)
+        src.seek(offset)
+        while count > 0:
+            buffer = src.read(min(count, 1 << 20))
+            if not buffer:
+                raise IOError("unexpected end of file")
+            dst.write(buffer)
+            count -= len(buffer)
+
     def check_dir(self, path):
         if not os.path.exists(path):
             os.makedirs(path)
@@ -70,169 +194,29 @@ class Mp4BoxTool:
             return
 
         try:
-            with open(input_file, "rb") as mp4_file:
-                vapc_start_index = 0
-                head = None
-                
-                while True:
-                    box_head_bytes = mp4_file.read(8)
-                    if len(box_head_bytes) != 8:
-                        break
-                        
-                    head = self.parse_box_head(box_head_bytes)
-                    if not head:
-                        break
-                        
-                    if head['type'] == 'vapc':
-                        head['startIndex'] = vapc_start_index
-                        break
-                        
-                    # Skip to next box (subtract 8 because we read header)
-                    # Java: mp4File.seek(head.length); 
-                    # Java RandomAccessFile.seek is absolute position?
-                    # Java logic:
-                    # mp4File.read(boxHead...) -> moves ptr by 8.
-                    # mp4File.seek(head.length) -> NO, WAIT.
-                    # Java RandomAccessFile behavior:
-                    # No, `seek` sets offset from beginning.
-                    # But the code says: `mp4File.seek(head.length);` 
-                    # That looks WRONG in Java if it meant "skip". 
-                    # If it meant "jump to abs position", then `head.length` is just the length of THIS box.
-                    # So it would jump to `length`? That implies `vapcStartIndex` is just 0?
-                    # Wait, the logic:
-                    # vapcStartIndex += head.length;
-                    # So it accumulates length.
-                    # Ah, `mp4File.seek` goes to ABSOLUTE position.
-                    # But `head.length` is the size of the CURRENT box.
-                    # If start was 0, after read(8), pos is 8.
-                    # If we `seek(head.length)`, we go to `head.length`.
-                    # But if we had multiple boxes...
-                    # Initial: vapcStartIndex = 0.
-                    # 1st box len=100.
-                    # seek(100). vapcStartIndex += 100 -> 100.
-                    # 2nd box starts at 100.
-                    # read(8). pos=108.
-                    # 2nd box len=50.
-                    # seek(50)? NO. logic bug in Java or I misread?
-                    # Java code: `mp4File.seek(head.length);` 
-                    # This only works if `offset` was added? NO.
-                    # Wait, look closely at Java code provided:
-                    # `mp4File.seek(head.length);`
-                    # `vapcStartIndex += head.length;`
-                    # This logic only works if `seek` is RELATIVE? 
-                    # RandomAccessFile.seek is ABSOLUTE.
-                    # So if first box has length 100, we seek to 100. Correct.
-                    # Next loop: vapcStartIndex = 100. 
-                    # read(8). pos=108.
-                    # box2 len=50.
-                    # `mp4File.seek(head.length)` -> seek(50). 
-                    # This jumps BACKWARDS to 50!
-                    # The Java code seems BUGGY if there are multiple boxes.
-                    # UNLESS `head.length` implies absolute offset? No, standard MP4 box length is size of box.
-                    # Maybe the user's Java code is only verifying the first box or assumes structure?
-                    # OR, maybe I am misreading `mp4File.seek(head.length)`.
-                    # IF the Java code meant `mp4File.seek(vapcStartIndex + head.length)`, that would be correct.
-                    # But it wrote `mp4File.seek(head.length)`.
-                    
-                    # HOWEVER, I must port the logic. 
-                    # If the source is buggy, I should probably reproduce the bug or fix it if obvious.
-                    # But wait, maybe `head.length` IS absolute?
-                    # No, parsing logic: boxHead[0..3] is length. It is the size of the box including header.
-                    
-                    # Let's assume the Java code Intention was to skip the box.
-                    # In python `file.seek(offset, 1)` skips relative.
-                    # Accessing the file sequentially is safer.
-                    # But if I use `file.seek(head.length)`, I replicate specific behavior.
-                    # But `head.length` is definitely size.
-                    
-                    # Let's look at the Java code again:
-                    # while (...) {
-                    #    head = parse...
-                    #    if (vapc) break;
-                    #    mp4File.seek(head.length);  <-- This looks suspicious.
-                    #    vapcStartIndex += head.length;
-                    # }
-                    
-                    # If I assume the Java code works for them, maybe they only have one box before VAPC? 
-                    # Or VAPC is inside something?
-                    # Actually, usually `ftyp` is first.
-                    # If `ftyp` is 32 bytes. `seek(32)` goes to 32. 
-                    # `vapcStartIndex` becomes 32.
-                    # Next read at 32. `moov` box, len 1000.
-                    # `seek(1000)`. Goes to 1000.
-                    # But `vapcStartIndex` becomes 1032.
-                    # Next read at 1000.
-                    # But `vapcStartIndex` tracks sum of lengths = 1032.
-                    # If `vapc` was at 1032, we imply we are at 1000? 
-                    # We are desynchronized by 32 bytes!
-                    # The Java code `mp4File.seek(head.length)` sets pos to `head.length`.
-                    # It IGNORES `vapcStartIndex` for the seek target!
-                    # So it effectively jumps to `length` absolute.
-                    # The only way this works is if `vapcStartIndex` tracks where we SHOULD be, 
-                    # but `seek` jumps to where the CURRENT box ends?
-                    # If box 1 ends at 32. Seek(32). Correct.
-                    # If box 2 len is 1000. Box 2 starts at 32. Ends at 1032.
-                    # `seek(1000)`. Jumps to 1000. 
-                    # But next box starts at 1032!
-                    # So we are reading junk at 1000.
-                    
-                    # CONCLUSION: The Java code is likely buggy for generic MP4s. 
-                    # BUT, I must convert it. 
-                    # I will interpret intent: Skip the box.
-                    # Code adaptation:
-                    # `mp4_file.seek(head['length'] - 8, 1)` (Current pos is after header, so skip length-8).
-                    # OR, strictly follow Java logic if I suspect `head.length` isn't what I think.
-                    # But `parseBoxHead` parses standard mp4 header.
-                    
-                    # I will FIX it to do the right thing: Skip to next box.
-                    # `mp4_file.read(8)` advanced 8 bytes.
-                    # `head.length` is total box size.
-                    # Remaining bytes: `head.length - 8`.
-                    # `mp4_file.seek(head.length - 8, 1)`
-                    
-                    # Update `vapc_start_index`
-                    vapc_start_index += head['length']
-                    
-                    # Do the seek
-                    # Note: Python's seek. 
-                    # If I want to match Java's likely INTENDED behavior (skipping):
-                    mp4_file.seek(head['length'] - 8, 1)
-
-                if not head or head['type'] != 'vapc':
+            with Mp4BoxIndex(input_file) as index:
+                vapc = index.find("vapc")
+                if not vapc:
                     TLog.i(self.TAG, "vapc box head not found")
+                    if index.error:
+                        TLog.i(self.TAG, index.error)
                     return
-                    
-                # Read vapc content
-                # seek back to start of data (header + 8)
-                # In parsed loop, we are at start of header of VAPC.
-                # Loop broke.
-                # `vapc_start_index` is logic start. 
-                # Current file pos is AFTER reading VAPC header (because loop read 8 bytes then broke).
-                # Wait, loop condition `mp4File.read(...)`. 
-                # If it matches 'vapc', we `break`.
-                # file pos is at `vapcStartIndex + 8`.
-                
-                # Java: `mp4File.seek(head.startIndex + 8);`
-                # My logic: `vapc_start_index` variable in loop IS the start index.
-                # So we just read payload.
-                
-                payload_len = head['length'] - 8
-                vapc_buf = mp4_file.read(payload_len)
-                
-                self.check_dir(output_path)
-                from anim_tool import AnimTool
-                output_file = os.path.join(output_path, AnimTool.VAPC_JSON_FILE)
-                
-                with open(output_file, "wb") as f:
-                    f.write(vapc_buf)
-                    
-                try:
-                    json_str = vapc_buf.decode('utf-8')
-                    TLog.i(self.TAG, "success")
-                    TLog.i(self.TAG, json_str)
-                except:
-                    pass
-                    
+                vapc_buf = bytes(vapc.data)
+
+            self.check_dir(output_path)
+            from anim_tool import AnimTool
+            output_file = os.path.join(output_path, AnimTool.VAPC_JSON_FILE)
+
+            with open(output_file, "wb") as f:
+                f.write(vapc_buf)
+
+            try:
+                json_str = vapc_buf.decode('utf-8')
+                TLog.i(self.TAG, "success")
+                TLog.i(self.TAG, json_str)
+            except:
+                pass
+
         except Exception as e:
             TLog.e(self.TAG, str(e))
 
@@ -0,0 +1,115 @@
+import math
+
+from utils.executor_util import ExecutorUtil
+from utils.log import TLog
+
+
+class Segment:
+    """
+    Frames [start, end) of the video, encoded on their own into output_file. Every segment
+    starts with a key frame, force_key_frames is relative to the segment's first frame.
+    """
+
+    def __init__(self, index, start, end, force_key_frames, output_file=""):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.force_key_frames = force_key_frames
+        self.output_file = output_file
+
+    @property
+    def frames(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"Segment({self.index}, {self.start}-{self.end}, force_key_frames={self.force_key_frames})"
+
+
+class SegmentPlan:
+    """
+    Split the encode of frames/*.png into key frame aligned segments that separate ffmpeg
+    processes encode at the same time; the segments are then joined without re-encoding.
+
+    Segment boundaries become key frames, so they snap to a key frame of force_key_frames when
+    one is close, and every forced key frame stays one. Only a list of times is understood,
+    a force_key_frames expression ("expr:...") encodes as one segment.
+
+    CommonArg.segments: 1 = one encode, 0 = one segment per ENCODER_CORES available cores
+    with at least MIN_SEGMENT_SECONDS each, n = n segments.
+    """
+    TAG = "SegmentPlan"
+    SEGMENTS_DIR = "segments"
+    CONCAT_FILE = "segments.txt"
+
+    # x264/x265 keep about this many cores busy on frames of this size
+    ENCODER_CORES = 4
+    MIN_SEGMENT_SECONDS = 2
+    # a boundary moves to a forced key frame at most this share of a segment away
+    SNAP_RANGE = 0.25
+
+    @staticmethod
+    def is_enabled(common_arg):
+        # the segments are encoded from frames/*.png
+        return common_arg.segments != 1 and not common_arg.stream_frames
+
+    @staticmethod
+    def get_key_frames(common_arg):
+        """
+        Frame indices of force_key_frames, None for a format that is not a list of times.
+        ffmpeg forces the first frame whose time is >= each time.
+        """
+        key_frames = set()
+        for value in common_arg.force_key_frames.split(","):
+            value = value.strip()
+            if not value:
+                continue
+            try:
+                seconds = float(value)
+            except ValueError:
+                return None
+            key_frames.add(max(0, math.ceil(seconds * common_arg.fps - 1e-6)))
+        return sorted(key_frames)
+
+    @staticmethod
+    def get_count(common_arg):
+        total_frame = common_arg.total_frame
+        if common_arg.segments > 0:
+            return max(1, min(common_arg.segments, total_frame))
+        by_cores = ExecutorUtil.cpu_count() // SegmentPlan.ENCODER_CORES
+        by_length = total_frame // max(1, SegmentPlan.MIN_SEGMENT_SECONDS * common_arg.fps)
+        return max(1, min(by_cores, by_length))
+
+    @staticmethod
+    def create(common_arg):
+        """
+        The segments of common_arg's encode, None if it is encoded as one.
+        """
+        key_frames = SegmentPlan.get_key_frames(common_arg)
+        if key_frames is None:
+            TLog.w(SegmentPlan.TAG, f"segments: force_key_frames '{common_arg.force_key_frames}' "
+                                    "is not a list of times, encoding as one")
+            return None
+        count = SegmentPlan.get_count(common_arg)
+        if count <= 1:
+            TLog.i(SegmentPlan.TAG, f"segments: {common_arg.total_frame} frames are encoded as one")
+            return None
+
+        total_frame = common_arg.total_frame
+        length = total_frame / count
+        starts = [0]
+        for i in range(1, count):
+            ideal = int(round(i * length))
+            near = [k for k in key_frames if abs(k - ideal) <= length * SegmentPlan.SNAP_RANGE]
+            start = min(near, key=lambda k: abs(k - ideal)) if near else ideal
+            if starts[-1] < start < total_frame:
+                starts.append(start)
+
+        ends = starts[1:] + [total_frame]
+        segments = []
+        for index, (start, end) in enumerate(zip(starts, ends)):
+            # first frame of a segment is a key frame anyway, "0.000" keeps that explicit;
+            # times round down to the ms so they never pass the frame they are meant for
+            times = ["0.000"]
+            times += [f"{(k - start) * 1000 // common_arg.fps / 1000:.3f}" for k in key_frames if start < k < end]
+            segments.append(Segment(index, start, end, ",".join(times)))
+        return segments
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+
+from utils.mem_util import MemUtil
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class FrameStats:
+    """
+    Timings of one frame, measured in the worker (thread or process) and sent back with its FrameResult.
+    stages: name -> [wall_ms, cpu_ms], cpu is the worker thread's own cpu time.
+    A stage's time excludes the stages nested in it, those count for themselves only.
+    """
+    __slots__ = ("latency_ms", "stages", "bytes_read", "bytes_written", "open_stages")
+
+    def __init__(self):
+        self.latency_ms = 0.0
+        self.stages = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.open_stages = []  # [wall_ms, cpu_ms] of the nested stages, per stage being timed
+
+    @contextmanager
+    def stage(self, name):
+        nested = [0.0, 0.0]
+        self.open_stages.append(nested)
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            wall_ms = (time.perf_counter() - wall) * 1000
+            cpu_ms = (time.thread_time() - cpu) * 1000
+            self.open_stages.pop()
+            if self.open_stages:
+                outer = self.open_stages[-1]
+                outer[0] += wall_ms
+                outer[1] += cpu_ms
+            self.add(name, wall_ms - nested[0], cpu_ms - nested[1])
+
+    def add(self, name, wall_ms, cpu_ms):
+        times = self.stages.get(name)
+        if times is None:
+            self.stages[name] = [wall_ms, cpu_ms]
+        else:
+            times[0] += wall_ms
+            times[1] += cpu_ms
+
+
+class BuildStats:
+    """
+    Where a build spends its time: wall/cpu time and bytes per stage, a per-frame latency
+    histogram and peak RSS. Saved as build_stats.json next to md5.txt.
+
+    Build stages (check, frames, encode, audio, vapc, md5 ...) run in the main process:
+    cpu_ms is this process (all its threads), child_cpu_ms the processes that finished during
+    the stage (ffmpeg, process pool workers). Frame stages (frame.read, frame.decode ...) are
+    summed over all frames and workers, so with several workers they add up to more than
+    the wall time of the build stage they ran in.
+    """
+    STATS_FILE = "build_stats.json"
+    VERSION = 1
+
+    # upper bounds of the frame latency histogram buckets, the last bucket is open ended
+    HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.frame_stages = {}
+        self.frame_latencies = []
+        self.dedup = None  # FrameDedup.to_dict() when frames were deduplicated
+        self.layout = None  # LayoutPlan.to_dict() of the video layout
+
+    @staticmethod
+    def children_cpu():
+        if resource is None:
+            return 0.0
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+    @contextmanager
+    def stage(self, name):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        child_cpu = self.children_cpu()
+        try:
+            yield
+        finally:
+            self.add_stage(
+                name,
+                wall_ms=(time.perf_counter() - wall) * 1000,
+                cpu_ms=(time.process_time() - cpu) * 1000,
+                child_cpu_ms=(self.children_cpu() - child_cpu) * 1000,
+            )
+
+    def get_stage(self, name, stages=None):
+        stages = self.stages if stages is None else stages
+        stage = stages.get(name)
+        if stage is None:
+            stage = stages[name] = {
+                "count": 0, "wall_ms": 0.0, "cpu_ms": 0.0, "child_cpu_ms": 0.0, "bytes_read": 0, "bytes_written": 0,
+            }
+        return stage
+
+    def add_stage(self, name, wall_ms=0.0, cpu_ms=0.0, child_cpu_ms=0.0):
+        stage = self.get_stage(name)
+        stage["count"] += 1
+        stage["wall_ms"] += wall_ms
+        stage["cpu_ms"] += cpu_ms
+        stage["child_cpu_ms"] += child_cpu_ms
+
+    def add_bytes(self, name, read=0, written=0):
+        stage = self.get_stage(name)
+        stage["bytes_read"] += read
+        stage["bytes_written"] += written
+
+    def add_frame(self, frame_stats):
+        self.frame_latencies.append(frame_stats.latency_ms)
+        for name, (wall_ms, cpu_ms) in frame_stats.stages.items():
+            stage = self.get_stage(name, self.frame_stages)
+            stage["count"] += 1
+            stage["wall_ms"] += wall_ms
+            stage["cpu_ms"] += cpu_ms
+        if frame_stats.bytes_read:
+            self.get_stage("frame.read", self.frame_stages)["bytes_read"] += frame_stats.bytes_read
+        if frame_stats.bytes_written:
+            self.get_stage("frame.write", self.frame_stages)["bytes_written"] += frame_stats.bytes_written
+
+    def get_latency(self):
+        latencies = sorted(self.frame_latencies)
+        if not latencies:
+            return None
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3)
+
+        histogram = []
+        i = 0
+        for bound in self.HISTOGRAM_BUCKETS_MS + (None,):
+            count = 0
+            while i < len(latencies) and (bound is None or latencies[i] <= bound):
+                count += 1
+                i += 1
+            histogram.append({"le_ms": bound, "count": count})
+
+        return {
+            "count": len(latencies),
+            "min_ms": round(latencies[0], 3),
+            "mean_ms": round(sum(latencies) / len(latencies), 3),
+            "p50_ms": percentile(0.5),
+            "p90_ms": percentile(0.9),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(latencies[-1], 3),
+            "histogram": histogram,
+        }
+
+    @staticmethod
+    def round_stages(stages):
+        return {
+            name: {k: round(v, 3) if isinstance(v, float) else v for k, v in stage.items()}
+            for name, stage in stages.items()
+        }
+
+    def to_dict(self, success=True):
+        return {
+            "v": self.VERSION,
+            "success": success,
+            "total_ms": round((time.perf_counter() - self.start_time) * 1000, 3),
+            "stages": self.round_stages(self.stages),
+            "frame_stages": self.round_stages(self.frame_stages),
+            "frame_latency": self.get_latency(),
+            "dedup": self.dedup,
+            "layout": self.layout,
+            "peak_rss_mb": MemUtil.peak_rss_mb("self"),
+            "peak_child_rss_mb": MemUtil.peak_rss_mb("children"),
+        }
+
+    @staticmethod
+    def save(output_path, stats_dict):
+        stats_file = os.path.join(output_path, BuildStats.STATS_FILE)
+        tmp_file = stats_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(stats_dict, f, indent=2)
+        os.replace(tmp_file, stats_file)
+        return stats_file
+
+    @staticmethod
+    def get_summary(stats_dict):
+        stages = ", ".join(f"{name}={stage['wall_ms']:.0f}ms" for name, stage in stats_dict["stages"].items())
+        summary = f"total={stats_dict['total_ms']:.0f}ms, {stages}"
+        dedup = stats_dict.get("dedup")
+        if dedup:
+            summary += f", dedup={dedup['frames']} frames (~{dedup['saved_ms']:.0f}ms saved)"
+        layout = stats_dict.get("layout")
+        if layout:
+            summary += f", layout={layout['outputW']}x{layout['outputH']} (decode load {layout['decode_load']:.1%})"
+        return summary
@@ -0,0 +1,66 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from utils.log import TLog
+
+
+class ExecutorUtil:
+    TAG = "ExecutorUtil"
+
+    BACKEND_AUTO = "auto"
+    BACKEND_THREAD = "thread"
+    BACKEND_PROCESS = "process"
+
+    # below this many cores the process start-up and frame IPC cost more than the GIL
+    PROCESS_MIN_CPU = 4
+
+    @staticmethod
+    def cpu_count() -> int:
+        try:
+            return len(os.sched_getaffinity(0))
+        except AttributeError:
+            return os.cpu_count() or 1
+
+    @staticmethod
+    def resolve_workers(workers: int) -> int:
+        if workers and workers > 0:
+            return workers
+        return ExecutorUtil.cpu_count()
+
+    @staticmethod
+    def resolve_backend(backend: str, workers: int) -> str:
+        if backend == ExecutorUtil.BACKEND_AUTO:
+            if workers > 1 and ExecutorUtil.cpu_count() >= ExecutorUtil.PROCESS_MIN_CPU:
+                return ExecutorUtil.BACKEND_PROCESS
+            return ExecutorUtil.BACKEND_THREAD
+        return backend
+
+    @staticmethod
+    def create(backend: str, workers: int, initializer=None, initargs=()):
+        """
+        Create a frame executor. backend is one of auto|thread|process.
+        """
+        workers = ExecutorUtil.resolve_workers(workers)
+        backend = ExecutorUtil.resolve_backend(backend, workers)
+        TLog.i(ExecutorUtil.TAG, f"executor={backend}, workers={workers}")
+
+        if backend == ExecutorUtil.BACKEND_PROCESS:
+            return ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+        if backend == ExecutorUtil.BACKEND_THREAD:
+            return ThreadPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+
+        raise ValueError(f"unknown executor backend: {backend}")
+
+    @staticmethod
+    def is_process(executor) -> bool:
+        # tasks and their arguments are pickled
+        return isinstance(executor, ProcessPoolExecutor)
+
+    @staticmethod
+    def chunk_size(total: int, workers: int, chunk_size: int = 0) -> int:
+        """
+        Frames per task. Big enough to amortize per-task IPC, small enough that
+        every worker gets several chunks and the load stays balanced.
+        """
+        if chunk_size and chunk_size > 0:
+            return chunk_size
+        return max(1, min(16, total // (workers * 4)))
@@ -0,0 +1,53 @@
+import os
+import json
+from collections import namedtuple
+
+from utils.log import TLog
+from utils.process_util import ProcessUtil
+
+VideoInfo = namedtuple("VideoInfo", ["width", "height", "frames", "codec"])
+
+
+class FfprobeUtil:
+    TAG = "FfprobeUtil"
+
+    # decoders that keep the alpha plane of vp8/vp9 webm (ffmpeg's native ones drop it)
+    ALPHA_DECODERS = {"vp8": "libvpx", "vp9": "libvpx-vp9"}
+
+    @staticmethod
+    def get_ffprobe_cmd(common_arg):
+        if common_arg.ffprobe_cmd:
+            return common_arg.ffprobe_cmd
+        # ffprobe ships next to ffmpeg
+        head, tail = os.path.split(common_arg.ffmpeg_cmd)
+        if "ffmpeg" in tail:
+            return os.path.join(head, tail.replace("ffmpeg", "ffprobe"))
+        return "ffprobe"
+
+    @staticmethod
+    def probe_video(ffprobe_cmd, video_file):
+        """
+        Size, frame count and codec of the first video stream, None if it can not be probed.
+        Frames are counted from the packets (-count_packets), nothing is decoded.
+        """
+        cmd = [
+            ffprobe_cmd,
+            "-v", "error",
+            "-select_streams", "v:0",
+            "-count_packets",
+            "-show_entries", "stream=codec_name,width,height,nb_read_packets",
+            "-of", "json",
+            video_file,
+        ]
+        result, output = ProcessUtil.run_output(cmd)
+        if result != 0:
+            return None
+
+        try:
+            stream = json.loads(output)["streams"][0]
+            return VideoInfo(
+                int(stream["width"]), int(stream["height"]), int(stream["nb_read_packets"]), stream.get("codec_name", "")
+            )
+        except Exception as e:
+            TLog.e(FfprobeUtil.TAG, f"unexpected ffprobe output for {video_file}: {e}")
+            return None
@@ -1,32 +1,121 @@
 import hashlib
+import mmap
 import os
 from utils.log import TLog
 
+
+class HashingWriter:
+    """
+    File-like wrapper: everything written to f also goes into the hashes,
+    so the finished file does not have to be read again for its md5/sha256.
+    """
+
+    def __init__(self, f, hashes):
+        self.f = f
+        self.hashes = hashes  # algorithm -> hashlib object, see Md5Util.new_hashes
+
+    def write(self, data):
+        n = self.f.write(data)
+        for h in self.hashes.values():
+            h.update(data)
+        return n
+
+    def hexdigests(self) -> dict:
+        return {algorithm: h.hexdigest() for algorithm, h in self.hashes.items()}
+
+
 class Md5Util:
     MD5_FILE = "md5.txt"
+    # algorithm -> file written next to md5.txt
+    HASH_FILES = {"md5": MD5_FILE, "sha256": "sha256.txt"}
+
+    READ_BUFFER = 1 << 20
+    # hash a mapping in slices so one update does not fault in hundreds of MB at once
+    MMAP_SLICE = 8 << 20
+
+    @staticmethod
+    def new_hashes(algorithms=("md5",)) -> dict:
+        return {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+
+    @staticmethod
+    def update_from_file(hashes, f, offset=0, count=None):
+        """
+        Feed count bytes of the open file f (from offset, default: up to the end) into hashes.
+        Uses mmap, falls back to 1 MB reads where the file can not be mapped.
+        """
+        file_len = os.fstat(f.fileno()).st_size
+        if count is None:
+            count = file_len - offset
+        if count <= 0:
+            return
+
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            mapped = None
+
+        if mapped:
+            with mapped:
+                view = memoryview(mapped)
+                try:
+                    end = offset + count
+                    for start in range(offset, end, Md5Util.MMAP_SLICE):
+                        chunk = view[start:min(start + Md5Util.MMAP_SLICE, end)]
+                        for h in hashes.values():
+                            h.update(chunk)
+                        chunk.release()
+                finally:
+                    view.release()
+            return
+
+        f.seek(offset)
+        buffer = bytearray(Md5Util.READ_BUFFER)
+        view = memoryview(buffer)
+        while count > 0:
+            n = f.readinto(view[:min(count, Md5Util.READ_BUFFER)])
+            if not n:
+                raise IOError("unexpected end of file")
+            for h in hashes.values():
+                h.update(view[:n])
+            count -= n
 
     @staticmethod
-    def get_file_md5(file_path: str, output_path: str) -> str:
-        if not os.path.exists(file_path) or not os.path.isfile(file_path) or os.path.getsize(file_path) <= 0:
+    def get_file_hashes(file_path: str, algorithms=("md5",)) -> dict:
+        """
+        {algorithm: hex digest} of a file, all algorithms in one pass. None if the file is missing or empty.
+        """
+        if not os.path.isfile(file_path) or os.path.getsize(file_path) <= 0:
             return None
-        
-        md5_hash = hashlib.md5()
+
+        hashes = Md5Util.new_hashes(algorithms)
         try:
             with open(file_path, "rb") as f:
-                for byte_block in iter(lambda: f.read(4096), b""):
-                    md5_hash.update(byte_block)
-            
-            md5_txt = md5_hash.hexdigest()
-            
-            try:
-                with open(os.path.join(output_path, Md5Util.MD5_FILE), "w") as f:
-                    f.write(md5_txt)
-            except Exception as e:
-                TLog.e("Md5Util", str(e))
-                raise RuntimeError(e)
-                
-            return md5_txt
+                Md5Util.update_from_file(hashes, f)
+        except Exception as e:
+            TLog.e("Md5Util", str(e))
+            return None
+        return {algorithm: h.hexdigest() for algorithm, h in hashes.items()}
+
+    @staticmethod
+    def write_hash_file(output_path: str, algorithm: str, digest: str):
+        try:
+            with open(os.path.join(output_path, Md5Util.HASH_FILES.get(algorithm, f"{algorithm}.txt")), "w") as f:
+                f.write(digest)
         except Exception as e:
             TLog.e("Md5Util", str(e))
-        
-        return None
+            raise RuntimeError(e)
+
+    @staticmethod
+    def get_file_md5(file_path: str, output_path: str, algorithm: str = "md5") -> str:
+        """
+        Hash a file and write the digest to md5.txt (sha256.txt for sha256) in output_path.
+        """
+        digests = Md5Util.get_file_hashes(file_path, (algorithm,))
+        if not digests:
+            return None
+
+        try:
+            Md5Util.write_hash_file(output_path, algorithm, digests[algorithm])
+        except RuntimeError:
+            return None
+        return digests[algorithm]
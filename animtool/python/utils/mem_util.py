@@ -0,0 +1,31 @@
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class MemUtil:
+
+    @staticmethod
+    def peak_rss_mb(who="self"):
+        """
+        Peak resident set size in MB, or None where the platform does not report it.
+        who="self" is this process, who="children" is the largest waited-for child
+        (process pool workers, ffmpeg ...).
+        """
+        if resource is None:
+            return None
+
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN if who == "children" else resource.RUSAGE_SELF)
+        # ru_maxrss is KB on Linux, bytes on macOS
+        divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return round(usage.ru_maxrss / divisor, 1)
+
+    @staticmethod
+    def peak_rss_msg():
+        self_mb = MemUtil.peak_rss_mb("self")
+        if self_mb is None:
+            return "peakRss=n/a"
+        return f"peakRss={self_mb}MB, peakChildRss={MemUtil.peak_rss_mb('children')}MB"
@@ -0,0 +1,54 @@
+import struct
+from collections import namedtuple
+
+PngHeader = namedtuple("PngHeader", ["width", "height", "bit_depth", "color_type"])
+
+
+class PngUtil:
+    SIGNATURE = b"\x89PNG\r\n\x1a\n"
+    # signature + IHDR length/type + IHDR data(13) + crc
+    HEADER_LEN = 8 + 8 + 13 + 4
+
+    COLOR_GRAY = 0
+    COLOR_RGB = 2
+    COLOR_PALETTE = 3
+    COLOR_GRAY_ALPHA = 4
+    COLOR_RGBA = 6
+
+    COLOR_NAMES = {
+        COLOR_GRAY: "gray",
+        COLOR_RGB: "rgb",
+        COLOR_PALETTE: "palette",
+        COLOR_GRAY_ALPHA: "gray+alpha",
+        COLOR_RGBA: "rgba",
+    }
+
+    @staticmethod
+    def read_header(path) -> PngHeader:
+        """
+        Read only the IHDR chunk (first 33 bytes) of a PNG. Raises ValueError if it is not a PNG.
+        """
+        with open(path, "rb") as f:
+            head = f.read(PngUtil.HEADER_LEN)
+        return PngUtil.parse_header(head)
+
+    @staticmethod
+    def parse_header(head: bytes) -> PngHeader:
+        if len(head) < PngUtil.HEADER_LEN or head[:8] != PngUtil.SIGNATURE:
+            raise ValueError("not a png file")
+        length, chunk_type = struct.unpack(">I4s", head[8:16])
+        if chunk_type != b"IHDR" or length != 13:
+            raise ValueError("png IHDR chunk missing")
+        width, height, bit_depth, color_type = struct.unpack(">IIBB", head[16:26])
+        if color_type not in PngUtil.COLOR_NAMES:
+            raise ValueError(f"invalid png color type {color_type}")
+        return PngHeader(width, height, bit_depth, color_type)
+
+    @staticmethod
+    def has_alpha_channel(header: PngHeader) -> bool:
+        # palette images may still carry alpha in a tRNS chunk, treat them as "maybe"
+        return header.color_type in (PngUtil.COLOR_GRAY_ALPHA, PngUtil.COLOR_RGBA, PngUtil.COLOR_PALETTE)
+
+    @staticmethod
+    def color_name(header: PngHeader) -> str:
+        return PngUtil.COLOR_NAMES.get(header.color_type, str(header.color_type))
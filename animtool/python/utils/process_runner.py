@@ -0,0 +1,356 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import CancelledError
+
+from utils.log import TLog
+
+
+class EncodeProgress:
+    """
+    One block of ffmpeg's "-progress pipe:1" output.
+    """
+    __slots__ = ("frame", "fps", "speed", "out_time_ms", "total_size", "end")
+
+    def __init__(self, frame=0, fps=0.0, speed=None, out_time_ms=0, total_size=0, end=False):
+        self.frame = frame  # frames encoded so far
+        self.fps = fps  # encode rate
+        self.speed = speed  # encode time vs. media time (2.5 for "2.5x"), None while ffmpeg reports N/A
+        self.out_time_ms = out_time_ms
+        self.total_size = total_size  # bytes written to the output so far
+        self.end = end  # last block, ffmpeg is done
+
+    def __repr__(self):
+        return (f"EncodeProgress(frame={self.frame}, fps={self.fps}, speed={self.speed}, "
+                f"out_time_ms={self.out_time_ms}, end={self.end})")
+
+
+class ProgressParser:
+    """
+    Collects key=value lines; the "progress=continue|end" line closes a block.
+    Values are kept across blocks, a block only has to carry what changed.
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def feed(self, line):
+        """
+        Returns an EncodeProgress when line closes a block, else None.
+        """
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return None
+        if key != "progress":
+            self.values[key] = value
+            return None
+
+        values = self.values
+        # out_time_ms is in microseconds as well, despite its name
+        out_time_us = self.to_number(values.get("out_time_us", values.get("out_time_ms")), int, 0)
+        speed = values.get("speed", "").rstrip("x")
+        return EncodeProgress(
+            frame=self.to_number(values.get("frame"), int, 0),
+            fps=self.to_number(values.get("fps"), float, 0.0),
+            speed=self.to_number(speed, float, None),
+            out_time_ms=max(0, out_time_us) // 1000,
+            total_size=self.to_number(values.get("total_size"), int, 0),
+            end=value == "end",
+        )
+
+    @staticmethod
+    def to_number(value, number_type, default):
+        try:
+            return number_type(value)
+        except (TypeError, ValueError):
+            return default
+
+
+class ProcessResult:
+    __slots__ = ("return_code", "stderr", "timed_out", "cancelled")
+
+    def __init__(self, return_code=-1, stderr=None, timed_out=False, cancelled=False):
+        self.return_code = return_code
+        self.stderr = stderr if stderr is not None else deque()  # last lines of stderr
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+
+    @property
+    def ok(self):
+        return self.return_code == 0 and not self.timed_out and not self.cancelled
+
+    def get_error_msg(self, cmd):
+        if self.timed_out:
+            reason = "timed out"
+        elif self.cancelled:
+            reason = "cancelled"
+        else:
+            reason = f"exit code {self.return_code}"
+        msg = f"{cmd[0]} {reason}"
+        if self.stderr:
+            msg += ", last stderr lines:\n" + "\n".join(self.stderr)
+        return msg
+
+
+class ProcessRunner:
+    """
+    Runs external processes (ffmpeg, mp4edit ...) from one asyncio event loop on a daemon thread,
+    so any number of concurrent processes costs one thread instead of two reader threads each.
+
+    Per process: ffmpeg's -progress output on stdout is parsed into EncodeProgress callbacks,
+    the last STDERR_LINES lines of stderr are kept for the error message, a timeout stops it
+    (terminate, kill after KILL_GRACE seconds) and cancelling its future does the same.
+
+        future = ProcessRunner.get_default().submit(cmd, on_progress, timeout=600)
+        result = ProcessRunner.wait(future)  # ProcessResult
+
+    Callbacks run on the loop thread and must not block.
+    """
+    TAG = "ProcessRunner"
+    STDERR_LINES = 50
+    KILL_GRACE = 5.0
+    # after the exit: how long the pipes may stay open (held by a grandchild) before we stop reading
+    DRAIN_TIMEOUT = 2.0
+    POLL_INTERVAL = 0.05
+    READ_BUFFER = 1 << 16
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, stderr_lines=STDERR_LINES):
+        self.stderr_lines = stderr_lines
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_default(cls):
+        # one loop for the whole process: batch builds share it
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def get_loop(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name=self.TAG, daemon=True)
+                self.thread.start()
+            return self.loop
+
+    def stop(self):
+        with self.lock:
+            if self.loop is None:
+                return
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.loop = None
+            self.thread = None
+
+    def submit(self, cmd, on_progress=None, timeout=None):
+        """
+        Start cmd on the loop. Returns a concurrent.futures.Future of its ProcessResult; cancel() kills it.
+        """
+        return asyncio.run_coroutine_threadsafe(self.run(cmd, on_progress, timeout), self.get_loop())
+
+    @staticmethod
+    def wait(future):
+        try:
+            return future.result()
+        except CancelledError:
+            return ProcessResult(cancelled=True)
+
+    def run_sync(self, cmd, on_progress=None, timeout=None):
+        return self.wait(self.submit(cmd, on_progress, timeout))
+
+    def open_pipe(self, cmd, on_progress=None, timeout=None):
+        """
+        Start cmd with a stdin pipe that a worker thread writes into, see AsyncPipeProcess.
+        None if it could not be started.
+        """
+        try:
+            return asyncio.run_coroutine_threadsafe(
+                self.open_pipe_async(cmd, on_progress, timeout), self.get_loop()
+            ).result()
+        except Exception as e:
+            TLog.e(self.TAG, f"{cmd[0]}: {e}")
+            return None
+
+    async def run(self, cmd, on_progress=None, timeout=None):
+        try:
+            process = await self.create_process(cmd, False, on_progress)
+        except Exception as e:
+            TLog.e(self.TAG, f"{cmd[0]}: {e}")
+            return ProcessResult(stderr=deque([str(e)]))
+        return await self.communicate(process, on_progress, timeout)
+
+    async def open_pipe_async(self, cmd, on_progress, timeout):
+        process = await self.create_process(cmd, True, on_progress)
+        task = asyncio.ensure_future(self.communicate(process, on_progress, timeout))
+        return AsyncPipeProcess(self.loop, process, task)
+
+    @staticmethod
+    async def create_process(cmd, need_stdin, on_progress):
+        return await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if need_stdin else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE if on_progress else asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+    async def communicate(self, process, on_progress, timeout):
+        result = ProcessResult(stderr=deque(maxlen=self.stderr_lines))
+        # stderr must be drained even if nobody looks at it, otherwise the process blocks once the pipe is full
+        readers = [asyncio.ensure_future(self.read_stderr(process.stderr, result.stderr))]
+        if on_progress:
+            readers.append(asyncio.ensure_future(self.read_progress(process.stdout, on_progress)))
+        try:
+            result.return_code = await asyncio.wait_for(self.wait_exit(process), timeout)
+        except asyncio.TimeoutError:
+            result.timed_out = True
+            result.return_code = await self.stop_process(process)
+        except asyncio.CancelledError:
+            result.cancelled = True
+            await self.stop_process(process)
+            raise
+        finally:
+            _, still_reading = await asyncio.wait(readers, timeout=self.DRAIN_TIMEOUT)
+            for reader in still_reading:
+                reader.cancel()
+            await asyncio.gather(*readers, return_exceptions=True)
+        return result
+
+    @staticmethod
+    async def wait_exit(process):
+        # Process.wait() only returns once the pipes are closed too, which a grandchild can hold open
+        while process.returncode is None:
+            await asyncio.sleep(ProcessRunner.POLL_INTERVAL)
+        return process.returncode
+
+    async def stop_process(self, process):
+        try:
+            process.terminate()
+            try:
+                return await asyncio.wait_for(self.wait_exit(process), self.KILL_GRACE)
+            except asyncio.TimeoutError:
+                process.kill()
+        except ProcessLookupError:
+            pass
+        return await self.wait_exit(process)
+
+    async def read_stderr(self, stream, lines):
+        # chunks instead of readline: ffmpeg's stats lines end with \r and can get long
+        partial = b""
+        while True:
+            chunk = await stream.read(self.READ_BUFFER)
+            if not chunk:
+                break
+            parts = (partial + chunk).replace(b"\r", b"\n").split(b"\n")
+            partial = parts.pop()
+            for part in parts:
+                if part.strip():
+                    lines.append(part.decode("utf-8", "replace"))
+        if partial.strip():
+            lines.append(partial.decode("utf-8", "replace"))
+
+    @staticmethod
+    async def read_progress(stream, on_progress):
+        parser = ProgressParser()
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            progress = parser.feed(line.decode("utf-8", "replace"))
+            if progress is not None:
+                try:
+                    on_progress(progress)
+                except Exception as e:
+                    TLog.e(ProcessRunner.TAG, f"progress callback error: {e}")
+
+
+class AsyncPipeProcess:
+    """
+    A process started on the runner's loop whose stdin is fed from another thread.
+    write() waits until the pipe took the data, so a slow encoder throttles the producer.
+    """
+
+    def __init__(self, loop, process, task):
+        self.loop = loop
+        self.process = process
+        self.task = task  # ProcessResult once the process is done
+        self.bytes_written = 0
+        self.result = None
+
+    def write(self, data) -> bool:
+        try:
+            asyncio.run_coroutine_threadsafe(self.write_async(data), self.loop).result()
+            self.bytes_written += len(data)
+            return True
+        except (BrokenPipeError, ConnectionResetError, OSError) as e:
+            # process died early (bad args, disk full ...), its return code tells the rest
+            TLog.e(ProcessRunner.TAG, f"pipe write error: {e}")
+            return False
+
+    async def write_async(self, data):
+        self.process.stdin.write(data)
+        await self.process.stdin.drain()
+
+    def close(self) -> int:
+        """
+        End of input; waits for the process. Returns its exit code (-1 on timeout or cancel).
+        """
+        self.result = asyncio.run_coroutine_threadsafe(self.close_async(), self.loop).result()
+        return self.result.return_code if not self.result.timed_out and not self.result.cancelled else -1
+
+    async def close_async(self):
+        try:
+            self.process.stdin.close()
+            await self.process.stdin.wait_closed()
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            pass
+        try:
+            return await self.task
+        except asyncio.CancelledError:
+            return ProcessResult(stderr=deque(), cancelled=True)
+
+    def abort(self) -> int:
+        self.cancel()
+        return self.close()
+
+    def cancel(self):
+        # thread safe; the task stops the process
+        self.loop.call_soon_threadsafe(self.task.cancel)
+
+
+class TeePipe:
+    """
+    Writes every chunk to several AsyncPipeProcess at once (one encoder per variant). A pipe
+    whose process died is dropped and the others go on; write() fails once all are gone.
+    The slowest encoder sets the pace.
+    """
+
+    def __init__(self, pipes):
+        self.pipes = list(pipes)
+        self.failed = set()
+
+    def write(self, data) -> bool:
+        alive = [pipe for pipe in self.pipes if pipe not in self.failed]
+        if not alive:
+            return False
+        results = asyncio.run_coroutine_threadsafe(
+            self.write_async(alive, data), alive[0].loop
+        ).result()
+        for pipe, error in zip(alive, results):
+            if error is None:
+                pipe.bytes_written += len(data)
+            else:
+                TLog.e(ProcessRunner.TAG, f"pipe write error: {error}")
+                self.failed.add(pipe)
+        return len(self.failed) < len(self.pipes)
+
+    @staticmethod
+    async def write_async(pipes, data):
+        results = await asyncio.gather(*(pipe.write_async(data) for pipe in pipes), return_exceptions=True)
+        return [r if isinstance(r, BaseException) else None for r in results]
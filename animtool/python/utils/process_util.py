@@ -1,53 +1,122 @@
 import subprocess
 import threading
+from collections import deque
 from utils.log import TLog
+from utils.process_runner import ProcessRunner
 
 class ProcessUtil:
-    
+
+    @staticmethod
+    def run(cmd: list, on_progress=None, timeout=None) -> int:
+        """
+        Run cmd to completion on the shared ProcessRunner loop and return its exit code.
+        on_progress(EncodeProgress) gets ffmpeg's "-progress pipe:1" blocks (add the option to cmd),
+        timeout is in seconds. On failure the tail of stderr is logged.
+        """
+        result = ProcessRunner.get_default().run_sync(cmd, on_progress, timeout)
+        return ProcessUtil.get_return_code(cmd, result)
+
+    @staticmethod
+    def get_return_code(cmd, result) -> int:
+        if result.ok:
+            return 0
+        TLog.e("ProcessUtil", result.get_error_msg(cmd))
+        return result.return_code or -1
+
+    @staticmethod
+    def _reader(stream, lines):
+        # keep the tail only, dumped if the process fails
+        try:
+            for line in stream:
+                line = line.rstrip()
+                if line:
+                    lines.append(line.decode("utf-8", "replace"))
+        except Exception:
+            # the pipe closed under the reader (process killed), the tail so far is kept
+            pass
+
+    @staticmethod
+    def run_output(cmd: list):
+        """
+        Run a short command (ffprobe ...) and return (return_code, stdout text).
+        """
+        try:
+            process = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True)
+            if process.returncode != 0:
+                TLog.e("ProcessUtil", process.stderr.decode("utf-8", "replace").strip())
+            return process.returncode, process.stdout.decode("utf-8", "replace")
+        except Exception as e:
+            TLog.e("ProcessUtil", str(e))
+            return -1, ""
+
     @staticmethod
-    def run(cmd: list) -> int:
+    def open_reader(cmd: list):
+        """
+        Start a long-lived process whose stdout we read raw bytes from (e.g. ffmpeg writing rawvideo to "-").
+        The reads stay on the calling thread, a frame is copied once from the pipe into its buffer.
+        Returns a PipeProcess, or None if the process could not be started.
+        """
         try:
             process = subprocess.Popen(
                 cmd,
+                stdin=subprocess.DEVNULL,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                text=True,  # Use text mode for string output
-                encoding='utf-8',
-                errors='replace'
             )
-            
-            # Create threads to read stdout and stderr to prevent blocking
-            stdout_thread = threading.Thread(target=ProcessUtil._reader, args=(process.stdout, "OUTPUT"))
-            stderr_thread = threading.Thread(target=ProcessUtil._reader, args=(process.stderr, "ERROR"))
-            
-            stdout_thread.start()
+            stderr = deque(maxlen=ProcessRunner.STDERR_LINES)
+            stderr_thread = threading.Thread(target=ProcessUtil._reader, args=(process.stderr, stderr), daemon=True)
             stderr_thread.start()
-            
-            return_code = process.wait()
-            
-            stdout_thread.join()
-            stderr_thread.join()
-            
-            return return_code
-            
+            return PipeProcess(cmd, process, [stderr_thread], stderr)
+
         except Exception as e:
             TLog.e("ProcessUtil", str(e))
-            return -1
+            return None
 
     @staticmethod
-    def _reader(stream, type_name):
-        try:
-            for line in stream:
-                # In Python we can just log directly, or accumulate. 
-                # The Java version logged errors if result != 0 at the end.
-                # Here we mimic the behavior of reading lines.
-                # For now let's just print/log them as they come if needed, 
-                # or just consume them to prevent blocking.
-                if type_name == "ERROR":
-                     # In Java it collected error strings and printed them if exit code != 0.
-                     # Here, for simplicity while streaming, we might minimal log or just buffer.
-                     # Let's simple-log for now to avoid complexity of buffering + conditional print.
-                     # But Java logic was: buffer, then print ONLY if result != 0.
-                     pass 
-        except Exception as e:
-            pass
+    def open_pipe(cmd: list, on_progress=None, timeout=None):
+        """
+        Start a long-lived process whose stdin we write raw bytes into (e.g. ffmpeg reading rawvideo from "-").
+        on_progress(EncodeProgress) is called from the runner's loop thread for ffmpeg's -progress pipe:1 output.
+        Returns an AsyncPipeProcess (write / close / abort), or None if the process could not be started.
+        """
+        return ProcessRunner.get_default().open_pipe(cmd, on_progress, timeout)
+
+
+class PipeProcess:
+
+    def __init__(self, cmd, process, reader_threads, stderr):
+        self.cmd = cmd
+        self.process = process
+        self.reader_threads = reader_threads
+        self.stderr = stderr  # last lines of stderr
+        self.ended = False  # stdout reached its end
+
+    def read(self, size):
+        """
+        Exactly size bytes from the process' stdout, None once it ended (or ended mid-frame).
+        """
+        if self.ended:
+            return None
+        data = bytearray(size)
+        view = memoryview(data)
+        pos = 0
+        while pos < size:
+            n = self.process.stdout.readinto(view[pos:])
+            if not n:
+                self.ended = True
+                return None
+            pos += n
+        return data
+
+    def close(self) -> int:
+        return_code = self.process.wait()
+        for thread in self.reader_threads:
+            thread.join()
+        self.process.stdout.close()
+        if return_code > 0 and self.stderr:
+            TLog.e("ProcessUtil", f"{self.cmd[0]} exit code {return_code}, last stderr lines:\n" + "\n".join(self.stderr))
+        return return_code
+
+    def abort(self) -> int:
+        self.process.kill()
+        return self.close()
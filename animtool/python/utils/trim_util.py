@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from data.point_rect import PointRect
+
+
+class AlphaBounds:
+    """
+    Union of the alpha > 0 area of many frames, kept as one "any pixel" flag per row and per column:
+    two small boolean vectors instead of a mask of the whole canvas.
+    Also tracks whether every frame added so far covers the canvas fully opaque.
+    """
+
+    def __init__(self, w, h):
+        self.w = w
+        self.h = h
+        self.rows = np.zeros(h, dtype=bool)
+        self.cols = np.zeros(w, dtype=bool)
+        self.opaque = True
+
+    def add(self, alpha):
+        """
+        alpha: (h, w) uint8 array of one frame, at most the canvas size (top left aligned).
+        """
+        h, w = alpha.shape
+        visible = alpha > 0
+        self.rows[:h] |= visible.any(axis=1)
+        self.cols[:w] |= visible.any(axis=0)
+        if self.opaque:
+            self.opaque = (h, w) == (self.h, self.w) and alpha.min() == 255
+
+    def merge(self, other):
+        self.rows |= other.rows
+        self.cols |= other.cols
+        self.opaque = self.opaque and other.opaque
+
+    def get_rect(self):
+        """
+        Bounding box of everything added, None if all of it was transparent.
+        """
+        cols = np.flatnonzero(self.cols)
+        if cols.size == 0:
+            return None
+        rows = np.flatnonzero(self.rows)
+        return PointRect(int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1))
+
+
+class TrimUtil:
+    """
+    Transparent margin trimming: the union bounding box of alpha > 0 over a whole sequence.
+    """
+
+    @staticmethod
+    def get_alpha(path):
+        with Image.open(path) as img:
+            img.load()
+            # same conversion as the compositor: no alpha channel means fully opaque
+            if img.mode != "RGBA":
+                img = img.convert("RGBA")
+            return np.asarray(img.getchannel("A"))
+
+    @staticmethod
+    def scan_files(paths, w, h, workers):
+        """
+        AlphaBounds of the png files, decoded on workers threads (the png decode releases the GIL).
+        Each thread reduces its own frames, the per-thread vectors are merged at the end.
+        Missing files are skipped.
+        """
+        paths = list(paths)
+        workers = max(1, min(workers, len(paths)))
+
+        def scan(part):
+            bounds = AlphaBounds(w, h)
+            for path in part:
+                try:
+                    bounds.add(TrimUtil.get_alpha(path))
+                except FileNotFoundError:
+                    pass
+            return bounds
+
+        bounds = AlphaBounds(w, h)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for part in executor.map(scan, [paths[i::workers] for i in range(workers)]):
+                bounds.merge(part)
+        return bounds
+
+    @staticmethod
+    def scan_stream(reader, w, h):
+        """
+        AlphaBounds of raw RGBA frames read from a PipeProcess until it ends.
+        Returns (bounds, frame count).
+        """
+        bounds = AlphaBounds(w, h)
+        frame_count = 0
+        while True:
+            frame = reader.read(w * h * 4)
+            if frame is None:
+                break
+            bounds.add(np.frombuffer(frame, dtype=np.uint8).reshape(h, w, 4)[..., 3])
+            frame_count += 1
+        return bounds, frame_count
+
+    @staticmethod
+    def crop(image, trim_rect):
+        """
+        The trimmed part of a full-canvas frame. Images of another size (webm frames that
+        ffmpeg already cropped) are returned as they are.
+        """
+        if trim_rect is None or image.size == (trim_rect.w, trim_rect.h):
+            return image
+        return image.crop((trim_rect.x, trim_rect.y, trim_rect.x + trim_rect.w, trim_rect.y + trim_rect.h))
@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import struct
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from mp4_box_index import Mp4BoxIndex
+
+
+class VapcScanner:
+    """
+    Reads the vapc box of many mp4 files and checks it against the video stream.
+    One JSON object per file:
+
+        {"file": ..., "status": "ok"|"invalid"|"no_vapc"|"bad_json"|"error",
+         "size": bytes, "video": {"codec", "w", "h", "frames"}, "info": {...}, "problems": [...]}
+
+    Nothing is written per file and only the box headers, moov and vapc are touched,
+    mdat is never read.
+    """
+    TAG = "VapcScanner"
+
+    STATUS_OK = "ok"
+    STATUS_INVALID = "invalid"  # vapc found, but it does not match the video
+    STATUS_NO_VAPC = "no_vapc"
+    STATUS_BAD_JSON = "bad_json"
+    STATUS_ERROR = "error"  # not readable / not an mp4
+
+    VIDEO_EXTENSIONS = (".mp4",)
+    LIST_EXTENSIONS = (".txt", ".lst")
+    VISUAL_SAMPLE_ENTRIES = ("avc1", "avc3", "hvc1", "hev1", "mp4v", "encv")
+
+    # opening and mapping files is latency bound (network mounts), not cpu bound
+    DEFAULT_THREADS = 32
+
+    def __init__(self, threads=0, include_json=False):
+        self.threads = threads if threads and threads > 0 else self.DEFAULT_THREADS
+        self.include_json = include_json
+
+    def iter_files(self, paths):
+        """
+        Yield (file, error) per file to scan. Directories are walked recursively for *.mp4,
+        .mp4 files are taken as is, "-" (stdin) and .txt/.lst files are lists with one path
+        per line. A path that can not be read gets an error instead, the others are still scanned.
+        """
+        for path in paths:
+            try:
+                if path == "-":
+                    for file in self.read_list(sys.stdin):
+                        yield file, None
+                elif os.path.isdir(path):
+                    yield from self.walk_dir(path)
+                elif path.lower().endswith(self.VIDEO_EXTENSIONS):
+                    yield path, None
+                elif path.lower().endswith(self.LIST_EXTENSIONS):
+                    with open(path, "r", encoding="utf-8") as f:
+                        for file in self.read_list(f):
+                            yield file, None
+                elif os.path.exists(path):
+                    yield path, f"not an mp4 or a list ({', '.join(self.VIDEO_EXTENSIONS + self.LIST_EXTENSIONS)})"
+                else:
+                    yield path, "no such file or directory"
+            except (OSError, UnicodeDecodeError) as e:
+                yield path, str(e)
+
+    @staticmethod
+    def read_list(f):
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+    def walk_dir(self, path):
+        # scandir, no extra stat per entry
+        dirs = [path]
+        while dirs:
+            dir_path = dirs.pop()
+            try:
+                with os.scandir(dir_path) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError as e:
+                # e.g. no permission: report the directory, go on with the rest
+                yield dir_path, str(e)
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif entry.name.lower().endswith(self.VIDEO_EXTENSIONS):
+                    yield entry.path, None
+
+    def scan(self, paths):
+        """
+        Yield a result per file, in input order. At most a few batches of files are in flight.
+        """
+        files = self.iter_files(paths)
+        max_pending = self.threads * 4
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            for file, error in files:
+                if error:
+                    # not scanned, keeps its place in the report
+                    future = Future()
+                    future.set_result({"file": file, "status": self.STATUS_ERROR, "problems": [error]})
+                    pending.append(future)
+                else:
+                    pending.append(executor.submit(self.scan_file, file))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def scan_file(self, file):
+        result = {"file": file, "status": self.STATUS_OK}
+        try:
+            with Mp4BoxIndex(file) as index:
+                result["size"] = index.file_size
+                video = self.get_video(index)
+                vapc = index.find("vapc")
+                vapc_buf = bytes(vapc.data) if vapc else None
+                box_error = index.error
+        except Exception as e:
+            result["status"] = self.STATUS_ERROR
+            result["problems"] = [str(e)]
+            return result
+
+        if video:
+            result["video"] = video
+        problems = []
+        if box_error:
+            problems.append(box_error)
+
+        if vapc_buf is None:
+            result["status"] = self.STATUS_ERROR if box_error or not video else self.STATUS_NO_VAPC
+            result["problems"] = problems
+            return result
+
+        try:
+            vapc_json = json.loads(vapc_buf.decode("utf-8"))
+            info = vapc_json["info"]
+        except Exception as e:
+            result["status"] = self.STATUS_BAD_JSON
+            result["problems"] = problems + [f"vapc: {e}"]
+            return result
+
+        result["info"] = info
+        if self.include_json:
+            result["vapc"] = vapc_json
+
+        problems.extend(self.validate(info, video))
+        if problems:
+            result["status"] = self.STATUS_INVALID
+        result["problems"] = problems
+        return result
+
+    def get_video(self, index):
+        """
+        codec, size and frame count of the first video track, None if there is none.
+        """
+        for trak in index.find_all("moov/trak"):
+            hdlr = trak.find("mdia/hdlr")
+            # full box: version/flags, pre_defined, handler_type
+            if not hdlr or len(hdlr.data) < 12 or bytes(hdlr.data[8:12]) != b"vide":
+                continue
+            stbl = trak.find("mdia/minf/stbl")
+            if not stbl:
+                continue
+            video = {}
+            stsd = stbl.find("stsd")
+            for entry in stsd.children if stsd else []:
+                if entry.type in self.VISUAL_SAMPLE_ENTRIES and len(entry.data) >= 28:
+                    video["codec"] = entry.type
+                    video["w"], video["h"] = struct.unpack_from(">HH", entry.data, 24)
+                    break
+            stsz = stbl.find("stsz")
+            if stsz and len(stsz.data) >= 12:
+                # full box: version/flags, sample_size, sample_count
+                video["frames"] = struct.unpack_from(">I", stsz.data, 8)[0]
+            return video
+        return None
+
+    def validate(self, info, video):
+        problems = []
+        if not video or "w" not in video:
+            return ["no video track"]
+
+        def get_rect(key):
+            rect = info.get(key)
+            if not isinstance(rect, list) or len(rect) != 4 or not all(isinstance(v, int) for v in rect):
+                problems.append(f"{key}={rect!r} is not [x, y, w, h]")
+                return None
+            return rect
+
+        video_w, video_h = info.get("videoW"), info.get("videoH")
+        if (video_w, video_h) != (video["w"], video["h"]):
+            problems.append(f"videoW/videoH={video_w}x{video_h}, stream is {video['w']}x{video['h']}")
+
+        rgb_frame = get_rect("rgbFrame")
+        alpha_frame = get_rect("aFrame")
+        for key, rect in (("rgbFrame", rgb_frame), ("aFrame", alpha_frame)):
+            if not rect:
+                continue
+            x, y, w, h = rect
+            if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > video["w"] or y + h > video["h"]:
+                problems.append(f"{key}={rect} is outside the {video['w']}x{video['h']} video")
+
+        if rgb_frame and (info.get("w"), info.get("h")) != (rgb_frame[2], rgb_frame[3]):
+            problems.append(f"w/h={info.get('w')}x{info.get('h')}, rgbFrame is {rgb_frame[2]}x{rgb_frame[3]}")
+
+        if rgb_frame and alpha_frame:
+            rx, ry, rw, rh = rgb_frame
+            ax, ay, aw, ah = alpha_frame
+            if rx < ax + aw and ax < rx + rw and ry < ay + ah and ay < ry + rh:
+                problems.append(f"aFrame={alpha_frame} overlaps rgbFrame={rgb_frame}")
+
+        frames = video.get("frames")
+        if frames is not None and info.get("f") != frames:
+            problems.append(f"f={info.get('f')}, stream has {frames} frames")
+
+        return problems
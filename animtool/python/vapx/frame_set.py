@@ -0,0 +1,38 @@
+from data.point_rect import PointRect
+
+
+class FrameSet:
+    """
+    Mask positions of every frame. Workers send their FrameObj back with the frame,
+    the build collects them in frame order.
+    """
+
+    def __init__(self):
+        self.frame_objs = []
+
+    def __str__(self):
+        return '"frame":[' + ",".join(str(frame_obj) for frame_obj in self.frame_objs) + "]"
+
+
+class FrameObj:
+
+    def __init__(self, frame_index=0):
+        self.frames = []
+        self.frame_index = frame_index
+
+    def __str__(self):
+        return f'{{"i":{self.frame_index},"obj":[' + ",".join(str(frame) for frame in self.frames) + "]}"
+
+
+class Frame:
+
+    def __init__(self):
+        self.src_id = ""
+        self.z = 0
+        self.mt = 0  # rotation, only 0 is supported
+        self.frame = PointRect()  # src position
+        self.m_frame = PointRect()  # mask area in the video
+
+    def __str__(self):
+        return (f'{{"srcId":"{self.src_id}","z":{self.z},"frame":{self.frame},'
+                f'"mFrame":{self.m_frame},"mt":{self.mt}}}')
@@ -0,0 +1,186 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from data.point_rect import PointRect
+from get_alpha_frame import GetAlphaFrame
+from utils.log import TLog
+from utils.trim_util import TrimUtil
+from vapx.frame_set import Frame, FrameObj
+
+
+class GetMaskFrame:
+    """
+    Fusion animation (vapx) masks: for every src, the mask frame's bounding box is packed into
+    the space the scaled alpha area leaves free, as gray = (255 - red) * alpha.
+    Same placement and pixels as the Java GetMaskFrame, with array ops instead of per-pixel loops.
+
+    Not thread safe, each frame worker owns one. src w/h is not touched here: workers may be
+    processes, the build updates it from the returned FrameObj (SrcSet.update_size).
+    """
+    TAG = "GetMaskFrame"
+
+    F255 = np.float32(255)
+
+    def __init__(self):
+        self.frame_stats = None  # FrameStats of the frame being built
+
+    def get_frame_obj(self, frame_index, common_arg, video_frame):
+        """
+        Write the masks of frame_index into video_frame (an AlphaFrameOut) and return their FrameObj,
+        None if no src has a mask in this frame.
+        """
+        # where the masks go
+        gap = common_arg.gap
+        if common_arg.is_v_layout:
+            x = common_arg.alpha_point.w + gap
+            y = common_arg.alpha_point.y
+        else:
+            x = common_arg.alpha_point.x
+            y = common_arg.alpha_point.h + gap
+        start_x = x
+        last_max_y = y
+
+        # the canvas is reused across frames: clear the masks of the previous frame
+        self.clear_area(video_frame, x, y, common_arg.output_w, common_arg.output_h)
+
+        frame_obj = FrameObj(frame_index)
+        for src in common_arg.src_set.srcs:
+            frame = self.get_frame(frame_index, src, video_frame, common_arg.output_w, common_arg.output_h,
+                                   x, y, start_x, last_max_y, common_arg.trim_rect)
+            if frame is None:
+                continue
+            # start of the next mask
+            x = frame.m_frame.x + frame.m_frame.w + gap
+            y = frame.m_frame.y
+            last_max_y = max(last_max_y, frame.m_frame.y + frame.m_frame.h + gap)
+
+            frame_obj.frames.append(frame)
+
+        if not frame_obj.frames:
+            return None
+        return frame_obj
+
+    def get_frame(self, frame_index, src, video_frame, out_w, out_h, x, y, start_x, last_max_y, trim_rect=None):
+        input_file = src.src_path + f"{frame_index:03d}.png"
+        if not os.path.exists(input_file):
+            return None
+
+        # trim: masks are cropped like the frames, so frame is relative to the trimmed rgb area
+        input_buf = TrimUtil.crop(self.load_image(input_file), trim_rect)
+        mask = np.asarray(input_buf)
+
+        frame = Frame()
+        frame.src_id = src.src_id
+        frame.z = src.z
+
+        frame.frame = self.get_src_frame_point(mask[..., 3])
+        if frame.frame is None:
+            # the file exists but is empty
+            return None
+
+        mask_point = PointRect(frame.frame.x, frame.frame.y, frame.frame.w, frame.frame.h)
+
+        m_frame = PointRect(x, y, frame.frame.w, frame.frame.h)
+        # does the mask fit
+        if m_frame.x + m_frame.w > out_w:  # too wide, next row
+            m_frame.x = start_x
+            m_frame.y = last_max_y
+            if m_frame.x + m_frame.w > out_w:
+                # still too wide, scale the mask down (float32 like the Java tool)
+                scale = np.float32(out_w - m_frame.x) / np.float32(m_frame.w)
+
+                m_frame.w = out_w - m_frame.x
+                m_frame.h = int(m_frame.h * scale)
+
+                mask_point.x = int(mask_point.x * scale)
+                mask_point.y = int(mask_point.y * scale)
+                mask_point.h = m_frame.h
+                mask_point.w = m_frame.w
+
+                mask = self.scale_mask(scale, input_buf)
+
+                TLog.w(self.TAG, f"frameIndex={frame_index},src={src.src_id}, no more space for(w){m_frame},scale={scale}")
+        if m_frame.y + m_frame.h > out_h:  # not enough height is an error
+            TLog.e(self.TAG, f"frameIndex={frame_index},src={src.src_id}, no more space(h){m_frame}")
+            return None
+        frame.m_frame = m_frame
+
+        self.fill_mask_to_output(video_frame, mask, mask_point, m_frame, out_w, out_h)
+        return frame
+
+    def load_image(self, input_file):
+        if self.frame_stats is None:
+            return self.decode_image(input_file)
+        with self.frame_stats.stage("frame.mask_decode"):
+            return self.decode_image(input_file)
+
+    @staticmethod
+    def decode_image(input_file):
+        with Image.open(input_file) as img:
+            img.load()
+            return img if img.mode == "RGBA" else img.convert("RGBA")
+
+    @staticmethod
+    def scale_mask(scale, input_buf):
+        """
+        The scaled mask at the top left of a transparent buffer of the original size, so the
+        (scaled) mask_point indexes it like the Java tool's AffineTransformOp output.
+        """
+        w, h = input_buf.size
+        scaled = input_buf.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.BILINEAR)
+        mask = np.zeros((h, w, 4), dtype=np.uint8)
+        mask[:scaled.height, :scaled.width] = np.asarray(scaled)
+        return mask
+
+    @staticmethod
+    def get_src_frame_point(alpha):
+        """
+        Bounding box of alpha > 0, None if the mask is empty.
+        """
+        cols = np.flatnonzero(alpha.any(axis=0))
+        if cols.size == 0:
+            return None
+        rows = np.flatnonzero(alpha.any(axis=1))
+        return PointRect(int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1))
+
+    def fill_mask_to_output(self, video_frame, mask, mask_point, m_frame, out_w, out_h):
+        region = mask[mask_point.y:mask_point.y + mask_point.h, mask_point.x:mask_point.x + mask_point.w]
+        # black does not cover, red does: gray = (255 - red) / 255 * alpha / 255 * 255,
+        # in float32 and truncated like the Java int cast so the pixels match exactly
+        gray = (
+            (self.F255 - region[..., 0].astype(np.float32)) / self.F255
+            * (region[..., 3].astype(np.float32) / self.F255) * self.F255
+        ).astype(np.uint8)
+        self.write_gray(video_frame, gray, m_frame.x, m_frame.y, out_w, out_h)
+
+    @staticmethod
+    def write_gray(video_frame, gray, x, y, out_w, out_h):
+        h, w = gray.shape
+        if video_frame.yuv is not None:
+            # gray has no chroma, U/V stay as they are
+            y_plane = GetMaskFrame.get_y_plane(video_frame, out_w, out_h)
+            y_plane[y:y + h, x:x + w] = GetAlphaFrame.GRAY_TO_Y[gray]
+        elif video_frame.array is not None:
+            video_frame.array[y:y + h, x:x + w, :3] = gray[..., None]
+        else:
+            opaque = np.full_like(gray, 255)
+            video_frame.image.paste(Image.fromarray(np.dstack((gray, gray, gray, opaque)), "RGBA"), (x, y))
+
+    @staticmethod
+    def clear_area(video_frame, x, y, out_w, out_h):
+        # everything right of / below (x, y) is mask space, back to opaque black
+        if video_frame.yuv is not None:
+            y_plane = GetMaskFrame.get_y_plane(video_frame, out_w, out_h)
+            y_plane[y:, x:] = 16
+        elif video_frame.array is not None:
+            video_frame.array[y:, x:, :3] = 0
+        else:
+            image = video_frame.image
+            image.paste((0, 0, 0, 255), (x, y, image.width, image.height))
+
+    @staticmethod
+    def get_y_plane(video_frame, out_w, out_h):
+        # planar I420: the Y plane is the first out_w * out_h bytes
+        return video_frame.yuv[:out_w * out_h].reshape(out_h, out_w)
@@ -0,0 +1,129 @@
+import os
+import json
+
+from utils.log import TLog
+
+
+class Src:
+    TAG = "Src"
+
+    SRC_TYPE_IMG = "img"
+    SRC_TYPE_TXT = "txt"
+
+    LOAD_TYPE_NET = "net"
+    LOAD_TYPE_LOC = "local"
+
+    TEXT_STYLE_DEFAULT = ""
+    TEXT_STYLE_BOLD = "b"
+
+    FIT_TYPE_FITXY = "fitXY"
+    FIT_TYPE_CF = "centerFull"  # same as centerCrop
+
+    def __init__(self):
+        # src config
+        self.src_id = ""
+        self.src_type = self.SRC_TYPE_IMG
+        self.load_type = self.LOAD_TYPE_NET
+        self.src_tag = ""
+        self.color = "#000000"
+        self.style = self.TEXT_STYLE_DEFAULT
+        self.w = 0
+        self.h = 0
+        self.fit_type = self.FIT_TYPE_FITXY
+
+        # src helper info
+        self.src_path = ""  # mask frames: src_path + %03d.png
+        self.z = 0  # render order, same as the input order
+
+    def __str__(self):
+        # same key order and formatting as the Java SrcSet.Src, players parse both
+        json_str = "{"
+        json_str += f'"srcId":"{self.src_id}",'
+        json_str += f'"srcType":"{self.src_type}",'
+        json_str += f'"srcTag":"{self.src_tag.strip()}",'
+        if self.src_type == self.SRC_TYPE_TXT:
+            if self.color is not None:
+                json_str += f'"color":"{self.color.strip()}",'
+            json_str += f'"style":"{self.style}",'
+            json_str += f'"loadType":"{self.LOAD_TYPE_LOC}",'
+        else:
+            json_str += f'"loadType":"{self.load_type}",'
+        json_str += f'"fitType":"{self.fit_type}",'
+        json_str += f'"w":{self.w},'
+        json_str += f'"h":{self.h}'
+        json_str += "}"
+        return json_str
+
+
+class SrcSet:
+    TAG = "SrcSet"
+
+    # src json file keys -> (Src attribute, allowed values or None)
+    SRC_FIELDS = {
+        "srcPath": ("src_path", None),
+        "srcType": ("src_type", (Src.SRC_TYPE_IMG, Src.SRC_TYPE_TXT)),
+        "srcTag": ("src_tag", None),
+        "loadType": ("load_type", (Src.LOAD_TYPE_NET, Src.LOAD_TYPE_LOC)),
+        "fitType": ("fit_type", (Src.FIT_TYPE_FITXY, Src.FIT_TYPE_CF)),
+        "color": ("color", None),
+        "style": ("style", (Src.TEXT_STYLE_DEFAULT, Src.TEXT_STYLE_BOLD)),
+    }
+
+    def __init__(self):
+        self.srcs = []
+
+    def update_size(self, frame_obj):
+        """
+        src w/h is the largest mask of all frames. Like the Java tool only the width decides,
+        so w and h always come from the same frame; called in frame order.
+        """
+        for frame in frame_obj.frames:
+            src = self.srcs[frame.z]
+            if frame.frame.w > src.w:
+                src.w = frame.frame.w
+                src.h = frame.frame.h
+
+    @staticmethod
+    def load(src_file):
+        """
+        SrcSet from a json file, a list of srcs in z order:
+
+            [{"srcPath": "mask1", "srcType": "img", "srcTag": "head1", "fitType": "centerFull"},
+             {"srcPath": "mask2", "srcType": "txt", "srcTag": "text1", "color": "#0000ff", "style": "b"}]
+
+        Relative srcPath is relative to the json file. Returns None if the file is invalid.
+        """
+        try:
+            with open(src_file, "r") as f:
+                items = json.load(f)
+        except Exception as e:
+            TLog.e(SrcSet.TAG, f"read src file error: {e}")
+            return None
+
+        if not isinstance(items, list):
+            TLog.e(SrcSet.TAG, f"{src_file}: expected a list of srcs")
+            return None
+
+        src_set = SrcSet()
+        base_dir = os.path.dirname(os.path.abspath(src_file))
+        for i, item in enumerate(items):
+            if not isinstance(item, dict) or not item.get("srcPath"):
+                TLog.e(SrcSet.TAG, f"src {i}: srcPath is required")
+                return None
+            src = Src()
+            for key, value in item.items():
+                field = SrcSet.SRC_FIELDS.get(key)
+                if field is None:
+                    TLog.e(SrcSet.TAG, f"src {i}: unknown field '{key}'")
+                    return None
+                attr, allowed = field
+                if allowed is not None and value not in allowed:
+                    TLog.e(SrcSet.TAG, f"src {i}: {key}={value!r}, expected one of {allowed}")
+                    return None
+                setattr(src, attr, str(value))
+            src.src_path = os.path.join(base_dir, src.src_path)
+            src_set.srcs.append(src)
+        return src_set
+
+    def __str__(self):
+        return '"src":[' + ",".join(str(src) for src in self.srcs) + "]"
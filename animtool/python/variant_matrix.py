@@ -0,0 +1,137 @@
+import os
+import copy
+import json
+
+from utils.log import TLog
+
+
+class Variant:
+    """
+    One encode of a variant matrix: codec, rate control and fps. Everything else (layout,
+    frames, audio) comes from the build's CommonArg.
+    """
+
+    def __init__(self, name, enable_h265, enable_crf, bitrate, crf, fps):
+        self.name = name
+        self.enable_h265 = enable_h265
+        self.enable_crf = enable_crf
+        self.bitrate = bitrate
+        self.crf = crf
+        self.fps = fps
+
+    def create_common_arg(self, common_arg):
+        """
+        Copy of the (checked) CommonArg that encodes this variant into output_path/variants/<name>/.
+        Frames are shared: frame_output_path still points at the build's frames dir.
+        """
+        variant_arg = copy.copy(common_arg)
+        variant_arg.enable_h265 = self.enable_h265
+        variant_arg.enable_crf = self.enable_crf
+        variant_arg.bitrate = self.bitrate
+        variant_arg.crf = self.crf
+        variant_arg.fps = self.fps
+        variant_arg.output_path = os.path.join(common_arg.output_path, VariantMatrix.VARIANTS_DIR, self.name)
+        return variant_arg
+
+    def __repr__(self):
+        return f"Variant({self.name})"
+
+
+class VariantMatrix:
+    """
+    codec x rate x fps, each a comma separated list (CommonArg.variant_codecs / variant_rates / variant_fps):
+
+        codecs: h264,h265
+        rates:  15000,8000,crf28  (kbps, or crf<n>)
+        fps:    25,30
+
+    A list that is left empty uses the build's own setting. Frames are composited once for all variants.
+    """
+    TAG = "VariantMatrix"
+    VARIANTS_DIR = "variants"
+    REPORT_FILE = "variants.json"
+    CODECS = {"h264": False, "h265": True}
+
+    STATUS_OK = "ok"
+    STATUS_FAILED = "failed"
+
+    @staticmethod
+    def is_enabled(common_arg):
+        return bool(common_arg.variant_codecs or common_arg.variant_rates or common_arg.variant_fps)
+
+    @staticmethod
+    def split(spec):
+        return [v.strip().lower() for v in str(spec).split(",") if v.strip()]
+
+    @staticmethod
+    def create(common_arg):
+        """
+        All variants of the matrix, None if a value can not be used.
+        """
+        codecs = VariantMatrix.split(common_arg.variant_codecs) or ["h265" if common_arg.enable_h265 else "h264"]
+        rates = VariantMatrix.split(common_arg.variant_rates) or [
+            f"crf{common_arg.crf}" if common_arg.enable_crf else str(common_arg.bitrate)
+        ]
+        fps_list = VariantMatrix.split(common_arg.variant_fps) or [str(common_arg.fps)]
+
+        variants = []
+        try:
+            for codec in codecs:
+                if codec not in VariantMatrix.CODECS:
+                    raise ValueError(f"codec '{codec}', expected one of {', '.join(VariantMatrix.CODECS)}")
+                for rate in rates:
+                    enable_crf, bitrate, crf = VariantMatrix.parse_rate(rate, common_arg)
+                    for fps in fps_list:
+                        fps = int(fps)
+                        if fps <= 0:
+                            raise ValueError(f"fps={fps}")
+                        rate_name = f"crf{crf}" if enable_crf else f"{bitrate}k"
+                        variants.append(Variant(
+                            f"{codec}_{rate_name}_{fps}fps", VariantMatrix.CODECS[codec], enable_crf, bitrate, crf, fps
+                        ))
+        except ValueError as e:
+            TLog.e(VariantMatrix.TAG, f"variant matrix: {e}")
+            return None
+
+        names = [v.name for v in variants]
+        if len(set(names)) != len(names):
+            TLog.e(VariantMatrix.TAG, f"variant matrix has duplicates: {names}")
+            return None
+        return variants
+
+    @staticmethod
+    def parse_rate(rate, common_arg):
+        """
+        (enable_crf, bitrate, crf) for "15000" / "15000k" or "crf28".
+        """
+        if rate.startswith("crf"):
+            crf = int(rate[3:])
+            if crf < 0 or crf > 51:
+                raise ValueError(f"crf={crf}, no in [0, 51]")
+            return True, common_arg.bitrate, crf
+        bitrate = int(rate.rstrip("k"))
+        if bitrate <= 0:
+            raise ValueError(f"bitrate={bitrate}")
+        return False, bitrate, common_arg.crf
+
+    @staticmethod
+    def get_result(variant, variant_arg, success, md5):
+        return {
+            "name": variant.name,
+            "codec": "h265" if variant.enable_h265 else "h264",
+            "bitrate": None if variant.enable_crf else variant.bitrate,
+            "crf": variant.crf if variant.enable_crf else None,
+            "fps": variant.fps,
+            "output": variant_arg.output_path,
+            "status": VariantMatrix.STATUS_OK if success else VariantMatrix.STATUS_FAILED,
+            "md5": md5 if success else None,
+        }
+
+    @staticmethod
+    def save_report(output_path, results):
+        report_file = os.path.join(output_path, VariantMatrix.REPORT_FILE)
+        tmp_file = report_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(results, f, indent=2)
+        os.replace(tmp_file, report_file)
+        return report_file